@@ -0,0 +1,122 @@
+"""
+Aggregator: Rolls readings up into fixed time windows before they go to the database.
+
+With aggregate_window set (seconds, in [General]), the daemon sends the database one row per sensor per
+window instead of every reading, so a sensor can be sampled every second without multiplying the rows sent
+to the central server. The local CSV log and binary store still get every raw reading.
+
+Windows are aligned to the clock (a 60 second window runs from :00 to :00), and each sensor field keeps only
+a running count and sum. Only the mean is kept because the database table has a single sensor_value per row.
+A window is closed when a reading for a later window arrives, or once the clock passes its end. A closed
+window comes out as a reading object like the ones the sensors return, with:
+    reading          the mean of the window's readings, rounded to one decimal like the sensors' readings
+    window_start, window_end, time    epoch seconds (time is the end)
+    reading_time     the window's end as a UTC time string, used as the database row's time
+A window closed early (by flush() or setWindow()) ends when it was closed, so the window that picks up the
+rest of that period gets a different reading_time and isn't taken for a duplicate row.
+Readings with no value (failed or timed out reads) aren't counted. A window with no good readings makes no row.
+
+With aggregate_window = 0 readings pass straight through.
+"""
+
+import time
+
+# Window: The running totals for one field in one window
+class Window:
+    __slots__ = ("start", "end", "count", "total", "reading")
+
+    def __init__(self, start, end, reading, value):
+        self.start = start
+        self.end = end
+        self.count = 1
+        self.total = value
+        self.reading = reading     # The latest reading object, for the description, type, sort, etc.
+
+    def add(self, reading, value):
+        self.count += 1
+        self.total += value
+        self.reading = reading
+
+    # Returns the window as a reading object. closedAt is when a window closed before its end; it's kept
+    # inside the window, so a clock that stepped back can't stamp the row before the window started.
+    def result(self, closedAt=None):
+        end = self.end if closedAt is None else max(self.start, min(self.end, closedAt))
+        result = dict(self.reading)
+        result.update({
+            "reading": str(round(self.total / self.count, 1)),
+            "window_start": self.start,
+            "window_end": end,
+            "time": end,
+            "reading_time": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(end)),
+            "error": None
+        })
+        return result
+
+
+# Aggregator: The open windows of every field, and the closed ones waiting to be written
+class Aggregator:
+    def __init__(self, window=0.0, clock=time.time):
+        self.window = window
+        self.clock = clock
+        self.windows = {}     # {field_name: Window}
+        self.finished = []    # Closed windows (as reading objects) not yet handed out
+
+    # Adds readings and returns the reading objects that are ready for the database: the readings
+    # themselves when aggregation is off, otherwise every window that has closed.
+    def add(self, readings, now=None):
+        if self.window <= 0:
+            finished, self.finished = self.finished + list(readings), []
+            return finished
+
+        for reading in readings:
+            if reading["reading"] is None:
+                continue
+            try:
+                value = float(reading["reading"])
+            except (TypeError, ValueError):
+                continue
+            fieldName = reading["field_name"]
+            start = reading["time"] - reading["time"] % self.window
+            window = self.windows.get(fieldName)
+            if window is not None and window.start == start:
+                window.add(reading, value)
+                continue
+            if window is not None:
+                self.finished.append(window.result())
+            self.windows[fieldName] = Window(start, start + self.window, reading, value)
+
+        return self.due(now)
+
+    # Closes the windows that ended by now and returns everything that's ready
+    def due(self, now=None):
+        if now is None:
+            now = self.clock()
+        for fieldName, window in list(self.windows.items()):
+            if window.end <= now:
+                self.finished.append(window.result())
+                del self.windows[fieldName]
+        finished, self.finished = self.finished, []
+        return finished
+
+    # Closes every window, finished or not (at shutdown), and returns everything that's ready
+    def flush(self):
+        now = self.clock()
+        self.finished.extend(window.result(now) for window in self.windows.values())
+        self.windows = {}
+        finished, self.finished = self.finished, []
+        return finished
+
+    # Changes the window length. Windows already open are closed early and handed out by the next add().
+    def setWindow(self, seconds):
+        if seconds == self.window:
+            return
+        now = self.clock()
+        self.finished.extend(window.result(now) for window in self.windows.values())
+        self.windows = {}
+        self.window = seconds
+
+# ==================================================================================================
+# getAggregator() - Returns an Aggregator for aggregate_window in [General] (seconds, default 0: off)
+# ==================================================================================================
+def getAggregator(rpgConfig):
+    return Aggregator(rpgConfig.getfloat("aggregate_window", defaultVal=0.0))
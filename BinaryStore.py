@@ -0,0 +1,229 @@
+"""
+BinaryStore and BinaryReader: A compact, append-only store of readings next to the CSV log.
+
+Each reading is a fixed-width 16 byte record: the epoch time (float64), the sensor id (uint32) and the
+value (float32), little-endian. Records are written in blocks, one block per write() call. Each block starts
+with a 16 byte header: the magic bytes "RPGB", the number of records, a CRC32 of the count and the records,
+and 4 spare bytes. Headers and records are the same size, so records stay 16-byte aligned in the file.
+
+Files are split by UTC day (readings-YYYYMMDD.bin). Sensor ids are kept in sensors.json in the same
+directory ({"field_name": id}); an id is saved there before any record uses it.
+
+After a power loss only the last block can be damaged. Opening a day's file for appending checks the block
+headers and CRCs from the start and cuts the file back to the last good block.
+
+BinaryReader memory-maps a day's file. blocks() returns one NumPy structured array per block (fields time,
+sensor and value) that points straight into the mapped file, without copying. NumPy is only needed for that;
+records() works without it.
+"""
+
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import atexit
+import threading
+import traceback
+
+MAGIC = b"RPGB"
+HEADER = struct.Struct("<4sIII")       # magic, record count, crc32, spare
+RECORD = struct.Struct("<dIf")         # epoch time, sensor id, value
+RECORD_SIZE = RECORD.size              # 16, the same as HEADER.size
+SENSOR_FILE = "sensors.json"
+
+# Returns the CRC stored in a block's header
+def blockCrc(count, records):
+    return zlib.crc32(records, zlib.crc32(struct.pack("<I", count))) & 0xffffffff
+
+# Walks the blocks in a buffer. Returns a list of (records offset, record count) for the good blocks, and
+# the offset just past the last good block (where appending should continue).
+def scanBlocks(buffer):
+    blocks = []
+    offset = 0
+    size = len(buffer)
+    while offset + HEADER.size <= size:
+        magic, count, crc, spare = HEADER.unpack_from(buffer, offset)
+        end = offset + HEADER.size + count * RECORD_SIZE
+        if magic != MAGIC or count == 0 or end > size:
+            break
+        if blockCrc(count, buffer[offset + HEADER.size:end]) != crc:
+            break
+        blocks.append((offset + HEADER.size, count))
+        offset = end
+    return blocks, offset
+
+def dayFileName(storeDir, epoch):
+    return os.path.join(storeDir, time.strftime("readings-%Y%m%d.bin", time.gmtime(epoch)))
+
+# Reads the sensor id file. Returns {field_name: id}.
+def loadSensorIds(storeDir):
+    try:
+        with open(os.path.join(storeDir, SENSOR_FILE)) as sensorFile:
+            return json.load(sensorFile)
+    except FileNotFoundError:
+        return {}
+
+
+# BinaryStore: Appends readings to the day's file
+class BinaryStore:
+    def __init__(self, storeDir, fsync=False):
+        self.storeDir = storeDir
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.sensorIds = None
+        self.fileName = None
+        self.fd = None
+
+    # Opens a day's file for appending, cutting off a damaged last block
+    def open(self, fileName):
+        self.close()
+        fd = os.open(fileName, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        size = os.fstat(fd).st_size
+        if size > 0:
+            with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as mapped:
+                blocks, goodSize = scanBlocks(mapped)
+            if goodSize < size:
+                print("!!! %s: dropping %d damaged bytes at the end" % (fileName, size - goodSize))
+                os.ftruncate(fd, goodSize)
+        self.fd = fd
+        self.fileName = fileName
+
+    # Returns the id of a sensor, saving a new id first if it doesn't have one yet
+    def sensorId(self, fieldName):
+        sensorId = self.sensorIds.get(fieldName)
+        if sensorId is None:
+            sensorId = max(self.sensorIds.values(), default=0) + 1
+            self.sensorIds[fieldName] = sensorId
+            fileName = os.path.join(self.storeDir, SENSOR_FILE)
+            with open(fileName + ".tmp", "w") as sensorFile:
+                json.dump(self.sensorIds, sensorFile, indent=1, sort_keys=True)
+                sensorFile.flush()
+                os.fsync(sensorFile.fileno())
+            os.replace(fileName + ".tmp", fileName)
+        return sensorId
+
+    # Appends one block with a record for each reading that has a value. Returns the number of bytes written.
+    def write(self, readings):
+        with self.lock:
+            if self.sensorIds is None:
+                os.makedirs(self.storeDir, exist_ok=True)
+                self.sensorIds = loadSensorIds(self.storeDir)
+
+            values = []
+            for reading in readings:
+                if reading["reading"] is None:
+                    continue
+                try:
+                    value = float(reading["reading"])
+                except (TypeError, ValueError):
+                    continue
+                values.append((reading["time"], self.sensorId(reading["field_name"]), value))
+            if not values:
+                return 0
+
+            block = bytearray(HEADER.size + len(values) * RECORD_SIZE)
+            for i, record in enumerate(values):
+                RECORD.pack_into(block, HEADER.size + i * RECORD_SIZE, *record)
+            HEADER.pack_into(block, 0, MAGIC, len(values), blockCrc(len(values), block[HEADER.size:]), 0)
+
+            fileName = dayFileName(self.storeDir, values[0][0])
+            if fileName != self.fileName:
+                self.open(fileName)
+            os.write(self.fd, block)     # One write per block; O_APPEND keeps it at the end
+            if self.fsync:
+                os.fsync(self.fd)
+            return len(block)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.fileName = None
+
+
+# BinaryReader: Reads the store, including the file being written to
+class BinaryReader:
+    def __init__(self, storeDir):
+        self.storeDir = storeDir
+
+    # The day files in the store, oldest first
+    def files(self):
+        return sorted(os.path.join(self.storeDir, name) for name in os.listdir(self.storeDir)
+                      if name.startswith("readings-") and name.endswith(".bin"))
+
+    # {id: field_name}
+    def sensorNames(self):
+        return dict((sensorId, fieldName) for fieldName, sensorId in loadSensorIds(self.storeDir).items())
+
+    # Maps a file into memory. Returns (mmap, [(records offset, record count), ...]); the caller closes the mmap.
+    def mapFile(self, fileName):
+        with open(fileName, "rb") as dataFile:
+            size = os.fstat(dataFile.fileno()).st_size
+            if size == 0:
+                return None, []
+            mapped = mmap.mmap(dataFile.fileno(), size, access=mmap.ACCESS_READ)
+        blocks, goodSize = scanBlocks(mapped)
+        return mapped, blocks
+
+    # Returns one NumPy structured array per block, each a view into the mapped file (no copy).
+    # The arrays stay valid for as long as they're referenced.
+    def blocks(self, fileName):
+        import numpy   # Only needed here
+        dtype = numpy.dtype([("time", "<f8"), ("sensor", "<u4"), ("value", "<f4")])
+        mapped, blocks = self.mapFile(fileName)
+        return [numpy.frombuffer(mapped, dtype=dtype, count=count, offset=offset) for offset, count in blocks]
+
+    # Returns all of a file's records as one NumPy structured array (this one is a copy)
+    def array(self, fileName):
+        import numpy
+        blocks = self.blocks(fileName)
+        if not blocks:
+            return numpy.zeros(0, dtype=[("time", "<f8"), ("sensor", "<u4"), ("value", "<f4")])
+        return numpy.concatenate(blocks)
+
+    # Yields (time, sensor id, value) for each record in a file, without NumPy
+    def records(self, fileName):
+        mapped, blocks = self.mapFile(fileName)
+        if mapped is None:
+            return
+        try:
+            for offset, count in blocks:
+                for record in RECORD.iter_unpack(mapped[offset:offset + count * RECORD_SIZE]):
+                    yield record
+        finally:
+            mapped.close()
+
+
+# The process's open stores, by directory
+binaryStores = {}
+binaryStoresLock = threading.Lock()
+
+# ==================================================================================================
+# getStore() - Returns the store for binary_dir in [General] (None if it isn't set). Options:
+#    binary_dir    directory for the day files and sensors.json
+#    binary_fsync  fsync after each block (default false)
+# ==================================================================================================
+def getStore(rpgConfig):
+    storeDir = rpgConfig.get("binary_dir")
+    if not storeDir:
+        return None
+    with binaryStoresLock:
+        store = binaryStores.get(storeDir)
+        if store is None:
+            store = binaryStores[storeDir] = BinaryStore(storeDir, fsync=rpgConfig.getboolean("binary_fsync", defaultVal=False))
+        return store
+
+def closeAll():
+    with binaryStoresLock:
+        stores = list(binaryStores.values())
+        binaryStores.clear()
+    for store in stores:
+        try:
+            with store.lock:
+                store.close()
+        except Exception:
+            print(traceback.format_exc())
+
+atexit.register(closeAll)
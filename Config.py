@@ -2,29 +2,78 @@
 RpgConfig and subclasses, SensorConfig, ClockSensorConfig, DhtSensorConfig, and McpSensorConfig:
 Provides a facade in front of Python's configparser module to handle configuration persistent settings
 
+Each SensorConfig also holds a snapshot (SensorSettings and subclasses): an immutable object with __slots__ that
+holds the section's options already converted to their types. Sensors read their settings from cfg.snapshot in
+the hot loop, so a read is a plain attribute load with no configparser lookup, interpolation or int() call.
+The snapshot is rebuilt only when one of the section's options actually changes.
+
 WHile there is a singleton parserInstance which holds information regarding the entire config file, an
 RpgConfig instance represents a single section within the configparser.  Options within that section can be
 read and written using . notation (myConfig.sort, for example).
 
-Any time an option's value is changed, it is immediately saved to the configparser's .ini file.
+Any time an option's value is changed, it is saved to the configparser's .ini file. By default that happens
+immediately. With RpgConfig.setFlushInterval(seconds) (write-behind mode) a change only marks the parser dirty,
+and the file is rewritten at most once per interval, when RpgConfig.flush() is called, and when the process
+exits. Every save writes a temporary file and renames it into place, so the .ini file is never left half written.
+Changes and saves hold a lock, so sensors on different threads can update their sections safely.
+
+Long-running processes can pick up edits to the .ini files without restarting: RpgConfig.checkForChanges()
+compares each file's modification time and size with the ones recorded when it was last read or written, and
+if someone else changed it, reparses it and copies only the sections that differ into parserInstance. It returns
+the names of those sections so the caller can rebuild just the objects that use them.
+
+If ConfigPlan.usePlan() found a valid compiled plan, RpgConfig objects read their values from the plan's
+PlanSection dictionaries, and the .ini file is only parsed the first time an option has to be changed.
 """
 
 import configparser
+import os
 import sys
+import time
+import atexit
+import threading
 from os import path
 import traceback
 
+# PlanSection: A section's values from a compiled plan (see ConfigPlan.py). Like the configparser,
+# option names aren't case sensitive.
+class PlanSection(dict):
+    def __contains__(self, key):
+        return dict.__contains__(self, key.lower())
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self, key.lower())
+
+    def get(self, key, default=None):
+        return dict.get(self, key.lower(), default)
+
 class RpgConfig:
-    RPGARDEN_CONFIG_FILE = "/home/pi/code/rpgarden/rpgarden.ini"
+    # The RPGARDEN_CONFIG_FILE and RPGARDEN_PRIVATE_FILE environment variables override the default paths
+    RPGARDEN_CONFIG_FILE = os.environ.get("RPGARDEN_CONFIG_FILE", "/home/pi/code/rpgarden/rpgarden.ini")
 
     # The private file is another configuration file that's not stored in GitHub for holding passwords and 
     # other private info
     # It has one section called: [Private]
     # It's options are accessible as yourRpgConfigVariable.private['your_option_name']
-    RPGARDEN_PRIVATE_FILE = "/home/pi/.rpgarden/rpgarden.ini"
+    RPGARDEN_PRIVATE_FILE = os.environ.get("RPGARDEN_PRIVATE_FILE", "/home/pi/.rpgarden/rpgarden.ini")
 
     parserInstance = None # We want all updates to go through the class singleton variable, parserInstance
     privateInstance = None # The private file is read-only, as far as this module is concerned
+    parserFile = None     # The file parserInstance was loaded from and is saved to
+
+    # Write-behind state, shared by all instances
+    saveLock = threading.RLock()  # Held while changing parserInstance or saving it
+    flushInterval = 0.0           # 0 saves on every change; otherwise the most often the file is rewritten
+    dirty = False                 # parserInstance has changes that aren't in the file yet
+    lastSave = 0.0                # time.monotonic() of the last save
+    flushTimer = None             # Pending timer that will save the dirty parser
+
+    # Change detection state
+    fileStats = {}                # (mtime in ns, size) of each file when we last read or wrote it
+    pendingChanges = set()        # Sections merged in from the file by a save, not yet returned by checkForChanges()
+
+    # Values compiled from the .ini file by ConfigPlan.py, used until the parser is needed
+    planSections = {}             # {section name: PlanSection of interpolated values}
 
     def __init__(self, sectionName="General", cfgFile=RPGARDEN_CONFIG_FILE):
         # self.configFile = cfgFile              # Initialize instance members
@@ -32,34 +81,252 @@ class RpgConfig:
         self.__dict__["configFile"] = cfgFile
         self.__dict__["sectionName"] = sectionName
         self.__dict__["section"] = None
-        self.__dict__["private"] = None
-
-        if not RpgConfig.parserInstance:                            # If parser hasn't already been initialized
-            RpgConfig.parserInstance = configparser.ConfigParser()  # Create ConfigParser object
-            RpgConfig.privateInstance = configparser.ConfigParser()  # Create ConfigParser object
-
-            if path.exists(cfgFile):                                # If the ini file exists
-                RpgConfig.parserInstance.read(cfgFile)              # Load its data from the file
-            else:
-                RpgConfig.parserInstance.add_section(sectionName)   # It's a new ini file. Add the section and
-                self.save()                                         # Write out the ini file
-
-            # Load up the private config file, if it exists
-            if path.exists(RpgConfig.RPGARDEN_PRIVATE_FILE):             # If the PRIVATE ini file exists
-                RpgConfig.privateInstance.read(RpgConfig.RPGARDEN_PRIVATE_FILE) # Load its data from the file
-                self.__dict__["private"] = RpgConfig.privateInstance['Private']
-
-        if not sectionName in RpgConfig.parserInstance:             # Existing ini file, but new section
-            RpgConfig.parserInstance.add_section(sectionName)       # Add the section and save
-            self.save()
-        
+
+        # With a compiled plan, read the values straight from it. The .ini file is only parsed once
+        # something needs to change it (see attachParser()).
+        if not RpgConfig.parserInstance and sectionName in RpgConfig.planSections:
+            RpgConfig.parserFile = cfgFile
+            self.__dict__["section"] = RpgConfig.planSections[sectionName]
+        else:
+            self.attachParser()
+
+    # Loads the .ini file into the parser singleton, if that hasn't been done yet
+    @staticmethod
+    def loadParser(cfgFile):
+        with RpgConfig.saveLock:
+            if not RpgConfig.parserInstance:                            # If parser hasn't already been initialized
+                RpgConfig.parserFile = cfgFile
+                parser = configparser.ConfigParser()                    # Create ConfigParser object
+                if path.exists(cfgFile):                                # If the ini file exists
+                    RpgConfig.recordStat(cfgFile)
+                    parser.read(cfgFile)                                # Load its data from the file
+                RpgConfig.parserInstance = parser
+
+    # Loads the private file, if it exists, the first time it's needed. Returns its [Private] section or None.
+    @staticmethod
+    def loadPrivate():
+        with RpgConfig.saveLock:
+            if RpgConfig.privateInstance is None:
+                privateParser = configparser.ConfigParser()             # Create ConfigParser object
+                if path.exists(RpgConfig.RPGARDEN_PRIVATE_FILE):        # If the PRIVATE ini file exists
+                    RpgConfig.recordStat(RpgConfig.RPGARDEN_PRIVATE_FILE)
+                    privateParser.read(RpgConfig.RPGARDEN_PRIVATE_FILE) # Load its data from the file
+                RpgConfig.privateInstance = privateParser
+
+            if RpgConfig.privateInstance.has_section('Private'):
+                return RpgConfig.privateInstance['Private']
+            return None
+
+    # Points this object at its section in the parser, loading the parser and adding the section if needed
+    def attachParser(self):
+        RpgConfig.loadParser(self.configFile)
+
+        with RpgConfig.saveLock:
+            if not self.sectionName in RpgConfig.parserInstance:    # Existing ini file, but new section
+                RpgConfig.parserInstance.add_section(self.sectionName)  # Add the section and save
+                self.markDirty()
+
         # After this, changes to self.section will automagically change the original configparser
-        self.__dict__["section"] = RpgConfig.parserInstance[sectionName]
+        self.__dict__["section"] = RpgConfig.parserInstance[self.sectionName]
+
+    # Returns the section's values: the plan's PlanSection until the parser has been loaded, then the parser's section
+    def sectionData(self):
+        if type(self.section) is PlanSection and RpgConfig.parserInstance:
+            self.attachParser()
+        return self.section
+
+    # Returns a section's values without creating an RpgConfig object for it
+    @staticmethod
+    def sectionValues(sectionName):
+        if not RpgConfig.parserInstance and sectionName in RpgConfig.planSections:
+            return RpgConfig.planSections[sectionName]
+        RpgConfig.loadParser(RpgConfig.parserFile or RpgConfig.RPGARDEN_CONFIG_FILE)
+        if RpgConfig.parserInstance.has_section(sectionName):
+            return RpgConfig.parserInstance[sectionName]
+        return PlanSection()
+
+    # Starts using a compiled plan (see ConfigPlan.py) instead of parsing the .ini file
+    @staticmethod
+    def usePlan(cfgFile, sections, fileStat):
+        with RpgConfig.saveLock:
+            RpgConfig.parserFile = cfgFile
+            RpgConfig.planSections = dict((name, PlanSection(values)) for name, values in sections.items())
+            RpgConfig.fileStats[cfgFile] = fileStat
 
     # saves the current state of the entire configparser object to the ini file
     def save(self):
-        with open(self.configFile, 'w') as configfile:          # Write out the ini file
-            RpgConfig.parserInstance.write(configfile)
+        RpgConfig.writeFile(self.configFile)
+
+    # Writes the parser to a temporary file next to the ini file, then renames it into place
+    @staticmethod
+    def writeFile(fileName):
+        with RpgConfig.saveLock:
+            # Don't overwrite someone else's edits: merge them in first
+            if fileName == RpgConfig.parserFile and RpgConfig.fileChanged(fileName):
+                RpgConfig.pendingChanges |= RpgConfig.mergeFile(fileName)
+
+            tempName = fileName + ".tmp"
+            with open(tempName, 'w') as configfile:             # Write out the ini file
+                RpgConfig.parserInstance.write(configfile)
+                configfile.flush()
+                os.fsync(configfile.fileno())
+            os.replace(tempName, fileName)
+            RpgConfig.recordStat(fileName)
+
+            RpgConfig.dirty = False
+            RpgConfig.lastSave = time.monotonic()
+            if RpgConfig.flushTimer is not None:
+                RpgConfig.flushTimer.cancel()
+                RpgConfig.flushTimer = None
+
+    # Records that the parser has changed. Saves right away, or in write-behind mode schedules a save
+    # for when the flush interval has passed since the last one.
+    def markDirty(self):
+        with RpgConfig.saveLock:
+            RpgConfig.dirty = True
+            if RpgConfig.flushInterval <= 0:
+                self.save()
+            elif RpgConfig.flushTimer is None:
+                delay = max(RpgConfig.lastSave + RpgConfig.flushInterval - time.monotonic(), 0.0)
+                RpgConfig.flushTimer = threading.Timer(delay, RpgConfig.flush)
+                RpgConfig.flushTimer.daemon = True
+                RpgConfig.flushTimer.start()
+
+    # Saves the parser if it has unsaved changes
+    @staticmethod
+    def flush():
+        with RpgConfig.saveLock:
+            if RpgConfig.dirty and RpgConfig.parserInstance is not None:
+                try:
+                    RpgConfig.writeFile(RpgConfig.parserFile)
+                except Exception as ex:
+                    print(traceback.format_exc())
+
+    # Turns write-behind mode on (interval in seconds) or off (0). Unsaved changes are flushed at exit.
+    @staticmethod
+    def setFlushInterval(interval):
+        with RpgConfig.saveLock:
+            if interval > 0 and RpgConfig.flushInterval <= 0:
+                atexit.register(RpgConfig.flush)
+            RpgConfig.flushInterval = interval
+        if interval <= 0:
+            RpgConfig.flush()
+
+    # Returns (mtime in ns, size) of a file, or None if it doesn't exist
+    @staticmethod
+    def fileStat(fileName):
+        try:
+            fileInfo = os.stat(fileName)
+            return (fileInfo.st_mtime_ns, fileInfo.st_size)
+        except OSError:
+            return None
+
+    @staticmethod
+    def recordStat(fileName):
+        RpgConfig.fileStats[fileName] = RpgConfig.fileStat(fileName)
+
+    # True if the file was changed (by someone else) since we last read or wrote it
+    @staticmethod
+    def fileChanged(fileName):
+        return RpgConfig.fileStat(fileName) != RpgConfig.fileStats.get(fileName)
+
+    # Returns a section's options as raw (uninterpolated) strings
+    @staticmethod
+    def rawOptions(parser, sectionName):
+        return dict((key, parser.get(sectionName, key, raw=True)) for key in parser.options(sectionName))
+
+    # Reparses a config file and copies the sections that differ from parserInstance into it. Edits in the
+    # file win over unsaved changes to the same section. Sections missing from the file are left alone.
+    # Returns the names of the sections that were added or changed.
+    @staticmethod
+    def mergeFile(fileName):
+        changed = set()
+        with RpgConfig.saveLock:
+            RpgConfig.recordStat(fileName)      # Before reading, so a change made while we read is seen next time
+            newParser = configparser.ConfigParser()
+            try:
+                newParser.read(fileName)
+            except configparser.Error as ex:
+                print("!!! Not reloading " + fileName + ", it has errors:")
+                print(ex)
+                return changed
+
+            # Options are changed in place, new values before old ones are removed, so a thread reading an
+            # option without the lock (the sink workers, say) gets the old value or the new one, never None
+            parser = RpgConfig.parserInstance
+            oldDefaults = dict(parser.items(configparser.DEFAULTSECT, raw=True))
+            newDefaults = dict(newParser.items(configparser.DEFAULTSECT, raw=True))
+            defaultsChanged = newDefaults != oldDefaults
+            for key, value in newDefaults.items():
+                parser.set(configparser.DEFAULTSECT, key, value)
+
+            for sectionName in newParser.sections():
+                newOptions = RpgConfig.rawOptions(newParser, sectionName)
+                if not parser.has_section(sectionName):
+                    parser.add_section(sectionName)
+                elif not defaultsChanged and RpgConfig.rawOptions(parser, sectionName) == newOptions:
+                    continue
+                # Existing RpgConfig objects find their section by name, so they see the new options
+                oldKeys = set(RpgConfig.rawOptions(parser, sectionName))
+                for key, value in newOptions.items():
+                    if newDefaults.get(key) != value:
+                        parser.set(sectionName, key, value)
+                    else:
+                        parser.remove_option(sectionName, key)    # The default has the same value
+                for key in oldKeys - set(newOptions):
+                    parser.remove_option(sectionName, key)
+                changed.add(sectionName)
+
+            for key in set(oldDefaults) - set(newDefaults):
+                parser.remove_option(configparser.DEFAULTSECT, key)
+        return changed
+
+    # Checks whether the config file or the private file changed on disk since they were last read or written,
+    # and merges in the changes. Returns the set of section names that changed ("Private" for the private file).
+    @staticmethod
+    def checkForChanges():
+        with RpgConfig.saveLock:
+            changed = RpgConfig.pendingChanges
+            RpgConfig.pendingChanges = set()
+            if RpgConfig.parserInstance is None:
+                if RpgConfig.planSections and RpgConfig.fileChanged(RpgConfig.parserFile):
+                    # Running from a plan: load the new file and compare it with the plan's values
+                    try:
+                        RpgConfig.loadParser(RpgConfig.parserFile)
+                        parser = RpgConfig.parserInstance
+                        for sectionName, planValues in RpgConfig.planSections.items():
+                            if not parser.has_section(sectionName) or dict(parser.items(sectionName)) != planValues:
+                                changed.add(sectionName)
+                    except configparser.Error as ex:
+                        print("!!! Not reloading " + RpgConfig.parserFile + ", it has errors:")
+                        print(ex)
+            elif RpgConfig.fileChanged(RpgConfig.parserFile):
+                changed |= RpgConfig.mergeFile(RpgConfig.parserFile)
+
+            privateFile = RpgConfig.RPGARDEN_PRIVATE_FILE
+            if RpgConfig.privateInstance is not None and RpgConfig.fileChanged(privateFile):
+                RpgConfig.recordStat(privateFile)
+                newPrivate = configparser.ConfigParser()
+                try:
+                    newPrivate.read(privateFile)
+                except configparser.Error as ex:
+                    print("!!! Not reloading " + privateFile + ", it has errors:")
+                    print(ex)
+                    return changed
+                if newPrivate.has_section("Private"):
+                    privateParser = RpgConfig.privateInstance
+                    newOptions = RpgConfig.rawOptions(newPrivate, "Private")
+                    if not privateParser.has_section("Private") or RpgConfig.rawOptions(privateParser, "Private") != newOptions:
+                        oldKeys = set(RpgConfig.rawOptions(privateParser, "Private")) if privateParser.has_section("Private") else set()
+                        privateParser.read_dict({"Private": newOptions}, source=privateFile)    # In place, like mergeFile()
+                        for key in oldKeys - set(newOptions):
+                            privateParser.remove_option("Private", key)
+                        changed.add("Private")
+        return changed
+
+    # Called after an option in this section changed. Subclasses rebuild anything derived from the options.
+    def refresh(self):
+        pass
 
     # Sets an option value within the current section if it is different from current value
     # If the new value is not a string type, it also sets an instance variable to the 
@@ -67,13 +334,13 @@ class RpgConfig:
     def set(self, key, value): 
         myKey = str(key)
         # only set the value if it's changed or doesn't exist
-        if self.has(myKey):
-            if self.section[myKey] != str(value):
+        with RpgConfig.saveLock:
+            if not self.has(myKey) or self.section[myKey] != str(value):
+                if type(self.section) is PlanSection:  # Still reading from a plan: changes need the parser
+                    self.attachParser()
                 self.section[myKey] = str(value)
-                self.save()
-        else:
-            self.section[myKey] = str(value)
-            self.save()
+                self.markDirty()
+                self.refresh()
 
         # if the value passed in was not a string, also save a instance version in the native data type
         if not isinstance(value, str):   # Hold non-string values in an instance variable
@@ -84,10 +351,11 @@ class RpgConfig:
         retVal = defaultVal
         myKey = str(key)
         try:
+            section = self.sectionData()
             if myKey in self.__dict__:
                 retVal = self.__dict__[myKey]
-            elif self.section and myKey in self.section:
-                retVal = self.section[myKey]
+            elif section and myKey in section:
+                retVal = section[myKey]
         except Exception as ex:
             print(traceback.format_exc())
 
@@ -95,30 +363,43 @@ class RpgConfig:
     
     # returns True if the key is an option in the configparser
     def has(self, key):
-        return (str(key) in self.section)
+        return (str(key) in self.sectionData())
+
+    # Same conversions as the configparser's getboolean(), getint() and getfloat()
+    @staticmethod
+    def convertValue(value, valueType, defaultVal=None):
+        if value is None:
+            return defaultVal
+        if valueType is bool:
+            if value.lower() not in configparser.ConfigParser.BOOLEAN_STATES:
+                raise ValueError('Not a boolean: %s' % value)
+            return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+        return valueType(value)
 
-    # pass-through to the configparser's function
+    # like the configparser's function
     def getboolean(self, key, defaultVal=None): 
-        retVal = RpgConfig.parserInstance.getboolean(self.sectionName, str(key), fallback=defaultVal)
+        retVal = RpgConfig.convertValue(self.sectionData().get(str(key)), bool, defaultVal)
         return retVal
 
-    # pass-through to the configparser's function
+    # like the configparser's function
     def getint(self, key, defaultVal=None): 
-        retVal = RpgConfig.parserInstance.getint(self.sectionName, str(key), fallback=defaultVal)
+        retVal = RpgConfig.convertValue(self.sectionData().get(str(key)), int, defaultVal)
         return retVal
 
-    # pass-through to the configparser's function
+    # like the configparser's function
     def getfloat(self, key, defaultVal=None): 
-        retVal = RpgConfig.parserInstance.getfloat(self.sectionName, str(key), fallback=defaultVal)
+        retVal = RpgConfig.convertValue(self.sectionData().get(str(key)), float, defaultVal)
         return retVal
 
     # Given the section Name, returns the type of sensor
     def getSensorType(self, iniSectionName, defaultVal=None):
-        return RpgConfig.parserInstance.get(iniSectionName, "type", fallback=defaultVal)
+        return RpgConfig.sectionValues(iniSectionName).get("type", defaultVal)
     
     # Gets an attribute from the configparser object using dot notation.  Only called if the 
     # attribute isn't already one of this objects properties
     def __getattr__(self, key):
+        if key == "private":              # The private file is only read when it's used
+            return RpgConfig.loadPrivate()
         return self.get(key)
 
     # Sets an attribute on the configparser object using dot notation.
@@ -126,8 +407,87 @@ class RpgConfig:
         self.set(key, value)
 
 
+# SensorSettings: Immutable, typed snapshot of a sensor section's options.
+# FIELDS lists (attribute, ini option, type, default) for every value in the snapshot. Subclasses add their
+# own FIELDS and declare __slots__ for just the attributes they add.
+class SensorSettings:
+    FIELDS = (
+        ("description", "description", str, "Generic Sensor"),
+        ("sort", "sort", int, 50),
+        ("type", "type", str, "generic"),
+        ("field_name", "field_name", str, "generic"),
+        ("format", "format", str, None),
+        ("interval", "interval", float, None),
+        ("timeout", "timeout", float, None)
+    )
+    __slots__ = tuple(field[0] for field in FIELDS)
+
+    def __init__(self, values):
+        for attribute, option, valueType, default in self.FIELDS:
+            object.__setattr__(self, attribute, values.get(attribute, default))
+
+    # Reads and converts every field from a section (of the parser, or of the compiled plan)
+    @classmethod
+    def fromSection(cls, sectionName):
+        section = RpgConfig.sectionValues(sectionName)
+        values = {}
+        for attribute, option, valueType, default in cls.FIELDS:
+            values[attribute] = RpgConfig.convertValue(section.get(option), valueType, default)
+        return cls(values)
+
+    def asDict(self):
+        return dict((field[0], getattr(self, field[0])) for field in self.FIELDS)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("%s is read-only; change the option through its SensorConfig" % type(self).__name__)
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self.asDict())
+
+class ClockSensorSettings(SensorSettings):
+    FIELDS = SensorSettings.FIELDS + (
+        ("clock_format", "clock_format", str, "%Y-%m-%d %H:%M:%S"),
+    )
+    __slots__ = tuple(field[0] for field in FIELDS[len(SensorSettings.FIELDS):])
+
+class DhtSensorSettings(SensorSettings):
+    FIELDS = SensorSettings.FIELDS + (
+        ("pin", "pin", int, None),
+        ("dht_type", "dht_type", str, None),
+        ("scale", "scale", str, None),
+        ("capture", "capture", str, "poll"),
+        ("gpio_chip", "gpio_chip", str, None),
+        ("decoder", "decoder", str, "python"),
+        ("capture_file", "capture_file", str, None),
+        ("read_budget", "read_budget", float, None),
+        ("description_temperature", "description_temperature", str, "temperature"),
+        ("sort_temperature", "sort_temperature", int, 20),
+        ("type_temperature", "type_temperature", str, "temperature"),
+        ("field_name_temperature", "field_name_temperature", str, "temperature"),
+        ("format_temperature", "format_temperature", str, None),
+        ("description_humidity", "description_humidity", str, "humidity"),
+        ("sort_humidity", "sort_humidity", int, 21),
+        ("type_humidity", "type_humidity", str, "humidity"),
+        ("field_name_humidity", "field_name_humidity", str, "humidity"),
+        ("format_humidity", "format_humidity", str, None)
+    )
+    __slots__ = tuple(field[0] for field in FIELDS[len(SensorSettings.FIELDS):])
+
+class McpSensorSettings(SensorSettings):
+    FIELDS = SensorSettings.FIELDS + (
+        ("maxVal", "top", int, 35000),
+        ("minVal", "bottom", int, 35001),
+        ("mcp_pin", "mcp_channel", int, 0),
+        ("reverse", "reverse", bool, False),
+        ("calibrated", "calibrated", bool, False)
+    )
+    __slots__ = tuple(field[0] for field in FIELDS[len(SensorSettings.FIELDS):])
+
+
 # SensorConfig: Base class for all Sensor-related Config objects
 class SensorConfig(RpgConfig):
+    settingsClass = SensorSettings   # The type of snapshot this config keeps in self.snapshot
+
     def __init__(self, sectionName, cfgFile=RpgConfig.RPGARDEN_CONFIG_FILE):
         super().__init__(sectionName, cfgFile)
 
@@ -137,8 +497,18 @@ class SensorConfig(RpgConfig):
         self.description = self.get('description', defaultVal="Generic Sensor")
         self.field_name = self.get('field_name', defaultVal="generic")
 
+        # From here on, the snapshot is rebuilt whenever an option changes
+        self.__dict__["snapshot"] = self.settingsClass.fromSection(self.sectionName)
+
+    # Replaces the snapshot after an option changed (before the first snapshot exists, there's nothing to do)
+    def refresh(self):
+        if "snapshot" in self.__dict__:
+            self.__dict__["snapshot"] = self.settingsClass.fromSection(self.sectionName)
+
 # ClockSensorConfig: Configuration for "pretend" clock sensor
 class ClockSensorConfig(SensorConfig):
+    settingsClass = ClockSensorSettings
+
     def __init__(self, sectionName, cfgFile=RpgConfig.RPGARDEN_CONFIG_FILE):
         super().__init__(sectionName, cfgFile)
 
@@ -147,6 +517,8 @@ class ClockSensorConfig(SensorConfig):
 
 # DhtSensorConfig: Configuration for Temperature and humidity sensor
 class DhtSensorConfig(SensorConfig):
+    settingsClass = DhtSensorSettings
+
     def __init__(self, sectionName, cfgFile=RpgConfig.RPGARDEN_CONFIG_FILE):
         super().__init__(sectionName, cfgFile)
         #cfg = RpgConfig.parserInstance 
@@ -158,6 +530,8 @@ class DhtSensorConfig(SensorConfig):
 
 # McpSensorConfig: Configuration for Soil Moisture sensors and photo-resistor light sensors
 class McpSensorConfig(SensorConfig):
+    settingsClass = McpSensorSettings
+
     def __init__(self, sectionName, cfgFile=RpgConfig.RPGARDEN_CONFIG_FILE):
         super().__init__(sectionName, cfgFile)
 
@@ -0,0 +1,129 @@
+"""
+ConfigPlan: Compiles rpgarden.ini into a per-host acquisition plan, cached on disk.
+
+The plan holds, already interpolated, the [General] section and the sections of every sensor named in this
+host's sensor_list_<host>. It's saved as JSON next to the .ini file (rpgarden.ini.<host>.plan.json) and is
+keyed by the .ini file's modification time and size, the host name and PLAN_VERSION. While the key matches,
+a cold start loads the plan instead of parsing the .ini file; RpgConfig only parses the file once something
+needs to change it.
+
+Symbolic values in the config (mcp_chip_select = board.D5, dht_type = DHTXX.DHT22, ...) are resolved with
+resolveSymbol(), which only accepts the names in SYMBOL_TABLE, instead of eval(). Symbols are checked when the
+plan is compiled, so a typo is reported once, at compile time, with the option it came from.
+"""
+
+import os
+import re
+import json
+import importlib
+import traceback
+
+from Config import RpgConfig
+
+PLAN_VERSION = 1
+
+# The symbols the config may use: prefix -> (allowed names, function returning the object they belong to)
+SYMBOL_TABLE = {
+    "board": (re.compile(r"^(D\d+|CE0|CE1|SCK|MISO|MOSI)$"), lambda: importlib.import_module("board")),
+    "DHTXX": (re.compile(r"^(DHT11|DHT22|FAHRENHEIT|CELCIUS)$"), lambda: importlib.import_module("dhtxx").DHTXX)
+}
+
+# Options holding symbols, by section type ("General" for the [General] section)
+SYMBOL_OPTIONS = {
+    "General": ("mcp_chip_select",),
+    "dht": ("dht_type", "scale")
+}
+
+# Raises ValueError if text isn't one of the symbols in SYMBOL_TABLE. Returns (prefix, name).
+def checkSymbol(text):
+    prefix, dot, name = str(text).strip().partition(".")
+    entry = SYMBOL_TABLE.get(prefix)
+    if not dot or entry is None or not entry[0].match(name):
+        raise ValueError("Unknown symbol in config: %r" % text)
+    return prefix, name
+
+# Returns the object a symbol like "board.D5" or "DHTXX.DHT22" stands for
+def resolveSymbol(text):
+    prefix, name = checkSymbol(text)
+    return getattr(SYMBOL_TABLE[prefix][1](), name)
+
+def planFileName(cfgFile, host):
+    return "%s.%s.plan.json" % (cfgFile, host)
+
+# Builds the plan from a loaded configparser. fileStat is the (mtime in ns, size) the parser was read with.
+def compilePlan(parser, cfgFile, host, fileStat):
+    sections = {"General": dict(parser.items("General"))}
+    for option in SYMBOL_OPTIONS["General"]:
+        if option in sections["General"]:
+            checkSymbol(sections["General"][option])
+
+    sensorNames = []
+    for sensorSection in sections["General"]["sensor_list_" + host].split(','):
+        sensorName = sensorSection + "_" + host
+        sensorNames.append(sensorName)
+        if parser.has_section(sensorName):
+            sections[sensorName] = dict(parser.items(sensorName))
+            for option in SYMBOL_OPTIONS.get(sections[sensorName].get("type"), ()):
+                try:
+                    checkSymbol(sections[sensorName].get(option))
+                except ValueError as ex:
+                    raise ValueError("[%s] %s: %s" % (sensorName, option, ex))
+
+    return {
+        "version": PLAN_VERSION,
+        "host": host,
+        "config_file": cfgFile,
+        "mtime_ns": fileStat[0],
+        "size": fileStat[1],
+        "sensors": sensorNames,
+        "sections": sections
+    }
+
+# Returns the cached plan if it's still valid for the .ini file and host, otherwise None
+def loadPlan(cfgFile, host):
+    try:
+        with open(planFileName(cfgFile, host)) as planFile:
+            plan = json.load(planFile)
+    except (OSError, ValueError):
+        return None
+
+    fileStat = RpgConfig.fileStat(cfgFile)
+    if fileStat is None or plan.get("version") != PLAN_VERSION or plan.get("host") != host or \
+       (plan.get("mtime_ns"), plan.get("size")) != fileStat:
+        return None
+    return plan
+
+# Saves a plan next to the .ini file. A plan that can't be saved (read-only directory) is just not cached.
+def savePlan(plan, cfgFile, host):
+    fileName = planFileName(cfgFile, host)
+    tempName = fileName + ".tmp"
+    try:
+        with open(tempName, "w") as planFile:
+            json.dump(plan, planFile, indent=1, sort_keys=True)
+        os.replace(tempName, fileName)
+    except OSError:
+        pass
+
+# ==================================================================================================
+# usePlan() - Sets RpgConfig up from the cached plan, compiling and saving a new one if the .ini file
+# changed. Returns the plan, or None if the config couldn't be compiled (RpgConfig then just parses
+# the .ini file as usual, and the error shows up where the bad value is used).
+# ==================================================================================================
+def usePlan(cfgFile, host):
+    plan = loadPlan(cfgFile, host)
+    if plan is not None:
+        RpgConfig.usePlan(cfgFile, plan["sections"], (plan["mtime_ns"], plan["size"]))
+        return plan
+
+    try:
+        RpgConfig.loadParser(cfgFile)
+        fileStat = RpgConfig.fileStats.get(cfgFile)
+        if fileStat is None:
+            return None
+        plan = compilePlan(RpgConfig.parserInstance, cfgFile, host, fileStat)
+        savePlan(plan, cfgFile, host)
+        return plan
+    except Exception as ex:
+        print("!!! Couldn't compile " + cfgFile + ":")
+        print(traceback.format_exc())
+        return None
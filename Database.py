@@ -0,0 +1,201 @@
+"""
+ConnectionPool: Keeps connections to the MySQL/MariaDB database open between cycles.
+
+Connecting over the Pi's Wi-Fi (TCP plus the MySQL auth handshake) can take seconds, so instead of a new
+connection for every write, the pool hands out connections it already has. A connection that has sat idle
+for db_ping_interval seconds is checked with ping() before it's handed out, and replaced if it's gone.
+A connection that failed while in use is released as broken and closed.
+
+When connecting fails, the pool waits before trying again, starting at db_retry_min seconds and doubling
+up to db_retry_max, with random jitter so a room full of Pis doesn't reconnect in lockstep after the server
+comes back. While it's waiting, acquire() returns None right away, like a failed connect, instead of
+holding up the cycle.
+
+The pool holds up to db_pool_size connections (default 2), so a longer query, like reading back history,
+can run while the daemon keeps writing. acquire() waits up to db_acquire_timeout seconds for a free one.
+
+Used through getPool(), which keeps one pool per process. reset() drops every connection (the daemon calls
+it when the private .ini file changes), and closeAll() closes the pool; it also runs when the process exits.
+"""
+
+import time
+import random
+import atexit
+import threading
+import traceback
+
+import Metrics
+
+DB_CONNECTS = Metrics.counter("rpgarden_db_connects_total", "Database connection attempts by result (ok, failed)", ["result"])
+DB_PING_FAILURES = Metrics.counter("rpgarden_db_ping_failures_total", "Idle database connections found dead by ping()")
+DB_POOL_CONNECTIONS = Metrics.gauge("rpgarden_db_pool_connections", "Open database connections, by state (idle, busy)", ["state"])
+
+# ==================================================================================================
+# connect() - Opens a connection to the database named in the private config file. Raises on failure.
+# ==================================================================================================
+def connect(rpgConfig):
+    import MySQLdb    # sudo apt-get update  - Do these commands to set up mysqldb in Python
+                      # sudo apt-get upgrade
+                      # sudo apt-get install python-dev default-libmysqlclient-dev
+                      # pip3 install mysqlclient
+    return MySQLdb.connect(rpgConfig.private['mysql_host'], rpgConfig.private['mysql_user'],
+                           rpgConfig.private['mysql_password'], rpgConfig.private['mysql_db'],
+                           connect_timeout=rpgConfig.getint("db_connect_timeout", defaultVal=10))
+
+
+# ConnectionPool: A few open connections, handed out one caller at a time
+class ConnectionPool:
+    def __init__(self, connect, size=2, pingInterval=30.0, retryMin=1.0, retryMax=300.0, clock=time.monotonic, rng=random):
+        self.connect = connect          # Opens a new connection, or raises
+        self.size = max(int(size), 1)
+        self.pingInterval = pingInterval
+        self.retryMin = retryMin
+        self.retryMax = retryMax
+        self.clock = clock
+        self.rng = rng
+        self.condition = threading.Condition()
+        self.idle = []                  # [(connection, generation, time it was released)]
+        self.busy = {}                  # {connection: generation} for connections handed out
+        self.opening = 0                # Connections being opened (they count against size)
+        self.generation = 0             # Bumped by reset(); connections from older generations are closed
+        self.failures = 0               # Connection attempts that failed in a row
+        self.retryAt = 0.0              # No new connections before this time
+
+    def updateGauges(self):
+        DB_POOL_CONNECTIONS.set(len(self.idle), state="idle")
+        DB_POOL_CONNECTIONS.set(len(self.busy), state="busy")
+
+    # Returns a live connection, or None if the database can't be reached right now (or no connection
+    # came free within timeout seconds). Hand it back with release().
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else self.clock() + timeout
+        with self.condition:
+            while not self.idle and len(self.busy) + self.opening >= self.size:
+                timeLeft = None if deadline is None else deadline - self.clock()
+                if timeLeft is not None and timeLeft <= 0:
+                    print("!!! No database connection came free")
+                    return None
+                self.condition.wait(timeLeft)
+
+            if self.idle:
+                connection, generation, released = self.idle.pop()
+                self.busy[connection] = generation
+                self.updateGauges()
+            else:
+                if self.clock() < self.retryAt:
+                    return None         # Still backing off after a failed connect
+                connection, generation, released = None, self.generation, None
+                self.opening += 1
+
+        # Check an idle connection is still there before handing it out
+        if connection is not None and self.clock() - released >= self.pingInterval:
+            try:
+                connection.ping()
+            except Exception as ex:
+                print("Database connection went away (%s). Reconnecting." % ex)
+                DB_PING_FAILURES.inc()
+                self.closeConnection(connection)
+                with self.condition:
+                    del self.busy[connection]      # Its place goes to the new connection
+                    self.opening += 1
+                    self.updateGauges()
+                connection = None
+
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception as ex:
+                with self.condition:
+                    self.opening -= 1
+                    self.failures += 1
+                    delay = min(self.retryMax, self.retryMin * 2 ** (self.failures - 1))
+                    delay *= self.rng.uniform(0.5, 1.0)
+                    self.retryAt = self.clock() + delay
+                    self.condition.notify()
+                DB_CONNECTS.inc(result="failed")
+                print("!!! Couldn't connect to the database (%s). Next try in %.1f seconds." % (ex, delay))
+                return None
+            DB_CONNECTS.inc(result="ok")
+            with self.condition:
+                self.opening -= 1
+                self.failures = 0
+                self.retryAt = 0.0
+                self.busy[connection] = self.generation
+                self.updateGauges()
+        return connection
+
+    # Hands a connection back. A broken one (it failed while in use), or one from before a reset(), is closed.
+    def release(self, connection, broken=False):
+        with self.condition:
+            generation = self.busy.pop(connection, None)
+            keep = not broken and generation == self.generation
+            if keep:
+                self.idle.append((connection, generation, self.clock()))
+            self.updateGauges()
+            self.condition.notify()
+        if not keep:
+            self.closeConnection(connection)
+
+    def closeConnection(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    # Drops every connection: idle ones now, busy ones when they're released. Also ends any backoff.
+    def reset(self):
+        with self.condition:
+            self.generation += 1
+            idle, self.idle = self.idle, []
+            self.failures = 0
+            self.retryAt = 0.0
+            self.updateGauges()
+        for connection, generation, released in idle:
+            self.closeConnection(connection)
+
+    def close(self):
+        self.reset()
+
+
+# The process's pool
+connectionPool = None
+connectionPoolLock = threading.Lock()
+
+# ==================================================================================================
+# getPool() - Returns the process's connection pool, creating it the first time. Options in [General]:
+#    db_pool_size        most connections open at once (default 2)
+#    db_ping_interval    ping a connection that's been idle this many seconds before using it (default 30)
+#    db_retry_min        seconds to wait after the first failed connect (default 1)
+#    db_retry_max        longest wait between connects, however many failed (default 300)
+#    db_connect_timeout  seconds to wait for the server when connecting (default 10)
+#    db_acquire_timeout  seconds writeSQL() waits for a free connection (default 10)
+# ==================================================================================================
+def getPool(rpgConfig):
+    global connectionPool
+    with connectionPoolLock:
+        if connectionPool is None:
+            connectionPool = ConnectionPool(lambda: connect(rpgConfig),
+                                            size=rpgConfig.getint("db_pool_size", defaultVal=2),
+                                            pingInterval=rpgConfig.getfloat("db_ping_interval", defaultVal=30.0),
+                                            retryMin=rpgConfig.getfloat("db_retry_min", defaultVal=1.0),
+                                            retryMax=rpgConfig.getfloat("db_retry_max", defaultVal=300.0))
+        return connectionPool
+
+# Drops the pool's connections, so the next write reconnects (with new credentials, for example)
+def resetAll():
+    with connectionPoolLock:
+        pool = connectionPool
+    if pool is not None:
+        pool.reset()
+
+def closeAll():
+    global connectionPool
+    with connectionPoolLock:
+        pool, connectionPool = connectionPool, None
+    if pool is not None:
+        try:
+            pool.close()
+        except Exception:
+            print(traceback.format_exc())
+
+atexit.register(closeAll)
@@ -0,0 +1,174 @@
+"""
+LogIndex: A sparse time index for the CSV logs, and range queries that use it.
+
+While it writes a log, CsvSink adds an entry to <log file>.idx every csv_index_rows rows: the byte offset
+where the row starts and the row's time (epoch seconds), as a fixed-width 16 byte record ("<Qd"). The index
+file is append-only, like the log.
+
+A query reads the header row, binary-searches the index for the last entry at or before the start time,
+seeks there and reads rows until they pass the end time. Without an index (or for gzipped segments) it
+reads the file from the top. It's safe to run while the log is being appended to: the file size is taken
+once at the start, a row without its line ending (still being written) is left out, and index entries
+pointing past the end of what's in the file yet are ignored.
+
+The rows have to be in time order for the search to work, which is how the sink writes them.
+
+For a segmented log (see Sinks.SegmentedCsvSink) queryLog() uses the manifest to open only the segments
+that can hold rows in the range.
+"""
+
+import os
+import bisect
+import struct
+import calendar
+import time
+
+ENTRY = struct.Struct("<Qd")   # byte offset, epoch time
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def indexFileName(logFile):
+    return logFile + ".idx"
+
+# Converts a row's time ("YYYY-MM-DD HH:MM:SS", UTC, maybe with a fraction of a second) to epoch seconds
+def parseTime(timeText):
+    seconds, point, fraction = timeText.partition(".")
+    return calendar.timegm(time.strptime(seconds, TIME_FORMAT)) + (float("0." + fraction) if fraction else 0.0)
+
+# Converts epoch seconds to a row's time format
+def formatTime(epoch):
+    return time.strftime(TIME_FORMAT, time.gmtime(epoch))
+
+
+# IndexWriter: Appends entries to an index file (emptied first with truncate, for a new log)
+class IndexWriter:
+    def __init__(self, fileName, truncate=False):
+        self.fd = os.open(fileName, os.O_WRONLY | os.O_CREAT | os.O_APPEND | (os.O_TRUNC if truncate else 0), 0o644)
+
+    def add(self, offset, epoch):
+        os.write(self.fd, ENTRY.pack(offset, epoch))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+# Returns a log's index entries as a list of (offset, epoch). A partly written last entry is left out.
+def readIndex(logFile):
+    try:
+        with open(indexFileName(logFile), "rb") as indexFile:
+            data = indexFile.read()
+    except FileNotFoundError:
+        return []
+    usable = len(data) - len(data) % ENTRY.size
+    return list(ENTRY.iter_unpack(data[:usable]))
+
+# (Re)builds a log's index from scratch, with an entry every indexRows rows. Returns the number of entries.
+def buildIndex(logFile, indexRows=100):
+    entries = 0
+    tempName = indexFileName(logFile) + ".tmp"
+    with open(logFile, "rb") as log, open(tempName, "wb") as indexFile:
+        offset = len(log.readline())         # Skip the header
+        row = 0
+        for line in log:
+            if not line.endswith(b"\n"):
+                break
+            if row % indexRows == 0:
+                indexFile.write(ENTRY.pack(offset, parseTime(line.split(b"\t", 1)[0].decode("ascii"))))
+                entries += 1
+            offset += len(line)
+            row += 1
+    os.replace(tempName, indexFileName(logFile))
+    return entries
+
+# Finds where to start reading for rows at or after startEpoch: the offset of the last index entry before it,
+# if that entry is inside the file and starts a row with the entry's time. Otherwise returns None (read from the top).
+def startOffset(log, entries, startEpoch, fileSize):
+    entries = [entry for entry in entries if entry[0] < fileSize]
+    position = bisect.bisect_right([epoch for offset, epoch in entries], startEpoch) - 1
+    # The row before an entry may share its time, so step back over equal times
+    while position >= 0 and entries[position][1] >= startEpoch:
+        position -= 1
+    if position < 0:
+        return None
+    return entries[position][0] if entryMatches(log, entries[position]) else None
+
+# True if an index entry points at the start of a row with the entry's time. An index that doesn't match
+# its log (rebuilt, replaced or rotated) fails this.
+def entryMatches(log, entry):
+    offset, epoch = entry
+    log.seek(offset - 1)
+    if log.read(1) != b"\n":
+        return False
+    try:
+        return parseTime(log.readline().split(b"\t", 1)[0].decode("ascii")) == epoch
+    except ValueError:
+        return False
+
+# True if a log's index is usable: empty, or its last entry matches the log
+def indexMatches(logFile):
+    entries = readIndex(logFile)
+    if not entries:
+        return True
+    with open(logFile, "rb") as log:
+        return entries[-1][0] < os.fstat(log.fileno()).st_size and entryMatches(log, entries[-1])
+
+# Yields the rows of one log file (a list of strings, starting with the time) between start and end,
+# which are row time strings or None. The header comes first, as a list of column names.
+def queryFile(fileName, start=None, end=None, compressed=False):
+    if compressed:
+        import gzip
+        log = gzip.open(fileName, "rb")
+        fileSize = None
+    else:
+        log = open(fileName, "rb")
+        fileSize = os.fstat(log.fileno()).st_size
+    try:
+        header = log.readline()
+        if not header.endswith(b"\n"):
+            return
+        yield header.decode("utf-8").rstrip("\r\n").split("\t")
+
+        position = len(header)
+        if start is not None and fileSize is not None:
+            offset = startOffset(log, readIndex(fileName), parseTime(start), fileSize)
+            position = offset if offset is not None else position
+            log.seek(position)
+
+        startBytes = start.encode("ascii") if start is not None else None
+        endBytes = end.encode("ascii") if end is not None else None
+        for line in log:
+            position += len(line)
+            if fileSize is not None and position > fileSize:
+                break                          # Appended after we started
+            if not line.endswith(b"\n"):
+                break                          # Still being written
+            timeBytes = line.split(b"\t", 1)[0]
+            if startBytes is not None and timeBytes < startBytes:
+                continue
+            if endBytes is not None and timeBytes[:len(endBytes)] > endBytes:
+                break                          # (An end time without a fraction takes in its whole second)
+            yield line.decode("utf-8").rstrip("\r\n").split("\t")
+    finally:
+        log.close()
+
+# Yields (columns, row) for every row of a log between start and end (row time strings or None). For a
+# segmented log, log_file is the name the segments are based on; its manifest picks the segments to read.
+def queryLog(logFile, start=None, end=None):
+    import Sinks
+    logDir = os.path.dirname(logFile) or "."
+    manifestFile = os.path.join(logDir, os.path.splitext(os.path.basename(logFile))[0] + ".manifest.json")
+    if os.path.exists(manifestFile):
+        files = [(os.path.join(logDir, segment["file"]), segment["compressed"])
+                 for segment in Sinks.LogManifest(manifestFile).segmentsBetween(start, end)]
+    else:
+        files = [(logFile, False)]
+
+    for fileName, compressed in files:
+        if not compressed and not os.path.exists(fileName) and os.path.exists(fileName + ".gz"):
+            fileName, compressed = fileName + ".gz", True     # Compressed since the manifest was read
+        rows = queryFile(fileName, start, end, compressed)
+        columns = next(rows, None)
+        if columns is None:
+            continue
+        for row in rows:
+            yield columns, row
@@ -0,0 +1,244 @@
+"""
+Counter, Gauge, Histogram and Registry: In-process metrics for readSensors.
+
+Metrics are kept in memory and exposed in the Prometheus text exposition format, either by writing them to a
+file every few seconds (metrics_file / metrics_interval in the [General] section; point node_exporter's
+textfile collector at it) or by serving them over HTTP on a local port (metrics_port / metrics_address).
+
+Each metric can have labels. Values for a label set are created the first time they're used:
+    READS = Metrics.counter("rpgarden_sensor_reads_total", "Sensor reads", ["sensor", "result"])
+    READS.inc(sensor="moisture_sensor_1_pi", result="ok")
+
+All updates are thread safe. Metrics never raise into the caller's code path on bad label values; a missing
+label is exposed as an empty string.
+"""
+
+import os
+import time
+import threading
+import traceback
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Formats a float the way the exposition format expects
+def formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def escapeLabel(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# Metric: Base class. Holds one value (or set of values) per combination of label values.
+class Metric:
+    TYPE = "untyped"
+
+    def __init__(self, name, help, labelNames=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(labelName, "")) for labelName in self.labelNames)
+
+    def labelText(self, key, extra=None):
+        pairs = ['%s="%s"' % (labelName, escapeLabel(value)) for labelName, value in zip(self.labelNames, key)]
+        if extra:
+            pairs.append('%s="%s"' % extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def expose(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.TYPE)]
+        with self.lock:
+            for key in sorted(self.values):
+                lines.extend(self.exposeValue(key, self.values[key]))
+        return lines
+
+    def exposeValue(self, key, value):
+        return ["%s%s %s" % (self.name, self.labelText(key), formatValue(value))]
+
+# Counter: A value that only goes up
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+# Gauge: A value that can go up and down
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+# Histogram: Counts observations into cumulative buckets, and keeps their sum and count
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, help, labelNames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelNames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    # Times the code in a with block
+    def time(self, **labels):
+        return HistogramTimer(self, labels)
+
+    def exposeValue(self, key, state):
+        counts, total, count = state
+        lines = []
+        for bound, bucketCount in zip(self.buckets, counts):
+            lines.append("%s_bucket%s %d" % (self.name, self.labelText(key, ("le", formatValue(bound))), bucketCount))
+        lines.append("%s_bucket%s %d" % (self.name, self.labelText(key, ("le", "+Inf")), count))
+        lines.append("%s_sum%s %s" % (self.name, self.labelText(key), formatValue(total)))
+        lines.append("%s_count%s %d" % (self.name, self.labelText(key), count))
+        return lines
+
+class HistogramTimer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, excTraceback):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+# Registry: The set of metrics a process exposes, and the ways of exposing them
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.stopEvent = threading.Event()
+
+    # Returns the metric with this name, creating it the first time
+    def register(self, metricClass, name, help, labelNames=(), **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metricClass(name, help, labelNames, **kwargs)
+            return metric
+
+    # Returns all metrics in the text exposition format
+    def expose(self):
+        with self.lock:
+            metrics = [self.metrics[name] for name in sorted(self.metrics)]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+    # Writes the metrics to a file. A temporary file is renamed into place so readers never see half a file.
+    def writeFile(self, fileName):
+        tempName = fileName + ".tmp"
+        with open(tempName, "w") as metricsFile:
+            metricsFile.write(self.expose())
+        os.replace(tempName, fileName)
+
+    # Starts a background thread that writes the metrics file every interval seconds until stop()
+    def startFileWriter(self, fileName, interval):
+        def writeLoop():
+            while not self.stopEvent.wait(interval):
+                try:
+                    self.writeFile(fileName)
+                except Exception:
+                    print(traceback.format_exc())
+            self.writeFile(fileName)
+        thread = threading.Thread(target=writeLoop, name="metrics-file", daemon=True)
+        thread.start()
+        return thread
+
+    # Serves the metrics over HTTP (any path) on a background thread. Returns the server.
+    def serve(self, port, address="127.0.0.1"):
+        import http.server   # Only needed when serving, and slow to import on a Pi Zero
+        registry = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.expose().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass   # Don't print a line for every scrape
+
+        server = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+        thread.start()
+        return server
+
+    def stop(self):
+        self.stopEvent.set()
+
+
+# The process-wide registry, and shortcuts for creating metrics in it
+REGISTRY = Registry()
+
+def counter(name, help, labelNames=()):
+    return REGISTRY.register(Counter, name, help, labelNames)
+
+def gauge(name, help, labelNames=()):
+    return REGISTRY.register(Gauge, name, help, labelNames)
+
+def histogram(name, help, labelNames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram, name, help, labelNames, buckets=buckets)
+
+# ==================================================================================================
+# startExporting() - Starts the metrics file writer and/or HTTP server configured in [General]:
+#    metrics_file      path of the text exposition file to write (not written if missing)
+#    metrics_interval  seconds between writes of the file (default 15)
+#    metrics_port      local port to serve the metrics on (not served if missing or 0)
+#    metrics_address   address to listen on (default 127.0.0.1)
+# ==================================================================================================
+def startExporting(rpgConfig):
+    try:
+        metricsFile = rpgConfig.get("metrics_file")
+        if metricsFile:
+            REGISTRY.startFileWriter(metricsFile, rpgConfig.getfloat("metrics_interval", defaultVal=15.0))
+
+        metricsPort = rpgConfig.getint("metrics_port", defaultVal=0)
+        if metricsPort:
+            REGISTRY.serve(metricsPort, rpgConfig.get("metrics_address", "127.0.0.1"))
+    except Exception as ex:
+        # Metrics are never worth stopping the data collection for
+        print(traceback.format_exc())
+        print(ex)
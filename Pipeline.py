@@ -0,0 +1,178 @@
+"""
+Pipeline: Hands each cycle's readings to the sinks (CSV log, binary store, database) through queues, so
+acquisition never waits on I/O.
+
+Every sink has its own SinkWorker: a bounded queue and a thread that takes batches off it and writes them.
+A slow database then only backs up the database's queue, and an error in one sink doesn't hold up the
+others. A batch is whatever the caller puts in; each sink's write function picks out what it needs.
+
+What happens when a sink's queue is full is set per sink:
+    block   put() waits for room. Nothing is lost, but a stuck sink stalls acquisition.
+    drop    the oldest batch in the queue is thrown away to make room (counted in rpgarden_sink_dropped_total).
+    spill   batches go to a file (<spill dir>/<sink>.spill.jsonl, one JSON batch per line) until the worker
+            has caught up, and the worker writes them from there, in order, before anything newer. The
+            file outlives a restart, so a batch spilled before a crash is written on the next start.
+Spilled batches have to be JSON (dicts, lists, strings and numbers), which reading objects are.
+
+Queue depths are exported as rpgarden_sink_queue_depth, and the time each write takes as
+rpgarden_sink_write_seconds.
+"""
+
+import os
+import json
+import time
+import queue
+import threading
+import traceback
+
+import Metrics
+
+SINK_QUEUE_DEPTH = Metrics.gauge("rpgarden_sink_queue_depth", "Batches waiting in a sink's queue (spilled ones included)", ["sink"])
+SINK_DROPPED = Metrics.counter("rpgarden_sink_dropped_total", "Batches a sink dropped because its queue was full", ["sink"])
+SINK_SPILLED = Metrics.counter("rpgarden_sink_spilled_total", "Batches a sink spilled to disk because its queue was full", ["sink"])
+SINK_ERRORS = Metrics.counter("rpgarden_sink_errors_total", "Sink writes that raised an exception", ["sink"])
+SINK_WRITE_SECONDS = Metrics.histogram("rpgarden_sink_write_seconds", "Time a sink took to write one batch", ["sink"])
+
+POLICIES = ("block", "drop", "spill")
+STOP = object()    # Put on a queue to stop its worker
+
+# SinkWorker: One sink's queue and the thread that writes what's in it
+class SinkWorker:
+    def __init__(self, name, write, queueSize=100, policy="block", spillDir=None):
+        if policy not in POLICIES:
+            raise ValueError("Unknown sink policy for %s: %s (use one of %s)" % (name, policy, ", ".join(POLICIES)))
+        if policy == "spill" and not spillDir:
+            raise ValueError("The spill policy for %s needs a spill directory" % name)
+        self.name = name
+        self.write = write             # write(batch) - does the actual I/O
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=max(int(queueSize), 1))
+        self.lock = threading.Lock()   # Guards the spill file
+        self.spillFile = os.path.join(spillDir, name + ".spill.jsonl") if spillDir else None
+        self.spilled = 0               # Batches in the spill file
+        if self.spillFile is not None:
+            os.makedirs(spillDir, exist_ok=True)
+            if os.path.exists(self.spillFile):    # Left from the last run
+                with open(self.spillFile, "rb") as spill:
+                    self.spilled = sum(1 for line in spill if line.endswith(b"\n"))
+        self.thread = threading.Thread(target=self.run, name="sink-" + name, daemon=True)
+        self.thread.start()
+
+    def depth(self):
+        return self.queue.qsize() + self.spilled
+
+    # Queues a batch for the sink, following the sink's policy when the queue is full
+    def put(self, batch):
+        if self.policy == "block":
+            self.queue.put(batch)
+        elif self.policy == "drop":
+            while True:
+                try:
+                    self.queue.put_nowait(batch)
+                    break
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.queue.task_done()
+                        SINK_DROPPED.inc(sink=self.name)
+                    except queue.Empty:
+                        pass
+        else:
+            with self.lock:
+                # Once spilling, keep spilling until the worker has emptied the file, so batches stay in order
+                spilled = self.spilled > 0
+                if not spilled:
+                    try:
+                        self.queue.put_nowait(batch)
+                    except queue.Full:
+                        spilled = True
+                if spilled:
+                    with open(self.spillFile, "a") as spill:
+                        spill.write(json.dumps(batch) + "\n")
+                    self.spilled += 1
+                    SINK_SPILLED.inc(sink=self.name)
+        SINK_QUEUE_DEPTH.set(self.depth(), sink=self.name)
+
+    def writeBatch(self, batch):
+        try:
+            with SINK_WRITE_SECONDS.time(sink=self.name):
+                self.write(batch)
+        except Exception:
+            print("!!! Sink " + self.name + " failed to write a batch")
+            print(traceback.format_exc())
+            SINK_ERRORS.inc(sink=self.name)
+
+    # Writes the batches in the spill file. The file is only cut down once they're all written, so a crash
+    # part way through writes them again on the next start rather than losing them. Batches spilled
+    # meanwhile are kept for the next pass; the file is removed once a pass finds nothing new.
+    def drainSpill(self):
+        while True:
+            with self.lock:
+                if self.spilled == 0:
+                    return
+                with open(self.spillFile, "r") as spill:
+                    lines = spill.readlines()
+            for line in lines:
+                if line.endswith("\n"):     # A line cut short by a crash is dropped
+                    self.writeBatch(json.loads(line))
+            with self.lock:
+                with open(self.spillFile, "r") as spill:
+                    rest = spill.readlines()[len(lines):]
+                if rest:
+                    with open(self.spillFile + ".tmp", "w") as spill:
+                        spill.writelines(rest)
+                    os.replace(self.spillFile + ".tmp", self.spillFile)
+                else:
+                    os.remove(self.spillFile)
+                self.spilled = len(rest)
+            SINK_QUEUE_DEPTH.set(self.depth(), sink=self.name)
+
+    def run(self):
+        while True:
+            if self.queue.empty() and self.spilled > 0:
+                self.drainSpill()
+            try:
+                batch = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                if batch is STOP:
+                    self.drainSpill()    # Batches spilled behind the queue go out before stopping
+                    return
+                self.writeBatch(batch)
+            finally:
+                self.queue.task_done()
+                SINK_QUEUE_DEPTH.set(self.depth(), sink=self.name)
+
+    # Writes what's queued, spilled batches included, and stops the thread. Gives up after timeout seconds,
+    # even if the queue is too full to take the stop; whatever is left in the spill file is written next start.
+    def close(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self.queue.put(STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        if self.thread.is_alive():
+            print("!!! Sink %s still has %d batches to write" % (self.name, self.depth()))
+
+
+# Pipeline: The workers of all the sinks
+class Pipeline:
+    def __init__(self):
+        self.workers = []
+
+    def add(self, name, write, queueSize=100, policy="block", spillDir=None):
+        self.workers.append(SinkWorker(name, write, queueSize, policy, spillDir))
+
+    # Gives a batch to every sink
+    def put(self, batch):
+        for worker in self.workers:
+            worker.put(batch)
+
+    # Stops every worker. timeout covers them all, not each one, so shutdown never waits longer than it.
+    def close(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self.workers:
+            worker.close(None if deadline is None else max(deadline - time.monotonic(), 0))
+        self.workers = []
@@ -0,0 +1,140 @@
+"""
+Scheduler and ScheduledTask:
+A multi-rate, drift-free scheduler for reading sensors at different intervals inside one process.
+
+Each task has its own interval. Deadlines are kept on a fixed grid (start + n * interval) measured with the
+monotonic clock, so a late cycle never pushes the following deadlines back. If a task falls more than a
+whole interval behind, the slots it missed are counted as skipped instead of being run back-to-back.
+
+The scheduler sleeps until the earliest deadline (it never busy-waits) and keeps per-task statistics:
+jitter (how late a task was started compared to its deadline), overruns (a run that finished after the
+task's next deadline) and skipped slots.
+
+A task's run doesn't have to finish before other tasks are handed out: a task that was returned by
+waitForDue() isn't due again until complete() is called for it, so runs can go on in the background.
+wake() makes a waiting waitForDue() return early (with no due tasks), for example when a run finishes.
+"""
+
+import time
+import threading
+
+# ScheduledTask: One item (usually a sensor) on the schedule, with its interval and statistics
+class ScheduledTask:
+    def __init__(self, item, name, interval, firstDeadline):
+        self.item = item
+        self.name = name
+        self.interval = interval
+        self.deadline = firstDeadline   # The deadline of the slot currently due or running
+        self.startedAt = None
+
+        # Statistics
+        self.runs = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.lastJitter = 0.0
+        self.maxJitter = 0.0
+        self.totalJitter = 0.0
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "interval": self.interval,
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "last_jitter": self.lastJitter,
+            "max_jitter": self.maxJitter,
+            "mean_jitter": (self.totalJitter / self.runs) if self.runs else 0.0
+        }
+
+
+class Scheduler:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.tasks = []
+        self.startTime = clock()
+        self.stopEvent = threading.Event()
+        self.wakeEvent = threading.Event()    # Set by stop() and wake() to end a wait early
+
+    # Adds an item to the schedule. The first run is due at start + phase seconds.
+    def add(self, item, interval, name=None, phase=0.0):
+        if interval <= 0:
+            raise ValueError("Scheduler interval must be greater than zero: %r" % interval)
+        task = ScheduledTask(item, name or str(item), float(interval), self.startTime + phase)
+        self.tasks.append(task)
+        return task
+
+    # Takes a task off the schedule
+    def remove(self, task):
+        if task in self.tasks:
+            self.tasks.remove(task)
+
+    # Asks a waiting scheduler to stop. waitForDue() then returns None.
+    def stop(self):
+        self.stopEvent.set()
+        self.wakeEvent.set()
+
+    # Makes waitForDue() return now (thread-safe). Used when a background run finishes.
+    def wake(self):
+        self.wakeEvent.set()
+
+    # Sleeps until at least one task is due and returns the list of due tasks, or None if stopped.
+    # The due tasks are marked as started; call complete() for each one once it has run. Tasks still
+    # running aren't returned again. Returns an empty list if woken by wake(), or once the clock
+    # time passes "until" (if given) without a task coming due.
+    def waitForDue(self, until=None):
+        if not self.tasks:
+            return None
+
+        while not self.stopEvent.is_set():
+            now = self.clock()
+            idleTasks = [task for task in self.tasks if task.startedAt is None]
+            dueTasks = [task for task in idleTasks if task.deadline <= now]
+            if not dueTasks:
+                if self.wakeEvent.is_set() or (until is not None and until <= now):
+                    self.wakeEvent.clear()
+                    return []
+                deadlines = [task.deadline for task in idleTasks] + ([until] if until is not None else [])
+                # Event.wait() sleeps without spinning and lets stop() and wake() end it early
+                self.wakeEvent.wait(min(deadlines) - now if deadlines else None)
+                continue
+
+            for task in dueTasks:
+                jitter = now - task.deadline
+                task.startedAt = now
+                task.lastJitter = jitter
+                task.totalJitter += jitter
+                if jitter > task.maxJitter:
+                    task.maxJitter = jitter
+            return dueTasks
+
+        return None
+
+    # Marks a task's run as finished and moves its deadline to the next slot on its grid.
+    # Slots whose deadlines have already passed are counted as skipped, not run late.
+    def complete(self, task):
+        now = self.clock()
+        task.runs += 1
+
+        nextDeadline = task.deadline + task.interval
+        if now >= nextDeadline:
+            task.overruns += 1
+            missed = int((now - nextDeadline) // task.interval) + 1
+            task.skipped += missed
+            nextDeadline += missed * task.interval
+
+        task.deadline = nextDeadline
+        task.startedAt = None
+
+    # Returns a list of statistics dictionaries, one per task
+    def stats(self):
+        return [task.stats() for task in self.tasks]
+
+    # Returns the statistics as printable text
+    def report(self):
+        lines = ["%-28s %8s %6s %8s %7s %10s %10s" % ("Task", "Interval", "Runs", "Overruns", "Skipped", "Jitter avg", "Jitter max")]
+        for taskStats in self.stats():
+            lines.append("%-28s %8.2f %6d %8d %7d %9.1fms %9.1fms" % (
+                taskStats["name"], taskStats["interval"], taskStats["runs"], taskStats["overruns"],
+                taskStats["skipped"], taskStats["mean_jitter"] * 1000.0, taskStats["max_jitter"] * 1000.0))
+        return "\n".join(lines)
@@ -1,36 +1,101 @@
 import sys
+import time
+import threading
 
 import Config  # Our .ini file configuration class
+import ConfigPlan  # Resolves symbols like DHTXX.DHT22 in the config
+import Metrics # In-process metrics
 
 # The clock "sensor" needs this
 import datetime
 
-# Here's our own module for reading the DHTxx Temp and Humidity Sensor
-from dhtxx import DHTXX
+# The hardware drivers (our dhtxx module for the DHTxx Temp and Humidity Sensor, and the Adafruit modules
+# for the MCP3xxx chip) are imported by the sensor classes that use them, the first time one is created.
+# A host only pays for importing the drivers its configured sensors need.
 
-# This is the Adafruit module that comes with CircuitPython
-# It is used to read the (soil moisture and light) sensors attached to the MCP3xxx chip
-# pip3 install adafruit-circuitpython-mcp3xxx
-from adafruit_mcp3xxx.analog_in import AnalogIn # handles the sensor
+# Metrics kept by the sensors
+SENSOR_READ_SECONDS = Metrics.histogram("rpgarden_sensor_read_seconds", "Time taken by one sensor read", ["sensor"])
+DHT_ATTEMPTS = Metrics.histogram("rpgarden_dht_attempts", "DHT reads needed for one reading", ["sensor"],
+                                 buckets=(1, 2, 3, 4, 5, 6, 8, 10))
+MCP_BOUND_UPDATES = Metrics.counter("rpgarden_mcp_bound_updates_total", "New extreme raw values seen by an MCP sensor",
+                                    ["sensor", "bound"])
 
 class GenericSensor:
+    MIN_INTERVAL = 0.0  # Shortest time, in seconds, the hardware allows between two reads
+    pendingRead = None  # Future for a read still running on a thread pool (see readSensors.getReadings)
+    scheduledInterval = None  # Seconds between reads while the daemon schedules it (None for a one-shot run)
+
     def __getattr__(self, name):      # Check the config object's properties if
         retVal = self.cfg.get(name)   #   it's not on the sensor object itself
         return retVal
 
-    def readObj(self):
+    # Returns the reading objects for this sensor (one per measured value), without the readings.
+    # Settings come from the config's typed snapshot, so this does no configparser lookups.
+    def describeObj(self):
+        settings = self.cfg.snapshot
         sensorResultDict = {
-            "description": self.cfg.description,
-            "sort": self.cfg.sort,
-            "type": self.cfg.type,
-            "field_name": self.cfg.field_name,
-            "format": self.cfg.format,
-            "reading": self.read()
+            "description": settings.description,
+            "sort": settings.sort,
+            "type": settings.type,
+            "field_name": settings.field_name,
+            "format": settings.format
         }
         return [sensorResultDict]
 
+    # Runs readObj() and records how long it took
+    def timedReadObj(self):
+        with SENSOR_READ_SECONDS.time(sensor=self.cfg.sectionName):
+            return self.readObj()
+
+    def readObj(self):
+        results = self.describeObj()
+        results[0]["reading"] = self.read()
+        return self.stampObj(results, None)
+
+    # Returns this sensor's reading objects with no readings, marked with an error message.
+    # Used when the sensor failed or didn't answer before its deadline.
+    def errorObj(self, error):
+        results = self.describeObj()
+        for result in results:
+            result["reading"] = None
+        return self.stampObj(results, error)
+
+    # Adds the error (None if the read worked) and the time of the reading to each reading object
+    def stampObj(self, results, error):
+        now = time.time()
+        for result in results:
+            result["error"] = error
+            result["time"] = now
+        return results
+
+    # Releases anything the sensor holds on to (called when a sensor is replaced after a config change)
+    def close(self):
+        pass
+
+    # Returns how often this sensor should be read, in seconds, from the 'interval' option in its
+    # ini section. Never shorter than the sensor's MIN_INTERVAL.
+    def getInterval(self, defaultVal):
+        interval = self.cfg.snapshot.interval
+        if interval is None:
+            interval = defaultVal
+        return max(interval, self.MIN_INTERVAL)
+
+    # Returns how long, in seconds, a read may take before it's reported as timed out, from the
+    # 'timeout' option in the sensor's ini section. Never longer than the scheduled interval, so a read
+    # is given up on before the next one is due.
+    def getTimeout(self, defaultVal):
+        timeout = self.cfg.snapshot.timeout
+        if timeout is None:
+            timeout = defaultVal
+        if self.scheduledInterval is not None:
+            timeout = min(timeout, self.scheduledInterval)
+        return timeout
+
 # DhtSensor: A digital sensor that returns the current temperature and humidity
 class DhtSensor(GenericSensor):
+    MIN_INTERVAL = 2.0  # The DHT22 datasheet asks for at least 2 seconds between reads
+    BUDGET_SHARE = 0.8  # Most of the scheduled interval the retries may take, leaving time to hand the reading in
+
     def __init__(self, iniSectionName):
         try:
             cfg = Config.DhtSensorConfig(iniSectionName)
@@ -39,8 +104,16 @@ class DhtSensor(GenericSensor):
             self.humidity = None
             self.error = None
 
+            # Here's our own module for reading the DHTxx Temp and Humidity Sensor. It imports RPi.GPIO
+            # (BCM pin numbers) itself, and only for the polling capture backend.
+            from dhtxx import DHTXX
+
             # set up DHTXX Sensor object
-            self.sensor = DHTXX(pin=cfg.pin, sensorType=eval(cfg.dht_type), scale=eval(cfg.scale))
+            settings = cfg.snapshot
+            self.sensor = DHTXX(pin=settings.pin, sensorType=ConfigPlan.resolveSymbol(settings.dht_type),
+                                scale=ConfigPlan.resolveSymbol(settings.scale),
+                                capture=settings.capture, chip=settings.gpio_chip,
+                                decoder=settings.decoder, capture_file=settings.capture_file)
         except Exception as ex:
             # Handle other exceptions
             print(type(ex))
@@ -48,44 +121,87 @@ class DhtSensor(GenericSensor):
             print(ex)
             raise(ex)
 
+    def close(self):
+        self.sensor.close()
+
+    # Returns the seconds read_and_retry() may spend: the 'read_budget' option, cut to fit the scheduled
+    # interval when there is one, so the retries are over before the read times out or the next one is due
+    def getReadBudget(self):
+        budget = self.cfg.snapshot.read_budget
+        if self.scheduledInterval is not None:
+            budget = min(budget or self.scheduledInterval, self.scheduledInterval * self.BUDGET_SHARE)
+        return budget
+
     def read_raw(self):
         return self.read()
     
     def read(self):
-        dhtVal = self.sensor.read_and_retry()
+        dhtVal = self.sensor.read_and_retry(budget=self.getReadBudget())
+        DHT_ATTEMPTS.observe(dhtVal.attempts, sensor=self.cfg.sectionName)
         if dhtVal.is_valid():
             self.temperature = str(round(dhtVal.temperature,1))
             self.humidity = str(round(dhtVal.humidity,1))
             self.error = None
-            return dhtVal
         else:
-            print("Error: %d" % resdhtValult.error_code)
+            print("Error: %d" % dhtVal.error_code)
             self.temperature = None
             self.humidity = None
             self.error = dhtVal.error_code
-            return {"Error": dhtVal.error_code}
+        return dhtVal
 
-    def readObj(self): # Need to override because we're returning two abjects
-        dhtVal = self.read()
-        if dhtVal.is_valid():
-            sensorResultDict1 = {
-                "description": self.cfg.description_temperature,
-                "sort": int(self.cfg.sort_temperature),
-                "type": self.cfg.type_temperature,
-                "field_name": self.cfg.field_name_temperature,
-                "format": self.cfg.format_temperature,
-                "reading": self.temperature
-            }
-            sensorResultDict2 = {
-                "description": self.cfg.description_humidity,
-                "sort": int(self.cfg.sort_humidity),
-                "type": self.cfg.type_humidity,
-                "field_name": self.cfg.field_name_humidity,
-                "format": self.cfg.format_humidity,
-                "reading": self.humidity
-            }
+    def describeObj(self): # Need to override because we're returning two abjects
+        settings = self.cfg.snapshot
+        sensorResultDict1 = {
+            "description": settings.description_temperature,
+            "sort": settings.sort_temperature,
+            "type": settings.type_temperature,
+            "field_name": settings.field_name_temperature,
+            "format": settings.format_temperature
+        }
+        sensorResultDict2 = {
+            "description": settings.description_humidity,
+            "sort": settings.sort_humidity,
+            "type": settings.type_humidity,
+            "field_name": settings.field_name_humidity,
+            "format": settings.format_humidity
+        }
         return [sensorResultDict1,sensorResultDict2]
 
+    def readObj(self):
+        dhtVal = self.read()
+        if not dhtVal.is_valid():
+            return self.errorObj(dhtVal.error_msg)
+
+        results = self.describeObj()
+        results[0]["reading"] = self.temperature
+        results[1]["reading"] = self.humidity
+        return self.stampObj(results, None)
+
+
+# McpChip: The MCP3008 Analog-to-Digital converter chip shared by the McpSensors.
+# The SPI bus and the chip are set up the first time a sensor asks for them, so hosts without
+# MCP sensors never import the Adafruit modules.
+class McpChip:
+    def __init__(self, chipSelect):
+        self.chipSelect = chipSelect   # The chip select pin, as a symbol like "board.D5"
+        self.mcp = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.mcp is None:
+                # These are all Adafruit modules that come with CircuitPython
+                # pip3 install adafruit-circuitpython-mcp3xxx
+                import busio      # handles the SPI bus protocol
+                import digitalio  # handles IO on the GPIO pins
+                import board      # Raspberry Pi pin name constants, etc.
+                import adafruit_mcp3xxx.mcp3008 as MCP  # handles the MCP3008
+
+                # Set up the SPI Bus, The chip select, and the MCP
+                spi = busio.SPI(clock=board.SCK, MISO=board.MISO, MOSI=board.MOSI)
+                cs = digitalio.DigitalInOut(ConfigPlan.resolveSymbol(self.chipSelect))
+                self.mcp = MCP.MCP3008(spi, cs)
+            return self.mcp
 
 # McpSensor: An analog sensor that returns a scaled value between 0 and VALUE_RANGE_SIZE
 # Used for Soil Moisture sensors and photo-resistor light sensors
@@ -93,16 +209,27 @@ class DhtSensor(GenericSensor):
 # Sensor must be calibrated to return a correct reading
 VALUE_RANGE_SIZE = 100 # number of values in our converted moisture range
 class McpSensor(GenericSensor):
+    # All MCP channels share one SPI bus, so reads from different threads take turns
+    busLock = threading.Lock()
+
     def __init__(self, iniSectionName, mcp):
         try:
             cfg = Config.McpSensorConfig(iniSectionName)
             self.cfg = cfg
 
-            # set up MoistureSensor or Photoresistor object
-            self.sensor = AnalogIn(mcp, cfg.mcp_pin)
+            # This is the Adafruit module that comes with CircuitPython
+            # It is used to read the (soil moisture and light) sensors attached to the MCP3xxx chip
+            # pip3 install adafruit-circuitpython-mcp3xxx
+            from adafruit_mcp3xxx.analog_in import AnalogIn # handles the sensor
 
-            # Factor for converting readings to a 0-100 range
-            self.factor = float(VALUE_RANGE_SIZE) / float(cfg.maxVal - cfg.minVal)
+            # set up MoistureSensor or Photoresistor object (mcp is an McpChip, or an MCP object that's already set up)
+            if isinstance(mcp, McpChip):
+                mcp = mcp.get()
+            self.sensor = AnalogIn(mcp, cfg.snapshot.mcp_pin)
+
+            # Factor for converting readings to a 0-100 range, and the snapshot it was worked out from
+            self.factorSettings = None
+            self.updateFactor()
 
         except Exception as ex:
             # Handle other exceptions
@@ -111,23 +238,30 @@ class McpSensor(GenericSensor):
             print(ex)
             raise(ex)
 
+    # Recalculates the factor for converting readings to a 0-100 range when the snapshot has been
+    # replaced (new bounds were saved, or the config changed)
+    def updateFactor(self):
+        settings = self.cfg.snapshot
+        if settings is not self.factorSettings:
+            self.factor = float(VALUE_RANGE_SIZE) / float(settings.maxVal - settings.minVal)
+            self.factorSettings = settings
+        return settings
+
     # Returns raw value
     def read_raw(self):
-        foundNewBounds = False
-        val = self.sensor.value
+        with McpSensor.busLock:
+            val = self.sensor.value
 
-        if (val > self.cfg.maxVal):         # Update the bounds in the ini file if it's outside
-            foundNewBounds = True           # the range of values seen so far
-            self.cfg.set('top', val)
+        settings = self.cfg.snapshot
+        if (val > settings.maxVal):         # Update the bounds in the ini file if it's outside
+            self.cfg.set('top', val)        # the range of values seen so far
+            MCP_BOUND_UPDATES.inc(sensor=self.cfg.sectionName, bound="top")
 
-        if (val < self.cfg.minVal):
-            foundNewBounds = True
+        if (val < settings.minVal):
             self.cfg.set('bottom', val)
-        
-        if (foundNewBounds):
-            # recalculate factor for converting readings to a 0-100 range
-            self.factor = float(VALUE_RANGE_SIZE) / float(self.cfg.maxVal - self.cfg.minVal)
+            MCP_BOUND_UPDATES.inc(sensor=self.cfg.sectionName, bound="bottom")
 
+        self.updateFactor()
         return val
     
     # Reads value from sensor and returns value converted to range from 0 to VALUE_RANGE_SIZE
@@ -137,8 +271,28 @@ class McpSensor(GenericSensor):
 
     # converts raw values to something from 0 to VALUE_RANGE_SIZE
     def convert(self, val):
-        newVal = float(val - self.cfg.minVal) * self.factor
-        if self.cfg.reverse:
+        settings = self.updateFactor()
+        newVal = float(val - settings.minVal) * self.factor
+        if settings.reverse:
             newVal =  float(VALUE_RANGE_SIZE) - (newVal)
         
         return newVal
+
+
+# Sensor types, by the 'type' option in a sensor's ini section. Each maker is called with the section
+# name and the McpChip, and returns the sensor. Add a new kind of sensor with registerSensorType().
+SENSOR_TYPES = {}
+
+def registerSensorType(sensorType, maker):
+    SENSOR_TYPES[sensorType] = maker
+
+# Returns a new sensor for the ini section, or None if its type isn't registered
+def makeSensor(sensorType, iniSectionName, mcp):
+    maker = SENSOR_TYPES.get(sensorType)
+    if maker is None:
+        return None
+    return maker(iniSectionName, mcp)
+
+registerSensorType("dht", lambda iniSectionName, mcp: DhtSensor(iniSectionName))
+registerSensorType("photo", McpSensor)
+registerSensorType("moisture", McpSensor)
@@ -0,0 +1,504 @@
+"""
+SimHardware: A simulated hardware backend so the whole pipeline, from initialize() to writeSQL(), runs on any
+Linux box. It stands in for RPi.GPIO, board, busio, digitalio, adafruit_mcp3xxx (MCP3008 and AnalogIn) and
+MySQLdb by putting simulated modules into sys.modules before the real ones are imported.
+
+Turn it on by setting the environment variable RPGARDEN_HARDWARE=sim before starting readSensors.py.
+RPGARDEN_SIM_PROFILE picks the latency model ("none", the default, or "pizero"), and RPGARDEN_SIM_TIME_SCALE
+speeds up the simulated clock (e.g. 1440 makes a simulated day pass in a minute).
+
+The values come from pluggable generators attached to the module-level simulation object:
+    simulation.mcpChannels[channel] = DriftingMoisture(...)   # or DayNightLight(...), ConstantValue(...), ...
+    simulation.dhtPins[pin] = DhtFrames(...)                  # with injectable CRC / missing data / no data errors
+Each generator has a value(t) method, where t is the simulated time in seconds since the epoch.
+
+The MySQLdb stand-in keeps the rpgarden2 table in a shared in-memory SQLite database, see database().
+"""
+
+import os
+import sys
+import math
+import time
+import random
+import types
+import threading
+
+# ==================================================================================================
+# Latency models: seconds of delay for each simulated operation
+# ==================================================================================================
+LATENCY_PROFILES = {
+    "none": {},
+    "pizero": {
+        "spi_transfer": 0.00015,  # one MCP3008 conversion over SPI
+        "gpio_setup": 0.0001,     # changing a pin's direction
+        "dht_capture": 0.006,     # the DHT sends its 40 bits after the start signal
+        "db_connect": 0.8,        # TCP and auth handshake over Wi-Fi
+        "db_execute": 0.02,       # one round trip to the database server
+        "db_commit": 0.03
+    }
+}
+
+# LatencyModel: Sleeps for the configured time (plus random jitter) for each operation
+class LatencyModel:
+    def __init__(self, latencies=None, jitter=0.1, rng=None):
+        self.latencies = dict(latencies or {})
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self.totals = {}   # operation -> [count, total seconds]
+
+    def delay(self, operation):
+        seconds = self.latencies.get(operation, 0.0)
+        if seconds > 0:
+            seconds *= 1.0 + self.rng.uniform(-self.jitter, self.jitter)
+            time.sleep(seconds)
+        total = self.totals.setdefault(operation, [0, 0.0])
+        total[0] += 1
+        total[1] += seconds
+
+
+# ==================================================================================================
+# Value generators
+# ==================================================================================================
+
+# ConstantValue: Always the same value, plus optional noise
+class ConstantValue:
+    def __init__(self, value, noise=0.0, rng=None):
+        self.constant = value
+        self.noise = noise
+        self.rng = rng or random.Random()
+
+    def value(self, t):
+        return self.constant + (self.rng.gauss(0, self.noise) if self.noise else 0)
+
+# DriftingMoisture: Raw soil moisture reading that dries out steadily until the plant is watered.
+# Higher raw values are dryer (that's why moisture sensors use reverse = True).
+class DriftingMoisture:
+    def __init__(self, wet=25000, dry=55000, dryingPerHour=600.0, noise=150.0, rng=None):
+        self.wet = wet
+        self.dry = dry
+        self.dryingPerHour = dryingPerHour
+        self.noise = noise
+        self.rng = rng or random.Random()
+
+    def value(self, t):
+        level = self.wet + ((t / 3600.0) * self.dryingPerHour) % (self.dry - self.wet)
+        return level + self.rng.gauss(0, self.noise)
+
+# DayNightLight: Raw photo-resistor reading that follows the sun between sunrise and sunset (local hours)
+class DayNightLight:
+    def __init__(self, night=2000, day=60000, sunrise=6.0, sunset=20.0, noise=300.0, rng=None):
+        self.night = night
+        self.day = day
+        self.sunrise = sunrise
+        self.sunset = sunset
+        self.noise = noise
+        self.rng = rng or random.Random()
+
+    def value(self, t):
+        hour = (t % 86400) / 3600.0
+        level = self.night
+        if self.sunrise < hour < self.sunset:
+            daylight = math.sin(math.pi * (hour - self.sunrise) / (self.sunset - self.sunrise))
+            level += (self.day - self.night) * daylight
+        return level + self.rng.gauss(0, self.noise)
+
+# DailyCycle: Smooth daily cycle between low and high, highest at peakHour. Used for temperature and humidity.
+class DailyCycle:
+    def __init__(self, low, high, peakHour=15.0, noise=0.0, rng=None):
+        self.low = low
+        self.high = high
+        self.peakHour = peakHour
+        self.noise = noise
+        self.rng = rng or random.Random()
+
+    def value(self, t):
+        hour = (t % 86400) / 3600.0
+        level = 0.5 + 0.5 * math.cos(2 * math.pi * (hour - self.peakHour) / 24.0)
+        return self.low + (self.high - self.low) * level + (self.rng.gauss(0, self.noise) if self.noise else 0)
+
+
+# ==================================================================================================
+# dhtSamples() - Builds the sample buffer DHTXX's polling loop would capture for one frame.
+# usPerSample is how long one loop iteration takes; jitter adds random noise to each period's length.
+# If flipBit is given, that data bit is inverted to produce a CRC error.
+# ==================================================================================================
+def dhtSamples(humidity, temperature, sensorType=22, usPerSample=5.0, jitter=0.3, flipBit=None, rng=random):
+    if sensorType == 11:
+        theBytes = [int(round(humidity)) & 255, 0, int(round(temperature)) & 255, 0]
+    else:
+        rawHumidity = int(round(humidity * 10))
+        rawTemperature = int(round(abs(temperature) * 10))
+        theBytes = [rawHumidity >> 8, rawHumidity & 255, rawTemperature >> 8, rawTemperature & 255]
+        if temperature < 0:
+            theBytes[2] |= 128
+    theBytes.append(sum(theBytes) & 255)
+
+    bits = [(byte >> (7 - i)) & 1 for byte in theBytes for i in range(8)]
+    if flipBit is not None:
+        bits[flipBit] ^= 1
+
+    # (level, microseconds): host release, sensor response, 40 data bits, end of frame
+    periods = [(1, 30), (0, 80), (1, 80)]
+    for bit in bits:
+        periods.append((0, 50))
+        periods.append((1, 70 if bit else 27))
+    periods.append((0, 50))
+
+    samples = []
+    for level, length in periods:
+        count = max(1, int(round(length / usPerSample + rng.uniform(-jitter, jitter))))
+        samples.extend([level] * count)
+    samples.extend([1] * 101)    # the polling loop stops after 100 unchanged samples
+    return samples
+
+# DhtFrames: Generates the polled sample buffer for each DHT read, with injected errors.
+# temperature (Celsius) and humidity are generators too. The error rates are probabilities per read.
+class DhtFrames:
+    def __init__(self, temperature=None, humidity=None, sensorType=22, crcErrorRate=0.05, missingDataRate=0.03,
+                 noDataRate=0.01, usPerSample=5.0, rng=None):
+        self.rng = rng or random.Random()
+        self.temperature = temperature or DailyCycle(14.0, 27.0, peakHour=15.0, noise=0.1, rng=self.rng)
+        self.humidity = humidity or DailyCycle(45.0, 80.0, peakHour=4.0, noise=0.5, rng=self.rng)
+        self.sensorType = sensorType
+        self.crcErrorRate = crcErrorRate
+        self.missingDataRate = missingDataRate
+        self.noDataRate = noDataRate
+        self.usPerSample = usPerSample
+
+    def value(self, t):
+        chance = self.rng.random()
+        if chance < self.noDataRate:
+            return [1] * 101
+        chance -= self.noDataRate
+
+        flipBit = None
+        if chance < self.crcErrorRate:
+            flipBit = self.rng.randrange(40)
+        chance -= self.crcErrorRate
+
+        samples = dhtSamples(max(0.0, min(99.9, self.humidity.value(t))), self.temperature.value(t), self.sensorType,
+                             usPerSample=self.usPerSample, flipBit=flipBit, rng=self.rng)
+        if chance < self.missingDataRate:
+            samples = samples[:len(samples) // 2] + [1] * 101
+        return samples
+
+
+# ==================================================================================================
+# Simulation: Holds the generators, the latency model and the simulated clock
+# ==================================================================================================
+class Simulation:
+    def __init__(self, profile="none", timeScale=1.0, seed=None):
+        self.rng = random.Random(seed)
+        self.latency = LatencyModel(LATENCY_PROFILES[profile], rng=self.rng)
+        self.timeScale = timeScale
+        self.startTime = time.time()
+        self.dbFailureRate = 0.0   # chance that a database connect or commit raises OperationalError
+
+        # Generators for the MCP3008 channels and the DHT pins (BCM numbers).
+        # Channels and pins without one read as mid-scale / a default DHT.
+        self.mcpChannels = {
+            0: DriftingMoisture(rng=self.rng),
+            1: DayNightLight(rng=self.rng)
+        }
+        self.dhtPins = {}
+        self.dhtDefaults = {}   # keyword arguments for the DhtFrames made for pins without a generator
+
+    # Simulated time in seconds since the epoch
+    def clock(self):
+        now = time.time()
+        return self.startTime + (now - self.startTime) * self.timeScale
+
+    def mcpValue(self, channel):
+        generator = self.mcpChannels.get(channel)
+        value = generator.value(self.clock()) if generator else 32768
+        return int(max(0, min(65535, value)))
+
+    def dhtSamples(self, pin):
+        if pin not in self.dhtPins:
+            self.dhtPins[pin] = DhtFrames(rng=self.rng, **self.dhtDefaults)
+        return self.dhtPins[pin].value(self.clock())
+
+
+simulation = Simulation(os.environ.get("RPGARDEN_SIM_PROFILE", "none"), float(os.environ.get("RPGARDEN_SIM_TIME_SCALE", "1")))
+
+
+# ==================================================================================================
+# Simulated RPi.GPIO
+# ==================================================================================================
+class SimGPIO:
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mode = None
+        self.outputs = {}   # pin -> last level written
+        self.frames = {}    # pin -> [samples, position] of the DHT frame being read
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        simulation.latency.delay("gpio_setup")
+        with self.lock:
+            if direction == SimGPIO.IN:
+                # Switching a pin to input after the start signal: the simulated DHT sends its frame
+                if self.outputs.get(pin) == SimGPIO.LOW:
+                    simulation.latency.delay("dht_capture")
+                    self.frames[pin] = [simulation.dhtSamples(pin), 0]
+            elif initial is not None:
+                self.outputs[pin] = initial
+
+    def output(self, pin, level):
+        with self.lock:
+            self.outputs[pin] = level
+
+    def input(self, pin):
+        frame = self.frames.get(pin)
+        if frame is None:
+            return self.outputs.get(pin, SimGPIO.HIGH)
+        samples, position = frame
+        if position >= len(samples):
+            return SimGPIO.HIGH
+        frame[1] = position + 1
+        return samples[position]
+
+    def cleanup(self, *args):
+        with self.lock:
+            self.outputs.clear()
+            self.frames.clear()
+
+
+# ==================================================================================================
+# Simulated board, busio, digitalio and adafruit_mcp3xxx
+# ==================================================================================================
+class SimPin:
+    def __init__(self, pinId):
+        self.id = pinId
+
+    def __repr__(self):
+        return "board.D%d" % self.id
+
+class SimSPI:
+    def __init__(self, clock, MOSI=None, MISO=None):
+        self.lock = threading.Lock()
+
+    def try_lock(self):
+        return self.lock.acquire(False)
+
+    def unlock(self):
+        self.lock.release()
+
+    def configure(self, baudrate=100000, polarity=0, phase=0, bits=8):
+        pass
+
+    def deinit(self):
+        pass
+
+class SimDigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.value = True
+
+    def deinit(self):
+        pass
+
+class SimMCP3008:
+    def __init__(self, spi_bus, cs, ref_voltage=3.3):
+        self.spi = spi_bus
+        self.cs = cs
+        self.reference_voltage = ref_voltage
+
+    # Returns the 10-bit conversion for a channel, like the real driver
+    def read(self, pin, is_differential=False):
+        simulation.latency.delay("spi_transfer")
+        return simulation.mcpValue(pin) >> 6
+
+class SimAnalogIn:
+    def __init__(self, mcp, positive_pin, negative_pin=None):
+        self._mcp = mcp
+        self._pin_setting = positive_pin
+
+    @property
+    def value(self):
+        return self._mcp.read(self._pin_setting) << 6
+
+    @property
+    def voltage(self):
+        return (self.value * self._mcp.reference_voltage) / 65535
+
+
+# ==================================================================================================
+# Simulated MySQLdb, backed by a shared in-memory SQLite database
+# ==================================================================================================
+SIM_DATABASE_URI = "file:rpgarden_sim?mode=memory&cache=shared"
+simDatabase = None       # Keeps the shared in-memory database alive
+simDatabaseLock = threading.Lock()
+
+class SimDatabaseError(Exception):
+    pass
+
+class SimOperationalError(SimDatabaseError):
+    pass
+
+# database() - Returns a connection to the simulated database, creating the rpgarden2 table the first time
+def database():
+    global simDatabase
+    with simDatabaseLock:
+        if simDatabase is None:
+            import sqlite3
+            simDatabase = sqlite3.connect(SIM_DATABASE_URI, uri=True, check_same_thread=False)
+            simDatabase.execute("CREATE TABLE IF NOT EXISTS rpgarden2 (pk INTEGER PRIMARY KEY AUTOINCREMENT, host TEXT, "
+                                "reading_time TEXT, sensor_name TEXT, sensor_type TEXT, sensor_value TEXT)")
+            simDatabase.commit()
+    return simDatabase
+
+# Turns MySQL-style SQL into SQLite SQL
+def translateSQL(sql):
+    return sql.replace("%s", "?").replace("INSERT IGNORE", "INSERT OR IGNORE")
+
+class SimCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.sqlite.cursor()
+        self.rowcount = -1
+        self.results = None     # Rows of a statement answered here rather than by SQLite
+
+    def execute(self, sql, args=None):
+        simulation.latency.delay("db_execute")
+        if sql.upper().startswith("SHOW INDEX FROM "):
+            return self.showIndex(sql.split()[3])
+        self.results = None
+        self.cursor.execute(translateSQL(sql), args or ())
+        self.rowcount = self.cursor.rowcount
+        return self.rowcount
+
+    def executemany(self, sql, args):
+        simulation.latency.delay("db_execute")
+        self.results = None
+        self.cursor.executemany(translateSQL(sql), args)
+        self.rowcount = self.cursor.rowcount
+        return self.rowcount
+
+    # SHOW INDEX, from SQLite's index lists: (Table, Non_unique, Key_name, Seq_in_index, Column_name)
+    def showIndex(self, table):
+        rows = []
+        for seq, name, unique, origin, partial in self.cursor.execute("PRAGMA index_list(%s)" % table).fetchall():
+            for seqno, cid, column in self.cursor.execute("PRAGMA index_info(%s)" % name).fetchall():
+                rows.append((table, 0 if unique else 1, name, seqno + 1, column))
+        self.results = rows
+        self.rowcount = len(rows)
+        return self.rowcount
+
+    def fetchone(self):
+        if self.results is not None:
+            return self.results.pop(0) if self.results else None
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        if self.results is not None:
+            rows, self.results = self.results, []
+            return rows
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+class SimConnection:
+    def __init__(self, *args, **kwargs):
+        simulation.latency.delay("db_connect")
+        if simulation.rng.random() < simulation.dbFailureRate:
+            raise SimOperationalError(2003, "Can't connect to simulated MySQL server")
+        database()
+        import sqlite3
+        self.sqlite = sqlite3.connect(SIM_DATABASE_URI, uri=True, check_same_thread=False)
+        self.open = True
+
+    def cursor(self):
+        return SimCursor(self)
+
+    def commit(self):
+        simulation.latency.delay("db_commit")
+        if simulation.rng.random() < simulation.dbFailureRate:
+            raise SimOperationalError(2013, "Lost connection to simulated MySQL server during query")
+        self.sqlite.commit()
+
+    def rollback(self):
+        self.sqlite.rollback()
+
+    def ping(self, reconnect=False):
+        if not self.open:
+            raise SimOperationalError(2006, "Simulated MySQL server has gone away")
+
+    def close(self):
+        self.open = False
+        self.sqlite.close()
+
+
+# ==================================================================================================
+# install() - Puts the simulated modules into sys.modules so "import RPi.GPIO" and friends get them
+# ==================================================================================================
+def makeModule(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    module.__dict__["__simulated__"] = True
+    return module
+
+def install():
+    gpio = SimGPIO()
+    gpioAttributes = dict((name, getattr(SimGPIO, name)) for name in dir(SimGPIO) if name.isupper())
+    for name in ("setmode", "setwarnings", "setup", "output", "input", "cleanup"):
+        gpioAttributes[name] = getattr(gpio, name)
+    gpioModule = makeModule("RPi.GPIO", **gpioAttributes)
+
+    boardAttributes = dict(("D%d" % pin, SimPin(pin)) for pin in range(28))
+    boardAttributes.update(SCK=SimPin(11), MOSI=SimPin(10), MISO=SimPin(9), CE0=SimPin(8), CE1=SimPin(7),
+                           SCL=SimPin(3), SDA=SimPin(2))
+
+    mcp3008Attributes = dict(("P%d" % channel, channel) for channel in range(8))
+    mcp3008Attributes["MCP3008"] = SimMCP3008
+
+    modules = {
+        "RPi": makeModule("RPi", GPIO=gpioModule),
+        "RPi.GPIO": gpioModule,
+        "board": makeModule("board", **boardAttributes),
+        "busio": makeModule("busio", SPI=SimSPI),
+        "digitalio": makeModule("digitalio", DigitalInOut=SimDigitalInOut),
+        "adafruit_mcp3xxx": makeModule("adafruit_mcp3xxx"),
+        "adafruit_mcp3xxx.mcp3008": makeModule("adafruit_mcp3xxx.mcp3008", **mcp3008Attributes),
+        "adafruit_mcp3xxx.analog_in": makeModule("adafruit_mcp3xxx.analog_in", AnalogIn=SimAnalogIn),
+        "MySQLdb": makeModule("MySQLdb", connect=SimConnection, Connect=SimConnection, Error=SimDatabaseError,
+                              OperationalError=SimOperationalError)
+    }
+    modules["adafruit_mcp3xxx"].mcp3008 = modules["adafruit_mcp3xxx.mcp3008"]
+    modules["adafruit_mcp3xxx"].analog_in = modules["adafruit_mcp3xxx.analog_in"]
+    sys.modules.update(modules)
+    return simulation
+
+# Installs the simulated hardware if RPGARDEN_HARDWARE=sim is set in the environment
+def installIfRequested():
+    if os.environ.get("RPGARDEN_HARDWARE", "").lower() == "sim":
+        return install()
+    return None
+
+# Installs the simulated hardware if the real RPi.GPIO isn't available (for offline tools that only
+# need the driver modules to import)
+def installIfMissing():
+    try:
+        import RPi.GPIO
+    except (ImportError, RuntimeError):
+        return install()
+    return None
@@ -0,0 +1,480 @@
+"""
+CsvSink: Writes rows of readings to the tab-delimited log file, keeping the file open between cycles.
+
+The file is opened once (in append mode, with a large write buffer) and a header row is written only if the
+file was empty. Rows are buffered in memory and written to the file once flush_rows rows are waiting, or when
+a row is added flush_interval seconds or more after the last flush. With fsync on, each flush also waits for
+the data to reach the SD card. At every flush the sink checks that the file it has open is still the one at
+the log path, and reopens it if the file was moved or deleted (by logrotate, for example).
+
+SegmentedCsvSink splits the log into daily and/or size-limited segments, each with its own header, lists
+them in a manifest with their time ranges and columns, and gzips closed segments in the background.
+
+Every csv_index_rows rows the sink also adds an entry to the file's sparse time index (<file>.idx), which
+LogIndex.queryLog() uses to seek straight to a time range instead of reading the whole log.
+
+SqliteSink keeps the readings in a local SQLite database with the same rpgarden2 table as the central
+MySQL/MariaDB database, indexed on (sensor_name, reading_time), so a Pi can answer its own queries without
+the network. It runs in WAL mode, and rows are committed in one transaction per sqlite_commit_interval
+seconds instead of one per cycle. Rows not yet committed are lost if the process dies, not the database.
+
+Used through getCsvSink() and getSqliteSink(), which keep one sink per file for the life of the process.
+closeAll() flushes and closes them; it also runs when the process exits.
+"""
+
+import io
+import os
+import csv
+import gzip
+import json
+import time
+import queue
+import shutil
+import atexit
+import threading
+import traceback
+
+import LogIndex
+
+# CsvSink: One open, buffered log file
+class CsvSink:
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, fileName, flushRows=1, flushInterval=0.0, fsync=False, indexRows=0, clock=time.monotonic):
+        self.fileName = fileName
+        self.flushRows = max(int(flushRows), 1)
+        self.flushInterval = flushInterval
+        self.fsync = fsync
+        self.indexRows = indexRows  # Add an entry to the file's time index every indexRows rows (0 for no index)
+        self.clock = clock
+        self.lock = threading.Lock()
+
+        # Rows are formatted into this small buffer, then written to the file as bytes
+        self.rowText = io.StringIO()
+        self.writer = csv.writer(self.rowText, dialect=csv.excel_tab, quoting=csv.QUOTE_NONE)
+
+        self.logFile = None
+        self.headerWritten = False
+        self.fileOffset = 0        # Where the next row will start in the file
+        self.index = None
+        self.rowsSinceIndex = 0
+        self.pendingRows = 0       # Rows written to the buffer since the last flush
+        self.lastFlush = clock()
+
+    # Opens the file for appending, creating its directory if needed
+    def open(self):
+        logDir = os.path.dirname(self.fileName)
+        if logDir:
+            os.makedirs(logDir, exist_ok=True)
+        self.logFile = open(self.fileName, mode='ab', buffering=self.BUFFER_SIZE)
+        self.fileOffset = self.logFile.tell()
+        self.headerWritten = self.fileOffset > 0
+        if self.indexRows > 0:
+            # An index left next to a new log (after logrotate, say) is the old file's: empty it. One that
+            # doesn't match a log someone else put there is rebuilt.
+            if self.fileOffset > 0 and not LogIndex.indexMatches(self.fileName):
+                LogIndex.buildIndex(self.fileName, self.indexRows)
+            self.index = LogIndex.IndexWriter(LogIndex.indexFileName(self.fileName), truncate=self.fileOffset == 0)
+            self.rowsSinceIndex = self.indexRows   # Start the index again from the next row
+
+    # Formats a row and adds it to the file's buffer. Returns the number of bytes.
+    def writeRow(self, values):
+        self.rowText.seek(0)
+        self.rowText.truncate()
+        self.writer.writerow(values)
+        data = self.rowText.getvalue().encode("utf-8")
+        self.logFile.write(data)
+        self.fileOffset += len(data)
+        return len(data)
+
+    # Adds a row for the readings: the time, then each reading's value. Writes the header first if the
+    # file is new. Returns the number of bytes added.
+    def write(self, readings, timeText):
+        with self.lock:
+            return self.writeLocked(readings, timeText)
+
+    def writeLocked(self, readings, timeText):
+        if self.logFile is None:
+            self.open()
+
+        written = 0
+        if not self.headerWritten:
+            fieldNames = ["Time"]
+            for reading in readings:
+                fieldNames.append(reading["field_name"])
+            written += self.writeRow(fieldNames)
+            self.headerWritten = True
+
+        if self.index is not None and self.rowsSinceIndex >= self.indexRows:
+            self.index.add(self.fileOffset, LogIndex.parseTime(timeText))
+            self.rowsSinceIndex = 0
+        self.rowsSinceIndex += 1
+
+        fieldVals = [timeText]
+        for reading in readings:
+            fieldVals.append(reading["reading"])
+        written += self.writeRow(fieldVals)
+        self.pendingRows += 1
+
+        if self.pendingRows >= self.flushRows or self.clock() - self.lastFlush >= self.flushInterval:
+            self.flushLocked()
+        return written
+
+    # Writes the buffered rows to the file (and to the card, with fsync on)
+    def flush(self):
+        with self.lock:
+            self.flushLocked()
+
+    def flushLocked(self):
+        if self.logFile is None:
+            return
+        self.logFile.flush()
+        if self.fsync:
+            os.fsync(self.logFile.fileno())
+        self.pendingRows = 0
+        self.lastFlush = self.clock()
+
+        # If the file was moved or deleted, start a new one at the log path with the next row
+        try:
+            moved = os.stat(self.fileName).st_ino != os.fstat(self.logFile.fileno()).st_ino
+        except OSError:
+            moved = True
+        if moved:
+            self.closeLocked()
+
+    def close(self):
+        with self.lock:
+            self.closeLocked()
+
+    def closeLocked(self):
+        if self.logFile is not None:
+            self.logFile.flush()
+            if self.fsync:
+                os.fsync(self.logFile.fileno())
+            self.logFile.close()
+            self.logFile = None
+            self.pendingRows = 0
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+
+# LogManifest: The list of a segmented log's files, saved as JSON next to them. Each segment is a dict:
+#    file        name of the segment in the log directory (ends in .gz once compressed)
+#    start, end  times of its first and last rows (end is None while the segment is open)
+#    columns     its header row
+#    rows        number of data rows
+#    closed      True once nothing more will be written to it
+#    compressed  True once it has been gzipped
+class LogManifest:
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.lock = threading.Lock()
+        self.segments = []
+        try:
+            with open(fileName) as manifestFile:
+                self.segments = json.load(manifestFile)["segments"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as ex:
+            print("!!! Starting a new manifest, couldn't read " + fileName)
+            print(ex)
+
+    def add(self, segment):
+        with self.lock:
+            self.segments.append(segment)
+
+    # Changes some of a segment's properties
+    def update(self, segment, **changes):
+        with self.lock:
+            segment.update(changes)
+
+    def save(self):
+        with self.lock:
+            tempName = self.fileName + ".tmp"
+            with open(tempName, "w") as manifestFile:
+                json.dump({"segments": self.segments}, manifestFile, indent=1)
+            os.replace(tempName, self.fileName)
+
+    # Returns the segments that may hold rows between the start and end times ("YYYY-MM-DD HH:MM:SS", or None
+    # for no limit). Open segments are always included, since their end isn't known yet.
+    def segmentsBetween(self, start=None, end=None):
+        with self.lock:
+            segments = list(self.segments)
+        return [segment for segment in segments
+                if (end is None or segment["start"] <= end) and
+                   (start is None or not segment["closed"] or segment["end"] is None or segment["end"] >= start)]
+
+# Opens a segment of a log for reading, whether or not it has been compressed
+def openSegment(logDir, segment):
+    fileName = os.path.join(logDir, segment["file"])
+    if segment["compressed"]:
+        return gzip.open(fileName, mode="rt", newline='')
+    return open(fileName, newline='')
+
+# Returns the time (first field) of the last row in a log file, or None if it has no data rows
+def lastRowTime(fileName):
+    try:
+        with open(fileName, "rb") as logFile:
+            logFile.seek(0, os.SEEK_END)
+            logFile.seek(max(logFile.tell() - 4096, 0))
+            lines = logFile.read().splitlines()
+    except OSError:
+        return None
+    if len(lines) < 2 or not lines[-1]:
+        return None
+    return lines[-1].split(b"\t")[0].decode("utf-8", "replace")
+
+
+# Background compression of closed segments: one worker thread, started the first time it's needed
+compressQueue = queue.Queue()
+compressThread = None
+compressLock = threading.Lock()
+
+def compressLater(manifest, logDir, segment):
+    global compressThread
+    with compressLock:
+        if compressThread is None:
+            compressThread = threading.Thread(target=compressWorker, name="log-compress", daemon=True)
+            compressThread.start()
+    compressQueue.put((manifest, logDir, segment))
+
+def compressWorker():
+    while True:
+        manifest, logDir, segment = compressQueue.get()
+        try:
+            compressSegment(manifest, logDir, segment)
+        except Exception:
+            print(traceback.format_exc())
+        finally:
+            compressQueue.task_done()
+
+# Gzips a closed segment. The manifest points at the .gz file before the original is deleted, so a crash
+# part way through leaves both files rather than none.
+def compressSegment(manifest, logDir, segment):
+    fileName = os.path.join(logDir, segment["file"])
+    gzipName = fileName + ".gz"
+    tempName = gzipName + ".tmp"
+    with open(fileName, "rb") as source, open(tempName, "wb") as target:
+        with gzip.GzipFile(filename=os.path.basename(fileName), mode="wb", fileobj=target) as gzipped:
+            shutil.copyfileobj(source, gzipped)
+        target.flush()
+        os.fsync(target.fileno())
+    os.replace(tempName, gzipName)
+    manifest.update(segment, file=segment["file"] + ".gz", compressed=True, bytes=os.path.getsize(gzipName))
+    manifest.save()
+    os.remove(fileName)
+    if os.path.exists(LogIndex.indexFileName(fileName)):   # Byte offsets mean nothing in the .gz
+        os.remove(LogIndex.indexFileName(fileName))
+
+# Waits until the segments queued for compression are done
+def waitForCompression():
+    if compressThread is not None:
+        compressQueue.join()
+
+
+# SegmentedCsvSink: A CsvSink that splits the log into segments, each with its own header row.
+# A new segment is started when the UTC day changes (rotate = "daily"), when the segment reaches maxBytes,
+# and when the columns change (a sensor was added or removed). Segments are named <log name>-YYYYMMDD-NNN.csv
+# and listed in <log name>.manifest.json. Closed segments are gzipped on a background thread.
+class SegmentedCsvSink(CsvSink):
+    def __init__(self, fileName, rotate="daily", maxBytes=0, compress=True, **kwargs):
+        super().__init__(fileName, **kwargs)
+        self.logDir = os.path.dirname(fileName) or "."
+        self.baseName = os.path.splitext(os.path.basename(fileName))[0]
+        self.rotate = rotate
+        self.maxBytes = maxBytes
+        self.compress = compress
+        self.manifest = None       # Loaded with the first row
+        self.segment = None        # Manifest entry of the open segment
+        self.segmentBytes = 0
+        self.lastTime = None       # Time of the last row written to the open segment
+
+    def writeLocked(self, readings, timeText):
+        columns = ["Time"]
+        for reading in readings:
+            columns.append(reading["field_name"])
+
+        if self.manifest is None:
+            self.resume()
+        if self.segment is not None and self.needsNewSegment(columns, timeText):
+            self.finishSegment()
+        if self.segment is None:
+            self.startSegment(columns, timeText)
+
+        written = super().writeLocked(readings, timeText)
+        self.segmentBytes += written
+        self.lastTime = timeText
+        self.segment["rows"] += 1
+        return written
+
+    def needsNewSegment(self, columns, timeText):
+        return (columns != self.segment["columns"] or
+                (self.rotate == "daily" and timeText[:10] != self.segment["start"][:10]) or
+                (self.maxBytes > 0 and self.segmentBytes >= self.maxBytes))
+
+    # Loads the manifest, picks up the last segment if it was left open, and queues any closed segments
+    # that didn't get compressed (the process stopped first)
+    def resume(self):
+        os.makedirs(self.logDir, exist_ok=True)
+        self.manifest = LogManifest(os.path.join(self.logDir, self.baseName + ".manifest.json"))
+        for segment in self.manifest.segments:
+            segmentFile = os.path.join(self.logDir, segment["file"])
+            if not segment["closed"]:
+                if os.path.exists(segmentFile):
+                    self.segment = segment
+                    self.fileName = segmentFile
+                    self.segmentBytes = os.path.getsize(segmentFile)
+                    self.lastTime = lastRowTime(segmentFile) or segment["start"]
+                else:
+                    self.manifest.update(segment, closed=True, end=segment["start"])
+            elif self.compress and not segment["compressed"] and os.path.exists(segmentFile):
+                compressLater(self.manifest, self.logDir, segment)
+
+    def startSegment(self, columns, timeText):
+        day = timeText[:10].replace("-", "")
+        sequence = sum(1 for segment in self.manifest.segments if segment["file"].startswith(self.baseName + "-" + day + "-"))
+        while True:
+            name = "%s-%s-%03d.csv" % (self.baseName, day, sequence)
+            if not os.path.exists(os.path.join(self.logDir, name)) and not os.path.exists(os.path.join(self.logDir, name + ".gz")):
+                break
+            sequence += 1
+
+        self.segment = {"file": name, "start": timeText, "end": None, "columns": columns, "rows": 0,
+                        "closed": False, "compressed": False}
+        self.fileName = os.path.join(self.logDir, name)
+        self.segmentBytes = 0
+        self.lastTime = None
+        self.manifest.add(self.segment)
+        self.manifest.save()
+
+    def finishSegment(self):
+        CsvSink.closeLocked(self)
+        segment = self.segment
+        self.manifest.update(segment, closed=True, end=self.lastTime or segment["start"], bytes=self.segmentBytes)
+        self.manifest.save()
+        if self.compress:
+            compressLater(self.manifest, self.logDir, segment)
+        self.segment = None
+
+    # Closes the file, leaving the segment open so the next run keeps appending to it
+    def closeLocked(self):
+        super().closeLocked()
+        if self.segment is not None and self.manifest is not None:
+            self.manifest.save()
+
+
+# SqliteSink: A local SQLite copy of the database table, written in batched transactions
+class SqliteSink:
+    def __init__(self, fileName, commitInterval=0.0, fsync=False, clock=time.monotonic):
+        import sqlite3    # Only needed when this sink is configured
+        self.fileName = fileName
+        self.commitInterval = commitInterval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.lastCommit = clock()
+
+        os.makedirs(os.path.dirname(fileName) or ".", exist_ok=True)
+        self.db = sqlite3.connect(fileName, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=%s" % ("FULL" if fsync else "NORMAL"))
+        self.db.execute("CREATE TABLE IF NOT EXISTS rpgarden2 (pk INTEGER PRIMARY KEY AUTOINCREMENT, host TEXT, "
+                        "reading_time TEXT, sensor_name TEXT, sensor_type TEXT, sensor_value)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS rpgarden2_sensor_time ON rpgarden2 (sensor_name, reading_time)")
+        self.db.commit()
+
+    # Adds rows of (host, reading_time, sensor_name, sensor_type, sensor_value), committing them (and any
+    # earlier rows) if commitInterval seconds have passed since the last commit. Returns the number of rows.
+    def write(self, rows):
+        with self.lock:
+            self.db.executemany("INSERT INTO rpgarden2 (host, reading_time, sensor_name, sensor_type, sensor_value) "
+                                "VALUES (?, ?, ?, ?, ?)", rows)
+            if self.clock() - self.lastCommit >= self.commitInterval:
+                self.commitLocked()
+            return len(rows)
+
+    def commitLocked(self):
+        if self.db.in_transaction:
+            self.db.commit()
+        self.lastCommit = self.clock()
+
+    def flush(self):
+        with self.lock:
+            self.commitLocked()
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.commitLocked()
+                self.db.close()
+                self.db = None
+
+
+# The process's open sinks, by file name
+csvSinks = {}
+csvSinksLock = threading.Lock()
+sqliteSinks = {}
+
+# ==================================================================================================
+# getCsvSink() - Returns the sink for the log_file in [General], opening it the first time. Options:
+#    csv_flush_rows      rows buffered before they're written to the file (default 1)
+#    csv_flush_interval  seconds after which the next row flushes the buffer (default 0: every row)
+#    csv_fsync           fsync the file at each flush (default false)
+#    csv_index_rows      add an entry to the file's time index every this many rows (default 0: no index)
+#    log_rotate          "daily" for one segment per UTC day, "none" for a single file (default none)
+#    log_max_bytes       start a new segment once one reaches this size (default 0: no limit)
+#    log_compress        gzip closed segments (default true)
+# With log_rotate or log_max_bytes set, the log is a SegmentedCsvSink and log_file only names the segments.
+# ==================================================================================================
+def getCsvSink(rpgConfig):
+    fileName = rpgConfig.get("log_file")
+    with csvSinksLock:
+        sink = csvSinks.get(fileName)
+        if sink is None:
+            options = {
+                "indexRows": rpgConfig.getint("csv_index_rows", defaultVal=0),
+                "flushRows": rpgConfig.getint("csv_flush_rows", defaultVal=1),
+                "flushInterval": rpgConfig.getfloat("csv_flush_interval", defaultVal=0.0),
+                "fsync": rpgConfig.getboolean("csv_fsync", defaultVal=False)
+            }
+            rotate = rpgConfig.get("log_rotate", "none")
+            maxBytes = rpgConfig.getint("log_max_bytes", defaultVal=0)
+            if rotate != "none" or maxBytes > 0:
+                sink = SegmentedCsvSink(fileName, rotate=rotate, maxBytes=maxBytes,
+                                        compress=rpgConfig.getboolean("log_compress", defaultVal=True), **options)
+            else:
+                sink = CsvSink(fileName, **options)
+            csvSinks[fileName] = sink
+        return sink
+
+# ==================================================================================================
+# getSqliteSink() - Returns the sink for sqlite_file in [General] (None if it isn't set). Options:
+#    sqlite_commit_interval  seconds between commits; rows in between share a transaction (default 0: every write)
+#    sqlite_fsync            sync the database to the SD card at each commit (default false)
+# ==================================================================================================
+def getSqliteSink(rpgConfig):
+    fileName = rpgConfig.get("sqlite_file")
+    if not fileName:
+        return None
+    with csvSinksLock:
+        sink = sqliteSinks.get(fileName)
+        if sink is None:
+            sink = sqliteSinks[fileName] = SqliteSink(fileName,
+                                                      commitInterval=rpgConfig.getfloat("sqlite_commit_interval", defaultVal=0.0),
+                                                      fsync=rpgConfig.getboolean("sqlite_fsync", defaultVal=False))
+        return sink
+
+# Flushes and closes every open sink, and waits for segments still being compressed
+def closeAll():
+    with csvSinksLock:
+        sinks = list(csvSinks.values()) + list(sqliteSinks.values())
+        csvSinks.clear()
+        sqliteSinks.clear()
+    for sink in sinks:
+        try:
+            sink.close()
+        except Exception:
+            print(traceback.format_exc())
+    waitForCompression()
+
+atexit.register(closeAll)
@@ -0,0 +1,212 @@
+"""
+Spool: A local, durable queue of database rows waiting to be sent to MySQL/MariaDB.
+
+With spool_file set, writeSQL() doesn't talk to the database at all: it adds the cycle's rows to the spool (a
+SQLite file in WAL mode) and returns. A drainer sends the rows on in large batches and removes them from the
+spool only after the database has committed them. In daemon mode the drainer is a background thread, woken
+after every add and every spool_drain_interval seconds; a one-shot run drains what it can before it exits.
+So a database outage costs nothing at sampling time, and when the database comes back the backlog goes up
+a few thousand rows per transaction.
+
+The drainer's inserts are INSERT IGNORE, so a batch that was committed but not yet removed from the spool
+(the Pi lost power in between, say) isn't stored twice when it's sent again. That needs a unique key on
+(host, sensor_name, reading_time) in the rpgarden2 table:
+    ALTER TABLE rpgarden2 ADD UNIQUE KEY host_sensor_time (host, sensor_name, reading_time);
+The drainer checks for the key (SHOW INDEX) before its first batch. Without it, each batch is checked against
+the rows already in the table over the batch's time range, which costs a query per batch.
+Note that reading_time has one-second resolution by default, so two readings of a sensor in the same second
+count as duplicates; when sampling that fast, set aggregate_window (see Aggregator.py), or make the column
+DATETIME(3) and set sql_time_decimals = 3.
+
+The spool is kept within limits when rows are added: rows older than spool_max_age seconds are dropped, and
+then the oldest rows beyond spool_max_rows. Dropped rows are counted in rpgarden_spool_dropped_total.
+
+With spool_fsync on (the default), every add is synced to the SD card before writeSQL() returns. Turning it
+off saves SD card writes: SQLite then syncs the WAL at checkpoints only, so a power cut can lose the last few
+cycles, but never corrupts the spool.
+"""
+
+import os
+import time
+import atexit
+import threading
+import traceback
+
+import Metrics
+
+SPOOL_ROWS = Metrics.gauge("rpgarden_spool_rows", "Rows in the spool waiting to be sent to the database")
+SPOOL_SENT = Metrics.counter("rpgarden_spool_sent_total", "Spooled rows committed to the database")
+SPOOL_DROPPED = Metrics.counter("rpgarden_spool_dropped_total", "Spooled rows dropped before they were sent, by reason (age, size)", ["reason"])
+
+# Spool: The queue itself
+class Spool:
+    def __init__(self, fileName, maxRows=100000, maxAge=7 * 24 * 3600.0, batchSize=5000, fsync=True, clock=time.time):
+        import sqlite3    # Only needed when spooling
+        self.fileName = fileName
+        self.maxRows = maxRows
+        self.maxAge = maxAge
+        self.batchSize = max(int(batchSize), 1)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.drainLock = threading.Lock()   # One drain at a time
+        self.drainer = None
+
+        os.makedirs(os.path.dirname(fileName) or ".", exist_ok=True)
+        self.db = sqlite3.connect(fileName, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=%s" % ("FULL" if fsync else "NORMAL"))
+        self.db.execute("CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, spooled REAL, host TEXT, "
+                        "reading_time TEXT, sensor_name TEXT, sensor_type TEXT, sensor_value)")
+        self.db.commit()
+        SPOOL_ROWS.set(self.count())
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    # Adds rows of (host, reading_time, sensor_name, sensor_type, sensor_value), then trims the spool to its limits
+    def add(self, rows):
+        now = self.clock()
+        with self.lock:
+            with self.db:    # One transaction
+                self.db.executemany("INSERT INTO spool (spooled, host, reading_time, sensor_name, sensor_type, sensor_value) "
+                                    "VALUES (?, ?, ?, ?, ?, ?)", [(now,) + tuple(row) for row in rows])
+                if self.maxAge > 0:
+                    dropped = self.db.execute("DELETE FROM spool WHERE spooled < ?", (now - self.maxAge,)).rowcount
+                    if dropped > 0:
+                        print("!!! Spool: dropped %d rows older than %.0f seconds" % (dropped, self.maxAge))
+                        SPOOL_DROPPED.inc(dropped, reason="age")
+                if self.maxRows > 0:
+                    # Rows are only removed from the front, so the ids left are (nearly) contiguous
+                    dropped = self.db.execute("DELETE FROM spool WHERE id <= (SELECT MAX(id) FROM spool) - ?",
+                                              (self.maxRows,)).rowcount
+                    if dropped > 0:
+                        print("!!! Spool: full, dropped the oldest %d rows" % dropped)
+                        SPOOL_DROPPED.inc(dropped, reason="size")
+            SPOOL_ROWS.set(self.db.execute("SELECT COUNT(*) FROM spool").fetchone()[0])
+        if self.drainer is not None:
+            self.drainer.wake()
+
+    # Returns up to limit of the oldest rows, as (id, host, reading_time, sensor_name, sensor_type, sensor_value)
+    def peek(self, limit):
+        with self.lock:
+            return self.db.execute("SELECT id, host, reading_time, sensor_name, sensor_type, sensor_value FROM spool "
+                                   "ORDER BY id LIMIT ?", (limit,)).fetchall()
+
+    # Removes the rows up to and including lastId
+    def remove(self, lastId):
+        with self.lock:
+            with self.db:
+                self.db.execute("DELETE FROM spool WHERE id <= ?", (lastId,))
+            SPOOL_ROWS.set(self.db.execute("SELECT COUNT(*) FROM spool").fetchone()[0])
+
+    # Sends spooled rows, oldest first, batchSize at a time, until the spool is empty, a batch fails or maxSeconds
+    # have passed. upload(rows) sends and commits a list of rows, returning True if they were saved.
+    # Returns the number of rows sent.
+    def drain(self, upload, maxSeconds=None):
+        sent = 0
+        startTime = time.monotonic()
+        with self.drainLock:
+            while True:
+                batch = self.peek(self.batchSize)
+                if not batch:
+                    break
+                if not upload([row[1:] for row in batch]):
+                    break
+                self.remove(batch[-1][0])     # Only once the database has the rows
+                sent += len(batch)
+                SPOOL_SENT.inc(len(batch))
+                if maxSeconds is not None and time.monotonic() - startTime >= maxSeconds:
+                    break
+        if sent:
+            print("Spool: sent %d rows to the database" % sent)
+        return sent
+
+    # Starts draining on a background thread
+    def startDrainer(self, upload, interval=10.0):
+        if self.drainer is None:
+            self.drainer = Drainer(self, upload, interval)
+            self.drainer.start()
+
+    def close(self):
+        if self.drainer is not None:
+            self.drainer.stop()
+            self.drainer = None
+        with self.lock:
+            self.db.close()
+
+
+# Drainer: A thread that drains the spool whenever rows are added, and every interval seconds
+class Drainer:
+    def __init__(self, spool, upload, interval):
+        self.spool = spool
+        self.upload = upload
+        self.interval = interval
+        self.event = threading.Event()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="spool-drainer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def wake(self):
+        self.event.set()
+
+    def run(self):
+        while not self.stopping:
+            self.event.wait(self.interval)
+            self.event.clear()
+            if self.stopping:
+                break
+            try:
+                self.spool.drain(self.upload)
+            except Exception:
+                print(traceback.format_exc())
+
+    # Waits for a drain in progress to finish its batch; rows left stay spooled for next time
+    def stop(self, timeout=30.0):
+        self.stopping = True
+        self.event.set()
+        self.thread.join(timeout)
+
+
+# The process's spools, by file name
+spools = {}
+spoolsLock = threading.Lock()
+
+# ==================================================================================================
+# getSpool() - Returns the spool for spool_file in [General] (None if it isn't set). Options:
+#    spool_file            SQLite file for the spool
+#    spool_max_rows        most rows kept; the oldest are dropped beyond this (default 100000, 0 for no limit)
+#    spool_max_age         rows older than this many seconds are dropped (default 604800, a week; 0 for no limit)
+#    spool_batch_size      rows sent to the database per transaction when draining (default 5000)
+#    spool_drain_interval  seconds between drain attempts while the daemon has nothing new (default 10)
+#    spool_fsync           sync the spool to the SD card on every add (default true)
+#    spool_drain_time      most seconds a one-shot run spends draining (default 30, see readSensors.drainSpool())
+# ==================================================================================================
+def getSpool(rpgConfig):
+    fileName = rpgConfig.get("spool_file")
+    if not fileName:
+        return None
+    with spoolsLock:
+        spool = spools.get(fileName)
+        if spool is None:
+            spool = spools[fileName] = Spool(fileName,
+                                             maxRows=rpgConfig.getint("spool_max_rows", defaultVal=100000),
+                                             maxAge=rpgConfig.getfloat("spool_max_age", defaultVal=7 * 24 * 3600.0),
+                                             batchSize=rpgConfig.getint("spool_batch_size", defaultVal=5000),
+                                             fsync=rpgConfig.getboolean("spool_fsync", defaultVal=True))
+        return spool
+
+# Stops the drainers and closes every spool
+def closeAll():
+    with spoolsLock:
+        openSpools = list(spools.values())
+        spools.clear()
+    for spool in openSpools:
+        try:
+            spool.close()
+        except Exception:
+            print(traceback.format_exc())
+
+atexit.register(closeAll)
@@ -0,0 +1,315 @@
+# File: benchmarkCycle.py
+# -----------------------
+# Times each stage of an acquisition cycle on simulated hardware (see SimHardware.py):
+# importing readSensors, initialize(), getSensorList(), getReadings(), writeCSV(), writeSQL() and writeSQLite().
+#
+# Each stage is run many times and reported as percentiles. A second, shorter pass runs the
+# stages under tracemalloc to report how much memory each one allocates (kept separate so the
+# tracing doesn't skew the timings).
+#
+# The cycle is run once per sink scenario:
+#    null   - readings are thrown away (no writeCSV() or writeSQL() stage)
+#    file   - writeCSV() to a log file in a temporary directory
+#    db     - writeSQL() to the simulated MySQLdb (an in-memory SQLite stand-in)
+#    spool  - writeSQL() with spool_file set, which only adds the rows to the spool (nothing drains it)
+#    sqlite - writeSQLite() to the local SQLite database
+# The copied ini file has spool_file, sqlite_file and binary_dir cleared, so each scenario times only its own sink.
+#
+# Results can be saved as JSON (-o) and compared with an earlier run (-b) to catch regressions
+# when Sensor.py, Config.py or readSensors.py change. The exit code is 1 if any stage's median got
+# slower than the baseline by more than the threshold.
+#
+# usage: python3 benchmarkCycle.py [-n <iterations>] [-a <alloc iterations>] [-i <import runs>]
+#                                  [-s null,file,db,spool,sqlite] [-p none|pizero] [-e <dht error rate>]
+#                                  [-c <ini file>] [-H <host>] [-o <results.json>] [-b <baseline.json>] [-t <percent>]
+import os
+import sys, getopt
+import io
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import contextlib
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ["import", "initialize", "getSensorList", "getReadings", "writeCSV", "writeSQL", "writeSQLite"]
+SINKS = ["null", "file", "db", "spool", "sqlite"]
+SINK_FILES = {"spool": ("spool_file", "spool.sqlite"), "sqlite": ("sqlite_file", "readings.sqlite")}    # Set for that scenario only
+
+# ==================================================================================================
+# percentiles() - Summarizes a list of samples
+# ==================================================================================================
+def percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "min": ordered[0],
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": ordered[-1]
+    }
+
+# ==================================================================================================
+# makeEnvironment() - Copies the ini file into a temporary directory with the log going there too,
+# writes a private file for the simulated database, and returns the environment variables to use.
+# The spool, local SQLite database and binary store are turned off in the copy.
+# ==================================================================================================
+def makeEnvironment(workDir, iniFile, host, profile):
+    import configparser
+
+    parser = configparser.ConfigParser()
+    parser.read(iniFile)
+    parser["General"]["log_dir"] = os.path.join(workDir, "logs")
+    for option in ("spool_file", "sqlite_file", "binary_dir"):
+        parser["General"][option] = ""
+    simIni = os.path.join(workDir, "rpgarden.ini")
+    with open(simIni, "w") as iniOut:
+        parser.write(iniOut)
+
+    privateIni = os.path.join(workDir, "private.ini")
+    with open(privateIni, "w") as privateOut:
+        privateOut.write("[Private]\nmysql_host = localhost\nmysql_user = rpgarden\nmysql_password = rpgarden\nmysql_db = rpgarden\n")
+
+    env = {
+        "RPGARDEN_HARDWARE": "sim",
+        "RPGARDEN_SIM_PROFILE": profile,
+        "RPGARDEN_CONFIG_FILE": simIni,
+        "RPGARDEN_PRIVATE_FILE": privateIni,
+        "RPGARDEN_HOST": host
+    }
+    return env
+
+# ==================================================================================================
+# timeImports() - Times "import readSensors" in fresh interpreters, like a cron run pays it
+# ==================================================================================================
+def timeImports(runs, env):
+    code = "import time; t = time.perf_counter(); import readSensors; print(time.perf_counter() - t)"
+    childEnv = dict(os.environ)
+    childEnv.update(env)
+    childEnv["PYTHONPATH"] = REPO_DIR + os.pathsep + childEnv.get("PYTHONPATH", "")
+    samples = []
+    for i in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], env=childEnv, cwd=REPO_DIR,
+                                stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return samples
+
+# ==================================================================================================
+# runCycle() - Runs one cycle's stages, calling measure(stage, function) for each one
+# ==================================================================================================
+def runCycle(readSensors, rpgConfig, sink, measure):
+    mcp = measure("initialize", lambda: readSensors.initialize(rpgConfig))
+    sensors = measure("getSensorList", lambda: readSensors.getSensorList(rpgConfig, mcp))
+    readings = measure("getReadings", lambda: readSensors.getReadings(sensors, rpgConfig=rpgConfig))
+    if sink == "file":
+        measure("writeCSV", lambda: readSensors.writeCSV(rpgConfig, readings))
+    elif sink in ("db", "spool"):
+        measure("writeSQL", lambda: readSensors.writeSQL(rpgConfig, readings))
+    elif sink == "sqlite":
+        measure("writeSQLite", lambda: readSensors.writeSQLite(rpgConfig, readings))
+
+def benchmarkSink(readSensors, rpgConfig, sink, iterations, allocIterations):
+    timings = dict((stage, []) for stage in STAGES)
+    allocations = dict((stage, {"peak": [], "net": []}) for stage in STAGES)
+
+    def timeStage(stage, function):
+        start = time.perf_counter()
+        result = function()
+        timings[stage].append(time.perf_counter() - start)
+        return result
+
+    def traceStage(stage, function):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = function()
+        current, peak = tracemalloc.get_traced_memory()
+        allocations[stage]["peak"].append(peak - before)
+        allocations[stage]["net"].append(current - before)
+        return result
+
+    # The functions print progress; keep that out of the report
+    with contextlib.redirect_stdout(io.StringIO()) as quiet:
+        for i in range(iterations):
+            runCycle(readSensors, rpgConfig, sink, timeStage)
+            quiet.seek(0)
+            quiet.truncate()
+
+        tracemalloc.start()
+        try:
+            for i in range(allocIterations):
+                runCycle(readSensors, rpgConfig, sink, traceStage)
+                quiet.seek(0)
+                quiet.truncate()
+        finally:
+            tracemalloc.stop()
+
+    results = {}
+    for stage in STAGES:
+        if timings[stage]:
+            results[stage] = {
+                "seconds": percentiles(timings[stage]),
+                "alloc_peak_bytes": percentiles(allocations[stage]["peak"]),
+                "alloc_net_bytes": percentiles(allocations[stage]["net"])
+            }
+    return results
+
+# ==================================================================================================
+# printResults() / compareResults()
+# ==================================================================================================
+def printResults(results):
+    for sink, stages in results["sinks"].items():
+        print("")
+        print("Sink: %s" % sink)
+        print("%-14s %10s %10s %10s %10s %12s %12s" % ("Stage", "p50 ms", "p90 ms", "p99 ms", "max ms", "peak KiB", "net KiB"))
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            seconds = stages[stage]["seconds"]
+            peak = stages[stage].get("alloc_peak_bytes", {}).get("p50", 0)
+            net = stages[stage].get("alloc_net_bytes", {}).get("p50", 0)
+            print("%-14s %10.3f %10.3f %10.3f %10.3f %12.1f %12.1f" % (stage, seconds["p50"] * 1000, seconds["p90"] * 1000,
+                                                                   seconds["p99"] * 1000, seconds["max"] * 1000,
+                                                                   peak / 1024.0, net / 1024.0))
+
+def compareResults(results, baseline, thresholdPercent):
+    regressions = []
+    for sink, stages in results["sinks"].items():
+        for stage, stats in stages.items():
+            try:
+                before = baseline["sinks"][sink][stage]["seconds"]["p50"]
+            except KeyError:
+                continue
+            after = stats["seconds"]["p50"]
+            if before > 0 and (after - before) / before * 100.0 > thresholdPercent:
+                regressions.append("%s/%s: p50 %.3f ms -> %.3f ms (+%.0f%%)" % (sink, stage, before * 1000, after * 1000,
+                                                                              (after - before) / before * 100.0))
+    return regressions
+
+
+def printUsage():
+    print("usage: python3 benchmarkCycle.py [-n <iterations>] [-a <alloc iterations>] [-i <import runs>]")
+    print("                                 [-s null,file,db,spool,sqlite] [-p none|pizero] [-e <dht error rate>]")
+    print("                                 [-c <ini file>] [-H <host>] [-o <results.json>] [-b <baseline.json>] [-t <percent>]")
+
+def main():
+    iterations = 50
+    allocIterations = 10
+    importRuns = 5
+    sinks = list(SINKS)
+    profile = "none"
+    dhtErrorRate = 0.0
+    iniFile = os.path.join(REPO_DIR, "rpgarden.ini")
+    host = "pi"
+    outputFile = None
+    baselineFile = None
+    threshold = 20.0
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:a:i:s:p:e:c:H:o:b:t:",
+                                   ["help", "iterations=", "alloc-iterations=", "import-runs=", "sinks=", "profile=",
+                                    "dht-error-rate=", "config=", "host=", "output=", "baseline=", "threshold="])
+    except getopt.GetoptError as err:
+        print(err)
+        printUsage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o in ("-n", "--iterations"):
+            iterations = int(a)
+        elif o in ("-a", "--alloc-iterations"):
+            allocIterations = int(a)
+        elif o in ("-i", "--import-runs"):
+            importRuns = int(a)
+        elif o in ("-s", "--sinks"):
+            sinks = a.split(",")
+        elif o in ("-p", "--profile"):
+            profile = a
+        elif o in ("-e", "--dht-error-rate"):
+            dhtErrorRate = float(a)
+        elif o in ("-c", "--config"):
+            iniFile = a
+        elif o in ("-H", "--host"):
+            host = a
+        elif o in ("-o", "--output"):
+            outputFile = a
+        elif o in ("-b", "--baseline"):
+            baselineFile = a
+        elif o in ("-t", "--threshold"):
+            threshold = float(a)
+        else:
+            printUsage()
+            sys.exit()
+
+    workDir = tempfile.mkdtemp(prefix="rpgarden-bench-")
+    try:
+        env = makeEnvironment(workDir, iniFile, host, profile)
+        importTimes = timeImports(importRuns, env) if importRuns > 0 else []
+
+        # Everything below imports the pipeline in this process, on simulated hardware
+        os.environ.update(env)
+        import SimHardware
+        SimHardware.installIfRequested()
+        SimHardware.simulation.dhtDefaults = {"crcErrorRate": dhtErrorRate, "missingDataRate": 0.0, "noDataRate": 0.0}
+        import readSensors
+        from Config import RpgConfig
+        rpgConfig = RpgConfig()
+
+        results = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "profile": profile,
+            "iterations": iterations,
+            "alloc_iterations": allocIterations,
+            "sinks": {}
+        }
+        for sink in sinks:
+            option, fileName = SINK_FILES.get(sink, (None, None))
+            if option:
+                rpgConfig.set(option, os.path.join(workDir, "logs", fileName))
+            results["sinks"][sink] = benchmarkSink(readSensors, rpgConfig, sink, iterations, allocIterations)
+            if option:
+                rpgConfig.set(option, "")
+            if importTimes:
+                results["sinks"][sink]["import"] = {"seconds": percentiles(importTimes)}
+
+        printResults(results)
+
+        if outputFile:
+            with open(outputFile, "w") as resultFile:
+                json.dump(results, resultFile, indent=2, sort_keys=True)
+            print("")
+            print("Results saved to " + outputFile)
+
+        if baselineFile:
+            with open(baselineFile) as baseline:
+                regressions = compareResults(results, json.load(baseline), threshold)
+            print("")
+            if regressions:
+                print("Regressions over %.0f%%:" % threshold)
+                for regression in regressions:
+                    print("   " + regression)
+                sys.exit(1)
+            print("No regressions over %.0f%% compared with %s" % (threshold, baselineFile))
+    finally:
+        # Close the log and the spool before their directory goes away
+        if "Sinks" in sys.modules:
+            sys.modules["Sinks"].closeAll()
+        if "Spool" in sys.modules:
+            sys.modules["Spool"].closeAll()
+        shutil.rmtree(workDir, ignore_errors=True)
+
+if __name__ == "__main__":
+   main()
@@ -0,0 +1,72 @@
+# File: benchmarkDhtDecode.py
+# ---------------------------
+# Microbenchmark comparing the pure Python and the NumPy DHT frame decoders on the same
+# polled sample buffers. It also checks that both decoders return the same result for
+# every buffer, including corrupted ones.
+#
+# usage: python3 benchmarkDhtDecode.py [-n <iterations>] [-f <frames>]
+import sys, getopt
+import random
+import timeit
+
+# Works off the Pi too: the decoders only need RPi.GPIO's constants
+import SimHardware
+SimHardware.installIfMissing()
+
+from dhtxx import DHTXX
+from SimHardware import dhtSamples
+
+def main():
+    iterations = 200
+    frameCount = 50
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:f:", ["help", "iterations=", "frames="])
+    except getopt.GetoptError as err:
+        print(err)
+        print("usage: python3 benchmarkDhtDecode.py [-n <iterations>] [-f <frames>]")
+        sys.exit(2)
+
+    for o, a in opts:
+        if o in ("-n", "--iterations"):
+            iterations = int(a)
+        elif o in ("-f", "--frames"):
+            frameCount = int(a)
+        else:
+            print("usage: python3 benchmarkDhtDecode.py [-n <iterations>] [-f <frames>]")
+            sys.exit()
+
+    # Same frames for both decoders: mostly good ones, some with CRC errors and some cut short
+    rng = random.Random(1234)
+    frames = []
+    for i in range(frameCount):
+        samples = dhtSamples(rng.uniform(20.0, 90.0), rng.uniform(-10.0, 40.0), sensorType=DHTXX.DHT22,
+                             usPerSample=rng.uniform(2.0, 8.0), flipBit=rng.randrange(40) if i % 10 == 3 else None, rng=rng)
+        if i % 10 == 7:
+            samples = samples[:len(samples) // 2] + [1] * 101
+        frames.append(samples)
+
+    pythonDht = DHTXX(pin=0, decoder=DHTXX.DECODER_PYTHON)
+    numpyDht = DHTXX(pin=0, decoder=DHTXX.DECODER_NUMPY)
+
+    # Both decoders must agree on every frame
+    mismatches = 0
+    for samples in frames:
+        expected = pythonDht.decode(samples)
+        actual = numpyDht.decode(samples)
+        if (expected.error_code, expected.temperature, expected.humidity) != (actual.error_code, actual.temperature, actual.humidity):
+            mismatches += 1
+    print("Frames: %d   Mismatches: %d" % (len(frames), mismatches))
+
+    for name, dht in (("python", pythonDht), ("numpy", numpyDht)):
+        def decodeAll():
+            for samples in frames:
+                dht.decode(samples)
+        seconds = min(timeit.repeat(decodeAll, number=iterations, repeat=3))
+        perDecode = seconds / (iterations * len(frames))
+        print("%-8s %9.1f us/decode %10.0f decodes/s" % (name, perDecode * 1e6, 1.0 / perDecode))
+
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+   main()
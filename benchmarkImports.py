@@ -0,0 +1,150 @@
+# File: benchmarkImports.py
+# -------------------------
+# Measures what a cron run of readSensors.py pays for imports before it reads a single sensor.
+#
+# Each run starts a fresh interpreter with "python3 -X importtime", imports readSensors and sets
+# up the sensors (initialize() and getSensorList()), like main() does. The report shows the total
+# import time, the modules with the largest cumulative import times (median over the runs), and
+# which driver and sink modules were imported. A module only shows up there if a configured sensor
+# type or output needed it.
+#
+# Runs on simulated hardware by default (see SimHardware.py), so it works off the Pi too; use
+# -r on a Pi to import the real drivers.
+#
+# usage: python3 benchmarkImports.py [-n <runs>] [-t <top modules>] [-c <ini file>] [-H <host>] [-r]
+import os
+import sys, getopt
+import shutil
+import tempfile
+import subprocess
+
+from benchmarkCycle import REPO_DIR, makeEnvironment, percentiles
+
+# Modules that should only be imported when the host's config needs them
+DRIVER_MODULES = ["RPi.GPIO", "dhtxx", "numpy", "busio", "digitalio", "board", "adafruit_mcp3xxx",
+                  "MySQLdb", "sqlite3", "http.server"]
+
+# The child records every module an import statement asks for. Simulated drivers are put straight into
+# sys.modules by SimHardware, so they never show up in -X importtime's output or as new sys.modules entries.
+CHILD_CODE = """
+import sys, time, builtins
+requested = set()
+realImport = builtins.__import__
+def recordingImport(name, *args, **kwargs):
+    requested.add(name)
+    return realImport(name, *args, **kwargs)
+builtins.__import__ = recordingImport
+start = time.perf_counter()
+import readSensors
+imported = time.perf_counter()
+from Config import RpgConfig
+import ConfigPlan
+ConfigPlan.usePlan(RpgConfig.RPGARDEN_CONFIG_FILE, readSensors.getHostName())
+rpgConfig = RpgConfig()
+readSensors.getSensorList(rpgConfig, readSensors.initialize(rpgConfig))
+ready = time.perf_counter()
+print("RESULT %f %f" % (imported - start, ready - start))
+print("MODULES " + ",".join(sorted(requested)))
+"""
+
+# ==================================================================================================
+# parseImportTime() - Returns {module: cumulative seconds} from python3 -X importtime's output
+# ==================================================================================================
+def parseImportTime(stderr):
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) == 3:
+            cumulative[fields[2].strip()] = int(fields[1]) / 1e6
+    return cumulative
+
+# Runs one fresh interpreter. Returns (import seconds, setup seconds, {module: seconds}, imported modules)
+def runOnce(env):
+    childEnv = dict(os.environ)
+    childEnv.update(env)
+    childEnv["PYTHONPATH"] = REPO_DIR + os.pathsep + childEnv.get("PYTHONPATH", "")
+    child = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD_CODE], env=childEnv, cwd=REPO_DIR,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    importSeconds = setupSeconds = None
+    modules = []
+    for line in child.stdout.splitlines():
+        if line.startswith("RESULT "):
+            importSeconds, setupSeconds = [float(value) for value in line.split()[1:]]
+        elif line.startswith("MODULES "):
+            modules = line[len("MODULES "):].split(",")
+    if importSeconds is None:
+        raise RuntimeError("Benchmark run failed:\n" + child.stdout + child.stderr[-2000:])
+    return importSeconds, setupSeconds, parseImportTime(child.stderr), modules
+
+def printUsage():
+    print("usage: python3 benchmarkImports.py [-n <runs>] [-t <top modules>] [-c <ini file>] [-H <host>] [-r]")
+    print("   where: -r imports the real hardware drivers instead of the simulated ones")
+
+def main():
+    runs = 5
+    top = 15
+    iniFile = os.path.join(REPO_DIR, "rpgarden.ini")
+    host = "pi"
+    simulated = True
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:t:c:H:r", ["help", "runs=", "top=", "config=", "host=", "real"])
+    except getopt.GetoptError as err:
+        print(err)
+        printUsage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o in ("-n", "--runs"):
+            runs = int(a)
+        elif o in ("-t", "--top"):
+            top = int(a)
+        elif o in ("-c", "--config"):
+            iniFile = a
+        elif o in ("-H", "--host"):
+            host = a
+        elif o in ("-r", "--real"):
+            simulated = False
+        else:
+            printUsage()
+            sys.exit()
+
+    workDir = tempfile.mkdtemp(prefix="rpgarden-imports-")
+    try:
+        env = makeEnvironment(workDir, iniFile, host, "none")
+        if not simulated:
+            del env["RPGARDEN_HARDWARE"]
+
+        importTimes, setupTimes, moduleTimes, loaded = [], [], {}, set()
+        for i in range(runs):
+            importSeconds, setupSeconds, cumulative, modules = runOnce(env)
+            importTimes.append(importSeconds)
+            setupTimes.append(setupSeconds)
+            for module, seconds in cumulative.items():
+                moduleTimes.setdefault(module, []).append(seconds)
+            loaded.update(modules)
+
+        importStats = percentiles(importTimes)
+        setupStats = percentiles(setupTimes)
+        print("Runs: %d  (%s hardware, host %s)" % (runs, "simulated" if simulated else "real", host))
+        print("import readSensors:       p50 %8.1f ms   max %8.1f ms" % (importStats["p50"] * 1000, importStats["max"] * 1000))
+        print("import + sensor setup:    p50 %8.1f ms   max %8.1f ms" % (setupStats["p50"] * 1000, setupStats["max"] * 1000))
+
+        print("")
+        print("%-40s %12s" % ("Slowest imports (cumulative)", "p50 ms"))
+        medians = sorted(((percentiles(samples)["p50"], module) for module, samples in moduleTimes.items()), reverse=True)
+        for seconds, module in medians[:top]:
+            print("%-40s %12.1f" % (module, seconds * 1000))
+
+        print("")
+        print("Driver and sink modules imported:")
+        for module in DRIVER_MODULES:
+            used = any(name == module or name.startswith(module + ".") for name in loaded)
+            print("   %-20s %s" % (module, "yes" if used else "no"))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+if __name__ == "__main__":
+   main()
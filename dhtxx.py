@@ -1,5 +1,34 @@
 import time
-import RPi
+import json
+
+# RPi.GPIO is imported (and set to BCM pin numbers) by the first DHTXX object that polls the pin, so the
+# decoders (which only need the pin levels below) work off the Pi, and the edge capture backend doesn't
+# need it at all.
+GPIO = None
+LOW = 0     # RPi.GPIO.LOW
+HIGH = 1    # RPi.GPIO.HIGH
+
+def load_gpio():
+    global GPIO
+    if GPIO is None:
+        import RPi.GPIO as gpio_module
+        gpio_module.setmode(gpio_module.BCM)
+        GPIO = gpio_module
+    return GPIO
+
+# NumPy is optional. It's only needed for DHTXX(decoder=DHTXX.DECODER_NUMPY), and is imported by the first
+# DHTXX object that uses that decoder (it takes a long time to import on a Pi Zero).
+numpy = None
+
+def load_numpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as numpy_module
+        except ImportError:
+            return None
+        numpy = numpy_module
+    return numpy
 
 class DHTXXResult:
     'DHTXX sensor result returned by DHTXX.read() method'
@@ -11,8 +40,9 @@ class DHTXXResult:
     ERR_OUT_OF_RANGE = 4
     ERR_WRONG_SENSOR = 5
     ERR_RETRIES_EXCEEDED = 6
+    ERR_TIMEOUT = 7
 
-    error_messages = [None] * 7
+    error_messages = [None] * 8
     error_messages[ERR_NO_ERROR] = ""
     error_messages[ERR_NO_DATA] = "DHT returned no data. Are you connecected to the correct pin?"
     error_messages[ERR_MISSING_DATA] = "DHT returned the wrong amount of data"
@@ -20,12 +50,19 @@ class DHTXXResult:
     error_messages[ERR_OUT_OF_RANGE] = "Temperature or humidity out of expected range"
     error_messages[ERR_WRONG_SENSOR] = "Invalid value. Are you really using a DHT11? It looks like it might be a DHT22"
     error_messages[ERR_RETRIES_EXCEEDED] = "Exceeded number of retries without getting a valid reading"
+    error_messages[ERR_TIMEOUT] = "Ran out of time before getting a valid reading"
 
     error_code = ERR_NO_ERROR
     error_msg = error_messages[error_code]
 
     temperature = None
     humidity = None
+
+    # Filled in by DHTXX.read_and_retry(): how many reads it took, how many seconds it spent,
+    # and the error code of the last read when it gave up
+    attempts = 1
+    elapsed = 0.0
+    last_error_code = ERR_NO_ERROR
     
     def __init__(self, error_code, temperature, humidity):
         self.error_code = error_code
@@ -44,31 +81,143 @@ class DHTXX:
     FAHRENHEIT = 1
     CELCIUS = 2
 
+    # Shortest time the datasheets allow between the start of two reads, in seconds
+    MIN_READ_INTERVAL = {DHT11: 1.0, DHT22: 2.0}
+
+    # Roughly how long one read() takes (start signal plus capture), in seconds
+    READ_TIME = 0.1
+
+    # How read_and_retry() backs off after each kind of error. The wait before the next read is
+    # MIN_READ_INTERVAL * growth ** (number of times in a row this error has happened - 1).
+    # None means the error won't go away by retrying, so give up right away.
+    #   ERR_NO_DATA: nothing on the line. Often the sensor is still powering up or was read too soon, so back off.
+    #   ERR_MISSING_DATA, ERR_CRC: bits lost while the Pi was busy. Retry as soon as the sensor allows.
+    #   ERR_OUT_OF_RANGE: usually a corrupted frame that happened to pass the CRC. Retry as soon as allowed.
+    #   ERR_WRONG_SENSOR: the configured sensor type is wrong. Retrying can't fix that.
+    RETRY_BACKOFF = {
+        DHTXXResult.ERR_NO_DATA: 2.0,
+        DHTXXResult.ERR_MISSING_DATA: 1.0,
+        DHTXXResult.ERR_CRC: 1.0,
+        DHTXXResult.ERR_OUT_OF_RANGE: 1.0,
+        DHTXXResult.ERR_WRONG_SENSOR: None
+    }
+
+    # How the frame is captured:
+    #   CAPTURE_POLL: sample RPi.GPIO.input() in a Python loop. Pulse lengths are counted in samples,
+    #                 so they depend on how fast the interpreter loops.
+    #   CAPTURE_EDGES: let the kernel timestamp each edge through the GPIO character device
+    #                  (see DHTXXEdgeCapture). Pulse lengths are measured in microseconds.
+    CAPTURE_POLL = "poll"
+    CAPTURE_EDGES = "edges"
+
+    # How a polled sample buffer is decoded. Both give exactly the same results.
+    #   DECODER_PYTHON: a state machine walks the samples one at a time
+    #   DECODER_NUMPY: run-length encodes the samples and packs the bits with vectorized NumPy operations
+    DECODER_PYTHON = "python"
+    DECODER_NUMPY = "numpy"
+
+    # With edge timestamps, a data pull up of ~26-28us is a 0 and ~70us is a 1
+    EDGE_BIT_THRESHOLD_US = 50
+
     __pin = 0
 
-    def __init__(self, pin, sensorType=DHT22, scale=FAHRENHEIT):
+    # If capture_file is given, every raw capture is appended to it with its decoded result, one JSON
+    # object per line. replayDht.py feeds those files back through the decoders.
+    def __init__(self, pin, sensorType=DHT22, scale=FAHRENHEIT, capture=CAPTURE_POLL, chip=None, decoder=DECODER_PYTHON,
+                 capture_file=None):
         self.__pin = pin
         self.__sensorType = sensorType
         self.__scale = scale
+        self.__last_read = None   # time.monotonic() when the last read started
+        self.__capture_file = capture_file
+
+        if decoder == self.DECODER_NUMPY and load_numpy() is None:
+            raise ImportError("The numpy DHT decoder needs NumPy:  pip3 install numpy")
+        elif decoder not in (self.DECODER_PYTHON, self.DECODER_NUMPY):
+            raise ValueError("Unknown DHT decoder: %r" % decoder)
+        self.__decoder = decoder
+
+        self.__edge_capture = None
+        if capture == self.CAPTURE_EDGES:
+            self.__edge_capture = DHTXXEdgeCapture(pin, chip or DHTXXEdgeCapture.DEFAULT_CHIP)
+        elif capture == self.CAPTURE_POLL:
+            load_gpio()
+        else:
+            raise ValueError("Unknown DHT capture backend: %r" % capture)
+
+    # Releases the GPIO line held by the edge capture backend, if any
+    def close(self):
+        if self.__edge_capture is not None:
+            self.__edge_capture.close()
+            self.__edge_capture = None
 
     def read(self):
-        RPi.GPIO.setup(self.__pin, RPi.GPIO.OUT)
+        self.__last_read = time.monotonic()
+
+        if self.__edge_capture is not None:
+            # the edge backend sends the start signal itself
+            edges = self.__edge_capture.capture()
+            result = self.decode_edges(edges)
+            if self.__capture_file:
+                self.__save_capture({"edges": edges}, result)
+            return result
+
+        GPIO.setup(self.__pin, GPIO.OUT)
 
         # send initial high
-        self.__send_and_sleep(RPi.GPIO.HIGH, 0.05)
+        self.__send_and_sleep(HIGH, 0.05)
 
         # pull down to low
-        self.__send_and_sleep(RPi.GPIO.LOW, 0.02)
+        self.__send_and_sleep(LOW, 0.02)
 
         # change to input using pull up
-        RPi.GPIO.setup(self.__pin, RPi.GPIO.IN, RPi.GPIO.PUD_UP)
+        GPIO.setup(self.__pin, GPIO.IN, GPIO.PUD_UP)
 
         # collect data into an array
         data = self.__collect_input()
 
+        result = self.decode(data)
+        if self.__capture_file:
+            self.__save_capture({"samples": "".join(str(sample) for sample in data)}, result)
+        return result
+
+    # Decodes a buffer of samples captured by the polling backend with the configured decoder
+    def decode(self, data):
+        if self.__decoder == self.DECODER_NUMPY:
+            return self.__decode(self.__numpy_pull_up_lengths(data), vectorized=True)
+
         # parse lengths of all data pull up periods
         pull_up_lengths = self.__parse_data_pull_up_lengths(data)
 
+        return self.__decode(pull_up_lengths)
+
+    # Decodes a list of [level, timestamp in nanoseconds] edges captured by the edge backend.
+    # The pull ups are measured in microseconds and split at EDGE_BIT_THRESHOLD_US.
+    def decode_edges(self, edges):
+        return self.__decode(DHTXXEdgeCapture.pull_up_lengths(edges), self.EDGE_BIT_THRESHOLD_US)
+
+    # Appends a raw capture and its result to the capture file. A failure here never fails the read.
+    def __save_capture(self, capture, result):
+        record = {
+            "time": time.time(),
+            "pin": self.__pin,
+            "sensor_type": self.__sensorType,
+            "scale": self.__scale,
+            "decoder": self.__decoder,
+            "error_code": result.error_code,
+            "temperature": result.temperature,
+            "humidity": result.humidity
+        }
+        record.update(capture)
+        try:
+            with open(self.__capture_file, "a") as captureFile:
+                captureFile.write(json.dumps(record) + "\n")
+        except Exception as ex:
+            print("Could not save DHT capture to %s: %s" % (self.__capture_file, ex))
+
+    # Turns the lengths of the 40 data pull up periods into a result. If no threshold is given,
+    # the halfway point between the shortest and longest pull up separates 0 bits from 1 bits.
+    def __decode(self, pull_up_lengths, threshold=None, vectorized=False):
         # if no data found, return error
         if len(pull_up_lengths) == 0:
             return DHTXXResult(DHTXXResult.ERR_NO_DATA, None, None)
@@ -77,11 +226,14 @@ class DHTXX:
         if len(pull_up_lengths) != 40:
             return DHTXXResult(DHTXXResult.ERR_MISSING_DATA, None, None)
 
-        # calculate bits from lengths of the pull up periods
-        bits = self.__calculate_bits(pull_up_lengths)
+        if vectorized:
+            the_bytes = self.__numpy_lengths_to_bytes(pull_up_lengths)
+        else:
+            # calculate bits from lengths of the pull up periods
+            bits = self.__calculate_bits(pull_up_lengths, threshold)
 
-        # we have the bits, calculate bytes
-        the_bytes = self.__bits_to_bytes(bits)
+            # we have the bits, calculate bytes
+            the_bytes = self.__bits_to_bytes(bits)
 
         # calculate checksum and check
         checksum = self.__calculate_checksum(the_bytes)
@@ -132,17 +284,56 @@ class DHTXX:
             
         return DHTXXResult(DHTXXResult.ERR_NO_ERROR, temperature, humidity)
 
-    def read_and_retry(self, attempts=10):
-        for i in range(attempts):
+    # Reads the sensor until it gets a valid result, waiting between reads as the datasheet requires
+    # and backing off according to RETRY_BACKOFF. Gives up after the given number of attempts, on an
+    # error that retrying can't fix, or when the next read couldn't finish within budget seconds
+    # (if a budget is given). The result's attempts and elapsed properties tell how it went.
+    def read_and_retry(self, attempts=10, budget=None):
+        start = time.monotonic()
+        minInterval = self.MIN_READ_INTERVAL.get(self.__sensorType, 2.0)
+        result = None
+        lastError = None
+        repeats = 0
+        backoff = 1.0
+
+        for attempt in range(attempts):
+            # Wait until the sensor is ready for another read, and longer if we're backing off
+            wait = 0.0
+            if self.__last_read is not None:
+                wait = max(self.__last_read + minInterval * backoff - time.monotonic(), 0.0)
+
+            if budget is not None and (time.monotonic() - start) + wait + self.READ_TIME > budget:
+                return self.__retry_result(DHTXXResult.ERR_TIMEOUT, attempt, start, lastError)
+
+            if wait > 0:
+                time.sleep(wait)
+
             result = self.read()
             if result.is_valid():
-                return result
-            else:
-                time.sleep(2)
-        return DHTXXResult(DHTXXResult.ERR_RETRIES_EXCEEDED, None, None)
+                return self.__retry_result(result, attempt + 1, start, lastError)
+
+            growth = self.RETRY_BACKOFF.get(result.error_code, 1.0)
+            if growth is None:
+                return self.__retry_result(result, attempt + 1, start, result.error_code)
+
+            repeats = repeats + 1 if result.error_code == lastError else 1
+            lastError = result.error_code
+            backoff = growth ** (repeats - 1)
+
+        return self.__retry_result(DHTXXResult.ERR_RETRIES_EXCEEDED, attempts, start, lastError)
+
+    # Returns a result (or a new result for an error code) stamped with read_and_retry() statistics
+    def __retry_result(self, result, attempts, start, lastError):
+        if not isinstance(result, DHTXXResult):
+            result = DHTXXResult(result, None, None)
+        result.attempts = attempts
+        result.elapsed = time.monotonic() - start
+        if lastError is not None:
+            result.last_error_code = lastError
+        return result
 
     def __send_and_sleep(self, output, sleep):
-        RPi.GPIO.output(self.__pin, output)
+        GPIO.output(self.__pin, output)
         time.sleep(sleep)
 
     def __collect_input(self):
@@ -155,7 +346,7 @@ class DHTXX:
         last = -1
         data = []
         while True:
-            current = RPi.GPIO.input(self.__pin)
+            current = GPIO.input(self.__pin)
             data.append(current)
             if last != current:
                 unchanged_count = 0
@@ -185,28 +376,28 @@ class DHTXX:
             current_length += 1
 
             if state == STATE_INIT_PULL_DOWN:
-                if current == RPi.GPIO.LOW:
+                if current == LOW:
                     # ok, we got the initial pull down
                     state = STATE_INIT_PULL_UP
                     continue
                 else:
                     continue
             if state == STATE_INIT_PULL_UP:
-                if current == RPi.GPIO.HIGH:
+                if current == HIGH:
                     # ok, we got the initial pull up
                     state = STATE_DATA_FIRST_PULL_DOWN
                     continue
                 else:
                     continue
             if state == STATE_DATA_FIRST_PULL_DOWN:
-                if current == RPi.GPIO.LOW:
+                if current == LOW:
                     # we have the initial pull down, the next will be the data pull up
                     state = STATE_DATA_PULL_UP
                     continue
                 else:
                     continue
             if state == STATE_DATA_PULL_UP:
-                if current == RPi.GPIO.HIGH:
+                if current == HIGH:
                     # data pulled up, the length of this pull up will determine whether it is 0 or 1
                     current_length = 0
                     state = STATE_DATA_PULL_DOWN
@@ -214,7 +405,7 @@ class DHTXX:
                 else:
                     continue
             if state == STATE_DATA_PULL_DOWN:
-                if current == RPi.GPIO.LOW:
+                if current == LOW:
                     # pulled down, we store the length of the previous pull up period
                     lengths.append(current_length)
                     state = STATE_DATA_PULL_UP
@@ -224,20 +415,23 @@ class DHTXX:
 
         return lengths
 
-    def __calculate_bits(self, pull_up_lengths):
-        # find shortest and longest period
-        shortest_pull_up = 1000
-        longest_pull_up = 0
-
-        for i in range(0, len(pull_up_lengths)):
-            length = pull_up_lengths[i]
-            if length < shortest_pull_up:
-                shortest_pull_up = length
-            if length > longest_pull_up:
-                longest_pull_up = length
-
-        # use the halfway to determine whether the period it is long or short
-        halfway = shortest_pull_up + (longest_pull_up - shortest_pull_up) / 2
+    def __calculate_bits(self, pull_up_lengths, threshold=None):
+        if threshold is not None:
+            halfway = threshold
+        else:
+            # find shortest and longest period
+            shortest_pull_up = 1000
+            longest_pull_up = 0
+
+            for i in range(0, len(pull_up_lengths)):
+                length = pull_up_lengths[i]
+                if length < shortest_pull_up:
+                    shortest_pull_up = length
+                if length > longest_pull_up:
+                    longest_pull_up = length
+
+            # use the halfway to determine whether the period it is long or short
+            halfway = shortest_pull_up + (longest_pull_up - shortest_pull_up) / 2
         bits = []
 
         for i in range(0, len(pull_up_lengths)):
@@ -264,10 +458,104 @@ class DHTXX:
 
         return the_bytes
 
+    # Vectorized version of __parse_data_pull_up_lengths(). The samples are run-length encoded, then the
+    # same periods the state machine looks for are picked out by index: the first low run is the
+    # sensor's initial pull down, the next high run its initial pull up, the next low run the first
+    # data pull down, and from there every other run is a data pull up. A pull up still running at the
+    # end of the buffer isn't counted, just like in the state machine.
+    def __numpy_pull_up_lengths(self, data):
+        samples = numpy.asarray(data, dtype=numpy.int8)
+        if samples.size == 0:
+            return samples
+
+        run_starts = numpy.flatnonzero(numpy.diff(samples)) + 1
+        run_starts = numpy.concatenate(([0], run_starts))
+        run_lengths = numpy.diff(numpy.append(run_starts, samples.size))
+
+        low_runs = numpy.flatnonzero(samples[run_starts] == LOW)
+        if low_runs.size == 0:
+            return run_lengths[:0]
+
+        return run_lengths[low_runs[0] + 3 : run_lengths.size - 1 : 2]
+
+    # Vectorized version of __calculate_bits() + __bits_to_bytes() (same halfway threshold)
+    def __numpy_lengths_to_bytes(self, pull_up_lengths):
+        shortest_pull_up = min(pull_up_lengths.min(), 1000)
+        longest_pull_up = max(pull_up_lengths.max(), 0)
+        halfway = shortest_pull_up + (longest_pull_up - shortest_pull_up) / 2
+        return numpy.packbits(pull_up_lengths > halfway).tolist()
+
     def __calculate_checksum(self, the_bytes):
         return the_bytes[0] + the_bytes[1] + the_bytes[2] + the_bytes[3] & 255
 
 
+class DHTXXEdgeCapture:
+    'Captures a DHTXX frame as kernel-timestamped edges from the Linux GPIO character device'
+
+    # Needs the libgpiod 2.x Python bindings:  sudo apt-get install python3-libgpiod  (or pip3 install gpiod)
+    # Line offsets on the chip are the BCM pin numbers. On a Raspberry Pi 5 the header pins may be on another chip.
+    DEFAULT_CHIP = "/dev/gpiochip0"
+
+    START_LOW_TIME = 0.02   # how long to pull the line low to wake the sensor up, in seconds
+    END_OF_FRAME = 0.005    # no edges for this long means the frame is over, in seconds
+    MAX_EDGES = 100         # a full frame is 2 edges per bit plus the response, about 86
+
+    def __init__(self, pin, chip=DEFAULT_CHIP):
+        import gpiod    # only needed by this backend
+        from gpiod.line import Bias, Direction, Edge, Value
+
+        self.__pin = pin
+        self.__gpiod = gpiod
+        self.__idle_settings = gpiod.LineSettings(direction=Direction.OUTPUT, output_value=Value.ACTIVE)
+        self.__start_settings = gpiod.LineSettings(direction=Direction.OUTPUT, output_value=Value.INACTIVE)
+        self.__listen_settings = gpiod.LineSettings(direction=Direction.INPUT, edge_detection=Edge.BOTH, bias=Bias.PULL_UP)
+        self.__rising = gpiod.EdgeEvent.Type.RISING_EDGE
+
+        # The line is requested once and kept, so each read only reconfigures it
+        self.__request = gpiod.request_lines(chip, consumer="rpgarden-dht", config={pin: self.__idle_settings})
+
+    def close(self):
+        if self.__request is not None:
+            self.__request.release()
+            self.__request = None
+
+    # Sends the start signal, then waits in the kernel for edges until the line goes quiet.
+    # Returns a list of [level after the edge, timestamp in nanoseconds] pairs.
+    def capture(self):
+        request = self.__request
+        request.reconfigure_lines({self.__pin: self.__start_settings})
+        time.sleep(self.START_LOW_TIME)
+        request.reconfigure_lines({self.__pin: self.__listen_settings})
+
+        edges = []
+        try:
+            while len(edges) < self.MAX_EDGES and request.wait_edge_events(self.END_OF_FRAME):
+                for event in request.read_edge_events():
+                    level = HIGH if event.event_type == self.__rising else LOW
+                    edges.append([level, event.timestamp_ns])
+        finally:
+            request.reconfigure_lines({self.__pin: self.__idle_settings})
+
+        return edges
+
+    # Measures each high period (rising edge to the next falling edge) in a list of edges. The data bits
+    # are the last 40 of them; up to two earlier ones are the sensor's response and the host's release.
+    @staticmethod
+    def pull_up_lengths(edges):
+        lengths = []
+        rise = None
+        for level, timestamp in edges:
+            if level == HIGH:
+                rise = timestamp
+            elif rise is not None:
+                lengths.append((timestamp - rise) / 1000.0)
+                rise = None
+
+        if 40 < len(lengths) <= 42:
+            lengths = lengths[-40:]
+        return lengths
+
+
 # THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
 # AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
 # IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
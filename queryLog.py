@@ -0,0 +1,102 @@
+# File: queryLog.py
+# -----------------
+# Prints the rows of the local CSV log between two times, using the log's time index and (for a
+# segmented log) its manifest, so only the part of the log in the range is read. See LogIndex.py.
+#
+# Times are UTC, as "YYYY-MM-DD HH:MM:SS" or "YYYY-MM-DD". Examples:
+#    python3 queryLog.py -l 24 -f soil_1                  the last 24 hours of soil_1
+#    python3 queryLog.py -s 2026-10-01 -e 2026-10-07      a week of every column
+#    python3 queryLog.py -r                               rebuild the index of the log (or each open segment)
+#
+# usage: python3 queryLog.py [-s <start>] [-e <end>] [-l <last hours>] [-f <field,field>] [-L <log file>] [-r]
+import os
+import sys, getopt
+import time
+
+import LogIndex
+
+def normalizeTime(text, endOfDay=False):
+    if len(text) == 10:
+        return text + (" 23:59:59" if endOfDay else " 00:00:00")
+    LogIndex.parseTime(text)    # Raises ValueError if it isn't in the row format
+    return text
+
+def printUsage():
+    print("usage: python3 queryLog.py [-s <start>] [-e <end>] [-l <last hours>] [-f <field,field>] [-L <log file>] [-r]")
+    print("   where: -s, -e are UTC times (YYYY-MM-DD HH:MM:SS or YYYY-MM-DD)")
+    print("          -l picks the last <hours> hours instead of -s")
+    print("          -f lists the columns to print (default: all)")
+    print("          -L reads this log instead of log_file from the .ini file")
+    print("          -r rebuilds the time index (every csv_index_rows rows, default 100)")
+
+def main():
+    start = None
+    end = None
+    fields = None
+    logFile = None
+    rebuild = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hs:e:l:f:L:r", ["help", "start=", "end=", "last=", "fields=", "log=", "rebuild"])
+    except getopt.GetoptError as err:
+        print(err)
+        printUsage()
+        sys.exit(2)
+
+    try:
+        for o, a in opts:
+            if o in ("-s", "--start"):
+                start = normalizeTime(a)
+            elif o in ("-e", "--end"):
+                end = normalizeTime(a, endOfDay=True)
+            elif o in ("-l", "--last"):
+                start = LogIndex.formatTime(time.time() - float(a) * 3600.0)
+            elif o in ("-f", "--fields"):
+                fields = a.split(",")
+            elif o in ("-L", "--log"):
+                logFile = a
+            elif o in ("-r", "--rebuild"):
+                rebuild = True
+            else:
+                printUsage()
+                sys.exit()
+    except ValueError as err:
+        print(err)
+        printUsage()
+        sys.exit(2)
+
+    indexRows = 100
+    if logFile is None:
+        from Config import RpgConfig
+        rpgConfig = RpgConfig()
+        logFile = rpgConfig.get("log_file")
+        indexRows = rpgConfig.getint("csv_index_rows", defaultVal=0) or indexRows
+
+    if rebuild:
+        import Sinks
+        logDir = os.path.dirname(logFile) or "."
+        manifestFile = os.path.join(logDir, os.path.splitext(os.path.basename(logFile))[0] + ".manifest.json")
+        if os.path.exists(manifestFile):
+            fileNames = [os.path.join(logDir, segment["file"]) for segment in Sinks.LogManifest(manifestFile).segments
+                         if not segment["compressed"]]
+        else:
+            fileNames = [logFile]
+        for fileName in fileNames:
+            print("%s: %d index entries" % (fileName, LogIndex.buildIndex(fileName, indexRows)))
+        return
+
+    lastColumns = None
+    for columns, row in LogIndex.queryLog(logFile, start, end):
+        if fields is None:
+            if columns != lastColumns:    # A new segment may have different columns
+                print("\t".join(columns))
+                lastColumns = columns
+            print("\t".join(row))
+        else:
+            if lastColumns is None:
+                print("\t".join(["Time"] + fields))
+                lastColumns = columns
+            print("\t".join([row[0]] + [row[columns.index(field)] if field in columns else "" for field in fields]))
+
+if __name__ == "__main__":
+   main()
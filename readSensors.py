@@ -1,24 +1,45 @@
 import os
 import sys, getopt  # Read command line arguments
+
+# Set RPGARDEN_HARDWARE=sim to run on simulated hardware (see SimHardware.py).
+# This has to happen before any of the hardware modules are imported. On the Pi the simulation isn't loaded.
+if os.environ.get("RPGARDEN_HARDWARE", "").lower() == "sim":
+    import SimHardware
+    SimHardware.installIfRequested()
+
 import datetime
+import time       # Used for pacing the daemon loop
+import concurrent.futures  # Thread pool for reading sensors at the same time
 import Sensor
 from Config import RpgConfig
-import RPi.GPIO as GPIO
+import ConfigPlan
+from Scheduler import Scheduler
+import Metrics
+import Aggregator
 
-import csv        # Used for writing csv files
 import socket     # Used to get host name
 import traceback  # For error handling
-import MySQLdb    # sudo apt-get update  - Do these commands to set up mysqldb in Python
-                  # sudo apt-get upgrade
-                  # sudo apt-get install python-dev default-libmysqlclient-dev
-                  # pip3 install mysqlclient
 
-# These are all Adafruit modules that come with CircuitPython
-# pip3 install adafruit-circuitpython-mcp3xxx
-import busio      # handles the SPI bus protocol
-import digitalio  # handles IO on the GPIO pins
-import board      # Raspberry Pi pin name constants, etc.
-import adafruit_mcp3xxx.mcp3008 as MCP  # handles the MCP3008
+# The hardware drivers (RPi.GPIO, busio, digitalio, board, adafruit_mcp3xxx, dhtxx) are imported by
+# Sensor.py only for the sensor types this host uses, and MySQLdb only when connecting to the database
+# (see Database.py). Likewise the sink modules (Sinks, BinaryStore, Spool, Database, Pipeline) are imported
+# by the functions that write to them.
+
+# Metrics kept by this module (see Metrics.py for how they're exposed)
+CYCLE_SECONDS = Metrics.histogram("rpgarden_cycle_seconds", "Time taken by one acquisition cycle, reading and writing")
+SENSOR_READS = Metrics.counter("rpgarden_sensor_reads_total", "Sensor reads by result (ok, error, timeout, busy)", ["sensor", "result"])
+SCHEDULE_JITTER = Metrics.histogram("rpgarden_schedule_jitter_seconds", "How late scheduled reads started", ["task"])
+SCHEDULE_OVERRUNS = Metrics.counter("rpgarden_schedule_overruns_total", "Scheduled reads that ran past their next deadline", ["task"])
+SCHEDULE_SKIPPED = Metrics.counter("rpgarden_schedule_skipped_total", "Scheduled slots skipped because a read was late", ["task"])
+CSV_BYTES = Metrics.counter("rpgarden_csv_bytes_written_total", "Bytes written to the CSV log")
+BINARY_BYTES = Metrics.counter("rpgarden_binary_bytes_written_total", "Bytes written to the binary store")
+SQLITE_ROWS = Metrics.counter("rpgarden_sqlite_rows_total", "Rows written to the local SQLite database")
+SQL_ROWS = Metrics.counter("rpgarden_sql_rows_total", "Rows inserted into the database")
+SQL_FAILURES = Metrics.counter("rpgarden_sql_failures_total", "Database writes that failed and were rolled back")
+SQL_COMMIT_SECONDS = Metrics.histogram("rpgarden_sql_commit_seconds", "Time taken by a database commit")
+SQL_INSERT_SECONDS = Metrics.histogram("rpgarden_sql_insert_seconds", "Time taken to send one batch of rows to the database")
+SQL_ROWS_PER_SECOND = Metrics.gauge("rpgarden_sql_rows_per_second", "Rows per second of the last database write, inserts and commit")
+AGGREGATE_WINDOWS = Metrics.counter("rpgarden_aggregate_windows_total", "Aggregation windows closed and sent to the database")
 
 # ==================================================================================================
 # getUTCTime() - Gets current time in UTC as a string e.g.: 2020-08-21 20:20:20
@@ -27,9 +48,27 @@ def getUTCTime():
     clock_format = "%Y-%m-%d %H:%M:%S"
     return datetime.datetime.now(datetime.timezone( datetime.timedelta(hours=+0) )).strftime(clock_format)
 
+# ==================================================================================================
+# formatUTCTime() - Formats epoch seconds like getUTCTime(), with decimals digits of the fraction of a
+# second, e.g.: 2020-08-21 20:20:20.125 with decimals=3
+# ==================================================================================================
+def formatUTCTime(epoch, decimals=0):
+    timeText = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+    if decimals > 0:
+        timeText += ".%0*d" % (decimals, int(epoch % 1 * 10 ** decimals))
+    return timeText
+
+# ==================================================================================================
+# getHostName() - The name used to pick this Pi's sections in the .ini file and to tag its database
+# rows. The RPGARDEN_HOST environment variable overrides the real host name (handy off-device).
+# ==================================================================================================
+def getHostName():
+    return os.environ.get("RPGARDEN_HOST") or socket.gethostname()
+
 # ==================================================================================================
 # initialize() -Initialize pins and other stuff, Returns the mcp variable for handling the 
-# digital-to-analog converter chip. That will be needed for setting up sensors, later
+# digital-to-analog converter chip. That will be needed for setting up sensors, later.
+# The chip is an Sensor.McpChip: the SPI bus is only set up when the first MCP sensor is created.
 # ==================================================================================================
 def initialize(rpgConfig):
     try:
@@ -37,17 +76,10 @@ def initialize(rpgConfig):
         if rpgConfig is None:
             rpgConfig = RpgConfig()
 
-        # Set up the GPIO Pin Mode
-        GPIO.setmode(GPIO.BCM)
-
         # MCP_3008 Chip Select Pin
-        CHIP_SELECT_PIN = eval(rpgConfig.get("mcp_chip_select"))
-
-        # Set up the SPI Bus, The chip select, and the MCP
-        spi = busio.SPI(clock=board.SCK, MISO=board.MISO, MOSI=board.MOSI)
-        cs = digitalio.DigitalInOut(CHIP_SELECT_PIN)
-        mcp = MCP.MCP3008(spi, cs)
-        return mcp
+        chipSelect = rpgConfig.get("mcp_chip_select")
+        ConfigPlan.checkSymbol(chipSelect)
+        return Sensor.McpChip(chipSelect)
     except Exception as ex:
         # Handle other exceptions
         print(traceback.format_exc())
@@ -71,16 +103,10 @@ def getSensorList(rpgConfig, mcp):
             rpgConfig = RpgConfig()
 
         # Set up the sensors. Store them in the mySensors list
-        sensorList = rpgConfig.get("sensor_list" + "_" + socket.gethostname()).split(',')
-        for sensorSection in sensorList:
-            sensorName = sensorSection + "_" + socket.gethostname()
-            sensortype = rpgConfig.getSensorType(sensorName)
-
-            if sensortype == "dht":
-                mySensors.append(Sensor.DhtSensor(sensorName))
-
-            if sensortype == "photo" or sensortype == "moisture":
-                mySensors.append(Sensor.McpSensor(sensorName, mcp))
+        for sensorName in getSensorNames(rpgConfig):
+            sensor = makeSensor(rpgConfig, sensorName, mcp)
+            if sensor is not None:
+                mySensors.append(sensor)
         return mySensors
     except Exception as ex:
         # Handle other exceptions
@@ -90,18 +116,59 @@ def getSensorList(rpgConfig, mcp):
         print(ex)
 
 
+# ==================================================================================================
+# getSensorNames() - Returns the ini section names of this host's sensors, from sensor_list_<host>
+# ==================================================================================================
+def getSensorNames(rpgConfig):
+    sensorList = rpgConfig.get("sensor_list" + "_" + getHostName()).split(',')
+    return [sensorSection + "_" + getHostName() for sensorSection in sensorList]
+
+# ==================================================================================================
+# makeSensor() - Creates the Sensor object for an ini section, or None if its type isn't registered
+# in Sensor.SENSOR_TYPES
+# ==================================================================================================
+def makeSensor(rpgConfig, sensorName, mcp):
+    sensortype = rpgConfig.getSensorType(sensorName)
+    return Sensor.makeSensor(sensortype, sensorName, mcp)
+
+
 # ==================================================================================================
 # getReadings() - Given a list of Sensors, returns a list of sensor readings
+# The sensors are read at the same time on a thread pool, so one slow sensor (like the DHT, which
+# retries for many seconds) doesn't hold up the others. Each sensor has its own deadline (the 'timeout'
+# option in its ini section, or read_timeout from [General]). Sensors that fail or miss their deadline
+# still get reading objects, with a reading of None and the reason in their "error" property.
+# A long-running caller can pass in its own executor; a sensor whose last read is still running on it
+# isn't read again until that read finishes.
 # ==================================================================================================
-def getReadings(sensors):
+def getReadings(sensors, executor=None, rpgConfig=None):
     try:
+        if rpgConfig is None:
+            rpgConfig = RpgConfig()
+        defaultTimeout = rpgConfig.getfloat("read_timeout", defaultVal=30.0)
+
         # Collect the data from each sensor
         # A "reading" object has properties for:
-        #    description, sort, type, field_name, format, and reading
+        #    description, sort, type, field_name, format, reading, error, and time
         print("Collecting data...")
+        ownExecutor = executor is None
+        if ownExecutor:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(sensors), 1))
+
+        startTime = time.monotonic()
+        pending = []
         myReadings = []
         for sensor in sensors:
-            myReadings.extend(sensor.readObj())
+            if startRead(sensor, executor):
+                pending.append((sensor, startTime + sensor.getTimeout(defaultTimeout)))
+            else:
+                myReadings.extend(sensor.errorObj("busy"))
+
+        for sensor, deadline in pending:
+            myReadings.extend(collectRead(sensor, max(deadline - time.monotonic(), 0)))
+
+        if ownExecutor:
+            executor.shutdown(wait=False)
 
         # Sort readings
         myReadings.sort(key=lambda x: x["sort"], reverse=False)  
@@ -115,49 +182,130 @@ def getReadings(sensors):
         print(ex.args)
         print(ex)
 
+# ==================================================================================================
+# startRead() - Starts reading a sensor on the executor, in sensor.pendingRead. Returns False without
+# starting it if the sensor's last read is still running.
+# ==================================================================================================
+def startRead(sensor, executor):
+    if sensor.pendingRead is not None and not sensor.pendingRead.done():
+        print("!!! Previous read of " + sensor.cfg.sectionName + " is still running")
+        SENSOR_READS.inc(sensor=sensor.cfg.sectionName, result="busy")
+        return False
+    sensor.pendingRead = executor.submit(sensor.timedReadObj)
+    return True
 
-
+# ==================================================================================================
+# collectRead() - Returns the reading objects from a sensor's read, waiting up to timeout seconds for it.
+# A read that fails or isn't done in time gives reading objects with no readings and the reason as the
+# error; a timed-out read keeps running in the background.
+# ==================================================================================================
+def collectRead(sensor, timeout):
+    try:
+        sensorReadings = sensor.pendingRead.result(timeout=timeout)
+        failed = any(reading["error"] is not None for reading in sensorReadings)
+        SENSOR_READS.inc(sensor=sensor.cfg.sectionName, result="error" if failed else "ok")
+        return sensorReadings
+    except concurrent.futures.TimeoutError:
+        print("!!! Timed out reading " + sensor.cfg.sectionName)
+        SENSOR_READS.inc(sensor=sensor.cfg.sectionName, result="timeout")
+        return sensor.errorObj("timeout")
+    except Exception as ex:
+        print(traceback.format_exc())
+        print("!!! Failed to read " + sensor.cfg.sectionName)
+        SENSOR_READS.inc(sensor=sensor.cfg.sectionName, result="error")
+        return sensor.errorObj(str(ex))
 
 
 # ==================================================================================================
 # writeCSV() - Save the data to a tab-delimited file
+# The file is kept open between calls, and rows are buffered as set by the csv_* options (see Sinks.py).
+# The row is stamped with rowTime (a UTC time string), or the current time if it's None.
 # ==================================================================================================
-def writeCSV(rpgConfig, readings):
+def writeCSV(rpgConfig, readings, rowTime=None):
     try:
         # Read sensor info from the .ini file
         # That file contains the constants you can change to match your wiring
         if rpgConfig is None:
             rpgConfig = RpgConfig()
 
-        # Log directory and file path
-        RPGARDEN_LOG_DIR = rpgConfig.get("log_dir")
-        RPGARDEN_LOG_FILE = rpgConfig.get("log_file")
-
         print("Saving Data to file.")
-        # Check if the path to the log file exists, if not, create it
-        if not os.path.exists(RPGARDEN_LOG_DIR):
-            os.makedirs(RPGARDEN_LOG_DIR)
-
-        # Check if the log file exists, if not, initialize it with a header row
-        if not os.path.exists(RPGARDEN_LOG_FILE):
-            fieldNames = []
-            fieldNames.append("Time")
-            for reading in readings:
-                fieldNames.append(reading.field_name)
-            
-            with open(RPGARDEN_LOG_FILE, mode='w') as logFile:
-                logFile_writer = csv.writer(logFile, dialect=csv.excel_tab, quoting=csv.QUOTE_NONE)
-                logFile_writer.writerow(fieldNames)
-
-        # write out the values
-        fieldVals = []
-        fieldVals.append(getUTCTime())
-        for reading in readings:
-            fieldVals.append(reading["reading"])
-
-        with open(RPGARDEN_LOG_FILE, mode='a') as logFile:
-            logFile_writer = csv.writer(logFile, dialect=csv.excel_tab, quoting=csv.QUOTE_NONE)
-            logFile_writer.writerow(fieldVals)
+        import Sinks
+        # The sink creates the log directory, and writes the header row when the file is new
+        CSV_BYTES.inc(Sinks.getCsvSink(rpgConfig).write(readings, rowTime or getUTCTime()))
+    except Exception as ex:
+        # Handle other exceptions
+        print(traceback.format_exc())
+        print(type(ex))
+        print(ex.args)
+        print(ex)
+
+
+# ==================================================================================================
+# writeBinary() - Save the readings to the binary store in binary_dir, if it's set (see BinaryStore.py)
+# Unlike the CSV log, which has a row of every sensor's latest value, this gets only new readings.
+# ==================================================================================================
+def writeBinary(rpgConfig, readings):
+    try:
+        if rpgConfig is None:
+            rpgConfig = RpgConfig()
+
+        import BinaryStore
+        store = BinaryStore.getStore(rpgConfig)
+        if store is not None:
+            BINARY_BYTES.inc(store.write(readings))
+    except Exception as ex:
+        # Handle other exceptions
+        print(traceback.format_exc())
+        print(type(ex))
+        print(ex.args)
+        print(ex)
+
+
+# ==================================================================================================
+# connectSQL() - Opens a connection to the MySQL/MariaDB database named in the private config file
+# sendRows() doesn't need this: it borrows a connection from the pool in Database.py, which stays open.
+# ==================================================================================================
+def connectSQL(rpgConfig):
+    try:
+        if rpgConfig is None:
+            rpgConfig = RpgConfig()
+
+        import Database
+        return Database.connect(rpgConfig)
+    except Exception as ex:
+        # Handle other exceptions
+        print(traceback.format_exc())
+        print(type(ex))
+        print(ex.args)
+        print(ex)
+
+
+# ==================================================================================================
+# sqlRows() - Turns readings into rpgarden2 rows of (host, reading_time, sensor_name, sensor_type,
+# sensor_value), skipping readings from sensors that failed or timed out this cycle.
+# Each row gets the reading's own reading_time (aggregation windows have one), else rowTime if it's given,
+# else the time the reading was taken, with decimals digits of the second.
+# ==================================================================================================
+def sqlRows(readings, rowTime=None, decimals=0):
+    hostName = getHostName()
+    readingTime = lambda reading: (reading.get("reading_time") or rowTime or
+                                   (formatUTCTime(reading["time"], decimals) if reading.get("time") else getUTCTime()))
+    return [(hostName, readingTime(reading), reading["field_name"], reading["type"], reading["reading"])
+            for reading in readings if reading["reading"] is not None]
+
+# ==================================================================================================
+# writeSQLite() - Save the readings to the local SQLite database in sqlite_file, if it's set
+# It has the same rpgarden2 table as the MySQL/MariaDB database (see Sinks.SqliteSink).
+# ==================================================================================================
+def writeSQLite(rpgConfig, readings, rowTime=None):
+    try:
+        if rpgConfig is None:
+            rpgConfig = RpgConfig()
+
+        import Sinks
+        sink = Sinks.getSqliteSink(rpgConfig)
+        if sink is not None:
+            SQLITE_ROWS.inc(sink.write(sqlRows(readings, rowTime, rpgConfig.getint("sql_time_decimals", defaultVal=0))))
     except Exception as ex:
         # Handle other exceptions
         print(traceback.format_exc())
@@ -168,8 +316,15 @@ def writeCSV(rpgConfig, readings):
 
 # ==================================================================================================
 # writeSQL() - Save the data to a MySQL/MariaDB database
+# If an open connection is passed in as db, it is used and left open for the caller.
+# With spool_file set (and no db passed in), the rows go to the local spool instead, and are sent on
+# from there (see Spool.py and drainSpool()). Otherwise they're sent now with sendRows().
+# Rows are stamped with the time each reading was taken, or rowTime (a UTC time string) if it's given,
+# except aggregated readings, which carry their window's time (see sqlRows()). Returns True if the data
+# was saved (or spooled).
 # ==================================================================================================
-def writeSQL(rpgConfig, readings):
+def writeSQL(rpgConfig, readings, db=None, rowTime=None):
+    saved = False
     try:
         # Read sensor info from the .ini file
         # That file contains the constants you can change to match your wiring
@@ -177,28 +332,148 @@ def writeSQL(rpgConfig, readings):
             rpgConfig = RpgConfig()
 
         print("Saving data to database...")
-        # Open database connection
-        db = MySQLdb.connect(rpgConfig.private['mysql_host'], rpgConfig.private['mysql_user'], rpgConfig.private['mysql_password'], rpgConfig.private['mysql_db'])
+        print("UTC time: " + (rowTime or getUTCTime()))
+        rows = sqlRows(readings, rowTime, rpgConfig.getint("sql_time_decimals", defaultVal=0))
+
+        import Spool
+        spool = Spool.getSpool(rpgConfig) if db is None else None
+        if spool is not None:
+            spool.add(rows)
+            saved = True
+            print("%d new readings spooled for the database." % len(rows))
+        else:
+            saved = sendRows(rpgConfig, rows, db)
+    except Exception as ex:
+        # Handle other exceptions
+        print(traceback.format_exc())
+        print(type(ex))
+        print(ex.args)
+        print(ex)
+
+    return saved
+
+# ==================================================================================================
+# sendRows() - Inserts rows of (host, reading_time, sensor_name, sensor_type, sensor_value) and commits.
+# If db is None, a connection is borrowed from the pool (see Database.py) and handed back open, so the
+# next call doesn't have to connect again. The rows are sent in batches of up to sql_batch_size (default
+# 500) with executemany(), which MySQLdb turns into one multi-row INSERT per batch, and committed together.
+# With ignoreDuplicates, rows already in the table (same host, sensor and time) are skipped. Returns True
+# if the rows were saved.
+# ==================================================================================================
+def sendRows(rpgConfig, rows, db=None, ignoreDuplicates=False):
+    saved = False
+    try:
+        # Get a database connection. None means the database can't be reached right now.
+        pool = None
+        if db is None:
+            import Database
+            pool = Database.getPool(rpgConfig)
+            db = pool.acquire(timeout=rpgConfig.getfloat("db_acquire_timeout", defaultVal=10.0))
+            if db is None:
+                return saved
         cursor = db.cursor()
         sql = "INSERT INTO rpgarden2 (pk, host, reading_time, sensor_name, sensor_type, sensor_value) VALUES (NULL,  %s, %s, %s, %s, %s)"
+        if ignoreDuplicates:
+            sql = sql.replace("INSERT", "INSERT IGNORE", 1)
+            rows = skipStoredRows(cursor, rows)
 
-        strCurrentTime = getUTCTime()
-        print("UTC time: " + strCurrentTime)
+        batchSize = max(rpgConfig.getint("sql_batch_size", defaultVal=500), 1)
         try:
-            for reading in readings:
-                fieldVals = (socket.gethostname(), strCurrentTime, reading["field_name"], reading["type"], reading["reading"])
-                cursor.execute(sql, fieldVals)
-                print("Writing " + reading["description"] + " value to database")
-
-            db.commit()
-            print("New readings committed in database.")
+            startTime = time.perf_counter()
+            for first in range(0, len(rows), batchSize):
+                with SQL_INSERT_SECONDS.time():
+                    cursor.executemany(sql, rows[first:first + batchSize])
+
+            with SQL_COMMIT_SECONDS.time():
+                db.commit()
+            elapsed = time.perf_counter() - startTime
+            SQL_ROWS.inc(len(rows))
+            if rows and elapsed > 0:
+                SQL_ROWS_PER_SECOND.set(len(rows) / elapsed)
+            saved = True
+            print("%d new readings committed in database in %.1f ms (%.0f rows/s)."
+                  % (len(rows), elapsed * 1000, len(rows) / elapsed if elapsed > 0 else 0))
         except:
             print(traceback.format_exc())
-            print("!!! Failed to save MySQL data! Sensor: " + sensor.field_name)
-            db.rollback()
+            print("!!! Failed to save MySQL data! (%d rows)" % len(rows))
+            SQL_FAILURES.inc()
+            try:
+                db.rollback()
+            except Exception:
+                pass   # The connection is probably gone; the pool replaces it
+
+        # Hand the connection back. If the write failed, it's closed and the next call reconnects.
+        if pool is not None:
+            pool.release(db, broken=not saved)
+    except Exception as ex:
+        # Handle other exceptions
+        print(traceback.format_exc())
+        print(type(ex))
+        print(ex.args)
+        print(ex)
+
+    return saved
+
+# ==================================================================================================
+# hasUniqueKey() - Returns True if rpgarden2 has a unique key on (host, sensor_name, reading_time), or
+# some of those columns, so INSERT IGNORE skips a row that is already stored.
+# ==================================================================================================
+def hasUniqueKey(cursor):
+    cursor.execute("SHOW INDEX FROM rpgarden2")
+    keys = {}
+    for row in cursor.fetchall():
+        # Table, Non_unique, Key_name, Seq_in_index, Column_name, ...
+        if not int(row[1]):
+            keys.setdefault(row[2], set()).add(row[4])
+    return any(columns <= {"host", "sensor_name", "reading_time"} for columns in keys.values())
+
+uniqueKey = None    # hasUniqueKey() for the database, once it has been checked
 
-        # disconnect from server
-        db.close()
+# ==================================================================================================
+# skipStoredRows() - Returns the rows the database doesn't have yet. With the unique key in place INSERT
+# IGNORE does this, and the rows are returned as they are; without it, the stored rows in the batch's
+# time range are looked up and left out.
+# ==================================================================================================
+def skipStoredRows(cursor, rows):
+    global uniqueKey
+    if uniqueKey is None:
+        uniqueKey = hasUniqueKey(cursor)
+        if not uniqueKey:
+            print("!!! rpgarden2 has no unique key on (host, sensor_name, reading_time); spooled rows are checked "
+                  "against the table before they are sent. See Spool.py to add the key.")
+    if uniqueKey or not rows:
+        return rows
+
+    # Times are compared as text to the microsecond, whether the database returns text or datetimes
+    def timeKey(value):
+        if hasattr(value, "strftime"):
+            return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+        seconds, point, fraction = str(value).partition(".")
+        return seconds + "." + (fraction + "000000")[:6]
+
+    times = [timeKey(row[1]) for row in rows]
+    end = datetime.datetime.strptime(max(times)[:19], "%Y-%m-%d %H:%M:%S") + datetime.timedelta(seconds=1)
+    cursor.execute("SELECT host, reading_time, sensor_name FROM rpgarden2 WHERE reading_time >= %s AND reading_time < %s",
+                   (min(times)[:19], end.strftime("%Y-%m-%d %H:%M:%S")))
+    stored = set((host, timeKey(readingTime), sensorName) for host, readingTime, sensorName in cursor.fetchall())
+    return [row for row, key in zip(rows, times) if (row[0], key, row[2]) not in stored]
+
+# ==================================================================================================
+# drainSpool() - Sends the rows waiting in the spool (if spool_file is set) to the database.
+# In daemon mode (background=True) this starts the spool's drainer thread, which keeps at it.
+# Otherwise it sends what it can in up to spool_drain_time seconds (default 30) and returns.
+# ==================================================================================================
+def drainSpool(rpgConfig, background=False):
+    try:
+        import Spool
+        spool = Spool.getSpool(rpgConfig)
+        if spool is None:
+            return
+        upload = lambda rows: sendRows(rpgConfig, rows, ignoreDuplicates=True)
+        if background:
+            spool.startDrainer(upload, rpgConfig.getfloat("spool_drain_interval", defaultVal=10.0))
+        else:
+            spool.drain(upload, rpgConfig.getfloat("spool_drain_time", defaultVal=30.0))
     except Exception as ex:
         # Handle other exceptions
         print(traceback.format_exc())
@@ -206,6 +481,292 @@ def writeSQL(rpgConfig, readings):
         print(ex.args)
         print(ex)
 
+# ==================================================================================================
+# makePipeline() - Gives each sink its own queue and worker thread (see Pipeline.py), so the sinks write
+# while the next readings are taken, and a slow one doesn't hold up the others. Options in [General]:
+#    sink_queue_size      batches each sink's queue holds (default 100)
+#    sink_policy_csv, sink_policy_binary, sink_policy_sqlite, sink_policy_sql
+#                         what a sink does when its queue is full: block, drop or spill (default block)
+#    sink_spill_dir       where the spill policy puts batches (default <log_dir>/spill)
+#    sink_close_timeout   seconds to wait for the sinks to finish when stopping (default 60)
+#    csv_time_decimals    digits of the second in the CSV log's row times (default 0)
+#    sql_time_decimals    digits of the second in the databases' reading_time (default 0; up to the
+#                         column's, e.g. 3 for DATETIME(3))
+# A batch is a dict with the "time" its readings were taken (epoch seconds, the CSV row's time),
+# the "latest" reading of every sensor (for the CSV log), the "new" readings just taken (for the
+# binary store and local SQLite database) and the "sql" readings for the database (the new readings,
+# or the aggregation windows that just closed). Empty lists are skipped. Database rows get each
+# reading's own time.
+# ==================================================================================================
+def makePipeline(rpgConfig):
+    def csvSink(batch):
+        if batch["latest"]:
+            rowTime = batch["time"]
+            if not isinstance(rowTime, str):    # Batches spilled by older versions have the time as text
+                rowTime = formatUTCTime(rowTime, rpgConfig.getint("csv_time_decimals", defaultVal=0))
+            writeCSV(rpgConfig, batch["latest"], rowTime)
+
+    def binarySink(batch):
+        if batch["new"]:
+            writeBinary(rpgConfig, batch["new"])
+
+    def sqliteSink(batch):
+        if batch["new"]:
+            writeSQLite(rpgConfig, batch["new"])
+
+    def sqlSink(batch):
+        if batch["sql"]:
+            writeSQL(rpgConfig, batch["sql"])
+
+    queueSize = rpgConfig.getint("sink_queue_size", defaultVal=100)
+    spillDir = rpgConfig.get("sink_spill_dir") or os.path.join(rpgConfig.get("log_dir") or ".", "spill")
+    import Pipeline
+    pipeline = Pipeline.Pipeline()
+    for name, write in (("csv", csvSink), ("binary", binarySink), ("sqlite", sqliteSink), ("sql", sqlSink)):
+        pipeline.add(name, write, queueSize, rpgConfig.get("sink_policy_" + name, "block"), spillDir)
+    return pipeline
+
+# ==================================================================================================
+# closeModules() - Calls closeAll() of each sink module named, to close its files and connections.
+# Modules that were never imported have nothing open, so they're skipped rather than imported.
+# ==================================================================================================
+def closeModules(*moduleNames):
+    for moduleName in moduleNames:
+        module = sys.modules.get(moduleName)
+        if module is not None:
+            module.closeAll()
+
+# ==================================================================================================
+# makeBatch() - Builds a batch for the pipeline, stamped with the time of the newest of the new readings
+# (when they were read, not when the batch was made), or the current time if there are none
+# ==================================================================================================
+def makeBatch(latest=(), new=(), sql=()):
+    readTimes = [reading["time"] for reading in new if reading.get("time")]
+    return {"time": max(readTimes) if readTimes else time.time(), "latest": list(latest), "new": list(new), "sql": list(sql)}
+
+
+CONFIG_CHECK = "config"   # Scheduler item for checking the .ini files for changes
+
+# ==================================================================================================
+# scheduleInterval() - Returns how often the daemon reads a sensor (its interval option, or the default
+# interval), and tells the sensor, which keeps its read timeout and retries within it.
+# ==================================================================================================
+def scheduleInterval(sensor, interval):
+    sensor.scheduledInterval = sensor.getInterval(interval)
+    return sensor.scheduledInterval
+
+# ==================================================================================================
+# reloadSensors() - Brings the daemon's schedule up to date after the .ini files changed.
+# Sensors whose sections changed are rebuilt, sensors added to sensor_list_<host> are created and
+# sensors taken off it are dropped. The other sensors keep running untouched. A sensor with a read
+# still running isn't replaced until that read finishes; its name is returned to be retried later.
+# ==================================================================================================
+def reloadSensors(rpgConfig, scheduler, changedSections, mcp, interval, latestReadings):
+    try:
+        sensorNames = getSensorNames(rpgConfig)
+    except Exception as ex:
+        print(traceback.format_exc())
+        return set(changedSections)
+
+    retry = set()
+    sensorTasks = dict((task.name, task) for task in scheduler.tasks if task.item is not CONFIG_CHECK)
+    for sensorName, task in sensorTasks.items():
+        sensor = task.item
+        if sensorName in sensorNames and sensorName not in changedSections:
+            if "General" in changedSections:   # The default interval may have changed
+                task.interval = scheduleInterval(sensor, interval)
+            continue
+
+        if sensor.pendingRead is not None and not sensor.pendingRead.done():
+            retry.add(sensorName)
+            continue
+
+        print("Config changed. Removing " + sensorName)
+        scheduler.remove(task)
+        for reading in sensor.describeObj():
+            latestReadings.pop(reading["field_name"], None)
+        try:
+            sensor.close()
+        except Exception as ex:
+            print(traceback.format_exc())
+
+    scheduledNames = set(task.name for task in scheduler.tasks)
+    for sensorName in sensorNames:
+        if sensorName in scheduledNames:
+            continue
+        try:
+            sensor = makeSensor(rpgConfig, sensorName, mcp)
+        except Exception as ex:
+            print("!!! Couldn't set up " + sensorName)
+            print(traceback.format_exc())
+            continue
+        if sensor is not None:
+            print("Config changed. Adding " + sensorName)
+            # Start it on its own grid from now, so the time before it existed doesn't count as skipped
+            scheduler.add(sensor, scheduleInterval(sensor, interval), name=sensorName,
+                          phase=scheduler.clock() - scheduler.startTime)
+            seedReadings(latestReadings, sensor)
+    return retry
+
+# ==================================================================================================
+# seedReadings() - Adds a sensor's fields to latestReadings with no reading yet, so the CSV log has a
+# column for every scheduled sensor from its first row on, whichever reads finish first
+# ==================================================================================================
+def seedReadings(latestReadings, sensor):
+    for reading in sensor.describeObj():
+        reading["reading"] = None
+        latestReadings.setdefault(reading["field_name"], reading)
+
+# ==================================================================================================
+# completeTask() - Marks a scheduled task's run as finished and counts its overruns and skipped slots
+# ==================================================================================================
+def completeTask(scheduler, task):
+    overruns, skipped = task.overruns, task.skipped
+    scheduler.complete(task)
+    SCHEDULE_OVERRUNS.inc(task.overruns - overruns, task=task.name)
+    SCHEDULE_SKIPPED.inc(task.skipped - skipped, task=task.name)
+
+# ==================================================================================================
+# runDaemon() - Sets up the hardware, sensors and database connection once, then keeps reading
+# sensors until interrupted. Each sensor is read on its own schedule: the 'interval' option in its
+# ini section, or daemon_interval from [General] if it has none.
+# Reads run in the background: the loop starts the reads that are due and picks up the ones that
+# finished (or passed their deadline), so a slow sensor, like a DHT retrying, doesn't hold up the others.
+# Every config_check_interval seconds the .ini files are checked for edits (see reloadSensors()).
+# The readings are written by the sinks' own threads (see makePipeline()), so slow I/O doesn't delay reads.
+# With aggregate_window set, the database gets one row per sensor per window (see Aggregator.py).
+# ==================================================================================================
+def runDaemon(rpgConfig):
+    global uniqueKey
+    if rpgConfig is None:
+        rpgConfig = RpgConfig()
+
+    interval = rpgConfig.getfloat("daemon_interval", defaultVal=60.0)
+    defaultTimeout = rpgConfig.getfloat("read_timeout", defaultVal=30.0)
+    reportInterval = rpgConfig.getfloat("schedule_report_interval", defaultVal=300.0)
+    checkInterval = rpgConfig.getfloat("config_check_interval", defaultVal=30.0)
+    print("Starting daemon. Default sensor interval: %.1f seconds" % interval)
+
+    myMCP = initialize(rpgConfig)
+    mySensors = getSensorList(rpgConfig, myMCP)
+    if not mySensors:
+        print("!!! No sensors configured. Daemon is stopping.")
+        return
+
+    Metrics.startExporting(rpgConfig)
+    drainSpool(rpgConfig, background=True)
+
+    scheduler = Scheduler()
+    for sensor in mySensors:
+        scheduler.add(sensor, scheduleInterval(sensor, interval), name=sensor.cfg.sectionName)
+    if checkInterval > 0:
+        scheduler.add(CONFIG_CHECK, checkInterval, name=CONFIG_CHECK, phase=checkInterval)
+    retrySections = set()
+
+    # The CSV log has one column per sensor, so each row carries the latest value of every sensor,
+    # while the database only gets the readings that were just taken.
+    latestReadings = {}
+    for sensor in mySensors:
+        seedReadings(latestReadings, sensor)
+    aggregator = Aggregator.getAggregator(rpgConfig)
+
+    workers = len(mySensors)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    pipeline = makePipeline(rpgConfig)
+    readDeadlines = {}    # {task: deadline} for the reads still running
+    nextReport = time.monotonic() + reportInterval
+    try:
+        while True:
+            dueTasks = scheduler.waitForDue(min(readDeadlines.values()) if readDeadlines else None)
+            if dueTasks is None:
+                break
+
+            cycleStart = time.perf_counter()
+            myReadings = []
+            configDue = False
+            for task in dueTasks:
+                SCHEDULE_JITTER.observe(task.lastJitter, task=task.name)
+                if task.item is CONFIG_CHECK:
+                    configDue = True
+                    completeTask(scheduler, task)
+                elif startRead(task.item, executor):
+                    readDeadlines[task] = scheduler.clock() + task.item.getTimeout(defaultTimeout)
+                    task.item.pendingRead.add_done_callback(lambda future: scheduler.wake())
+                else:
+                    myReadings.extend(task.item.errorObj("busy"))
+                    completeTask(scheduler, task)
+
+            # Pick up the reads that finished, and give up on the ones past their deadline
+            now = scheduler.clock()
+            for task, deadline in list(readDeadlines.items()):
+                if not task.item.pendingRead.done() and now < deadline:
+                    continue
+                del readDeadlines[task]
+                if task in scheduler.tasks:    # Not dropped by a config change meanwhile
+                    myReadings.extend(collectRead(task.item, 0))
+                    completeTask(scheduler, task)
+            myReadings.sort(key=lambda x: x["sort"])
+
+            allReadings = []
+            if myReadings:
+                for reading in myReadings:
+                    if reading["reading"] is not None or reading["field_name"] not in latestReadings:
+                        latestReadings[reading["field_name"]] = reading
+                allReadings = sorted(latestReadings.values(), key=lambda x: x["sort"])
+
+            # The database gets the new readings, or the aggregation windows that just closed
+            sqlReadings = aggregator.add(myReadings or [])
+            if aggregator.window > 0:
+                AGGREGATE_WINDOWS.inc(len(sqlReadings))
+
+            # Hand the readings to the sinks: the tab-delimited CSV log, the binary store and the
+            # MySQL/MariaDB database (or the spool, which the drainer thread sends on)
+            if allReadings or sqlReadings:
+                pipeline.put(makeBatch(allReadings, myReadings or [], sqlReadings))
+            CYCLE_SECONDS.observe(time.perf_counter() - cycleStart)
+
+            # Pick up edits to the .ini files, rebuilding only the sensors they affect
+            if configDue or retrySections:
+                changedSections = RpgConfig.checkForChanges() | retrySections
+                if changedSections:
+                    print("Config changed: " + ", ".join(sorted(changedSections)))
+                    if "General" in changedSections:
+                        interval = rpgConfig.getfloat("daemon_interval", defaultVal=60.0)
+                        aggregator.setWindow(rpgConfig.getfloat("aggregate_window", defaultVal=0.0))
+                    retrySections = reloadSensors(rpgConfig, scheduler, changedSections, myMCP, interval, latestReadings)
+
+                    sensorCount = len(scheduler.tasks) - (1 if checkInterval > 0 else 0)
+                    if sensorCount > workers:
+                        executor.shutdown(wait=False)   # Reads still running on it finish on their own
+                        workers = sensorCount
+                        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+                    # New database credentials: reconnect on the next write
+                    if "Private" in changedSections:
+                        import Database
+                        Database.resetAll()
+                        uniqueKey = None    # Check the new database's table
+
+            if time.monotonic() >= nextReport:
+                print(scheduler.report())
+                nextReport += reportInterval
+    finally:
+        print(scheduler.report())
+        # Send the windows still open, so the readings in them aren't lost, and let the sinks catch up
+        try:
+            sqlReadings = aggregator.flush()
+            if sqlReadings:
+                AGGREGATE_WINDOWS.inc(len(sqlReadings))
+                pipeline.put(makeBatch(sql=sqlReadings))
+        except Exception:
+            print(traceback.format_exc())
+        pipeline.close(rpgConfig.getfloat("sink_close_timeout", defaultVal=60.0))
+        Metrics.REGISTRY.stop()
+        closeModules("Sinks", "BinaryStore")
+        RpgConfig.flush()
+        executor.shutdown(wait=False)
+        drainSpool(rpgConfig)     # One last try, so the spool is empty if the database is up
+        closeModules("Spool", "Database")
 
 
 # ==================================================================================================
@@ -213,38 +774,52 @@ def writeSQL(rpgConfig, readings):
 # ==================================================================================================
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hc", ["help", "configure"])
+        opts, args = getopt.getopt(sys.argv[1:], "hcd", ["help", "configure", "daemon"])
     except getopt.GetoptError as err:
         # print help information and exit:
         print("Unknown option provided")
-        print("usage: python3 readSensors.py [-c <sensorname>]")
-        print("   where: <sensorname> is an optional sensor to be configured")
+        printUsage()
         sys.exit(2)
 
     try:
+        # Start from the compiled config plan when the .ini file hasn't changed since it was made
+        ConfigPlan.usePlan(RpgConfig.RPGARDEN_CONFIG_FILE, getHostName())
         myRpgConfig = RpgConfig()
 
+        # Calibration updates from the sensors are written back to the .ini file at most this often
+        RpgConfig.setFlushInterval(myRpgConfig.getfloat("config_flush_interval", defaultVal=0.0))
+
         if len(sys.argv) > 1:
             for o, a in opts:
                 if o in ("-c", "configure"):
                     pass # ToDo: Add calibration code
+                elif o in ("-d", "--daemon"):
+                    runDaemon(myRpgConfig)
                 elif o in ("-h", "--help"):
-                    print("usage: python3 readSensors.py [-c <sensorname>]")
-                    print("   where: <sensorname> is an optional sensor to be configured")
+                    printUsage()
                     sys.exit()
                 else:
                     print("Unknown option")
-                    print("usage: python3 readSensors.py [-c <sensorname>]")
-                    print("   where: <sensorname> is an optional sensor to be configured")
+                    printUsage()
                     sys.exit()
         else:
+            cycleStart = time.perf_counter()
             myMCP = initialize(myRpgConfig)
             mySensors = getSensorList(myRpgConfig, myMCP)
-            myReadings = getReadings(mySensors)
-            # Write data to tab-delimited CSV
-            writeCSV(myRpgConfig, myReadings)
-            # Write data to MySQL/MariaDB Database
-            writeSQL(myRpgConfig, myReadings)
+            myReadings = getReadings(mySensors, rpgConfig=myRpgConfig) or []
+            # Write data to tab-delimited CSV, the binary store and the MySQL/MariaDB Database,
+            # all at once, and wait for them to finish
+            pipeline = makePipeline(myRpgConfig)
+            pipeline.put(makeBatch(myReadings, myReadings, myReadings))
+            pipeline.close(myRpgConfig.getfloat("sink_close_timeout", defaultVal=60.0))
+            # Send on what's in the spool, including rows left by runs when the database was down
+            drainSpool(myRpgConfig)
+            closeModules("Spool", "Database", "Sinks", "BinaryStore")
+            CYCLE_SECONDS.observe(time.perf_counter() - cycleStart)
+
+            # A one-shot run only has this run's numbers, so just leave them in the metrics file
+            if myRpgConfig.get("metrics_file"):
+                Metrics.REGISTRY.writeFile(myRpgConfig.get("metrics_file"))
     except KeyboardInterrupt:    
         pass  # Don't do anything special if user typed Ctrl-C
 
@@ -255,5 +830,10 @@ def main():
         print(ex.args)
         print(ex)
 
+def printUsage():
+    print("usage: python3 readSensors.py [-c <sensorname>] [-d]")
+    print("   where: <sensorname> is an optional sensor to be configured")
+    print("          -d, --daemon keeps running, reading sensors every daemon_interval seconds")
+
 if __name__ == "__main__":
    main()
\ No newline at end of file
@@ -0,0 +1,155 @@
+# File: replayDht.py
+# ------------------
+# Replays DHT captures saved by DHTXX(capture_file=...) through the decoders, away from the Pi.
+# Set the 'capture_file' option in a dht sensor section to start recording captures.
+#
+# For each decoder it reports throughput and the distribution of error codes. It also lists
+# every capture where a decoder's result differs from another decoder's or from the result
+# recorded when the capture was taken.
+#
+# usage: python3 replayDht.py [-n <repeats>] [-d <decoder,decoder>] [-v] <capture file> [...]
+import sys, getopt
+import gzip
+import json
+import time
+
+# Works off the Pi too: the decoders only need RPi.GPIO's constants
+import SimHardware
+SimHardware.installIfMissing()
+
+from dhtxx import DHTXX, DHTXXResult
+import dhtxx
+
+# Error code -> name, e.g. 3 -> ERR_CRC
+ERROR_NAMES = dict((getattr(DHTXXResult, name), name) for name in dir(DHTXXResult) if name.startswith("ERR_"))
+
+# ==================================================================================================
+# loadCaptures() - Reads capture records from JSON-lines files (optionally gzipped)
+# ==================================================================================================
+def loadCaptures(fileNames):
+    captures = []
+    for fileName in fileNames:
+        opener = gzip.open if fileName.endswith(".gz") else open
+        with opener(fileName, "rt") as captureFile:
+            for lineNumber, line in enumerate(captureFile, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print("Skipping unreadable capture %s:%d" % (fileName, lineNumber))
+                    continue
+                record["source"] = "%s:%d" % (fileName, lineNumber)
+                if "samples" in record:
+                    record["samples"] = [int(sample) for sample in record["samples"]]
+                captures.append(record)
+    return captures
+
+# ==================================================================================================
+# decodeCapture() - Decodes one capture record with the given DHTXX object
+# ==================================================================================================
+def decodeCapture(dht, record):
+    if "edges" in record:
+        return dht.decode_edges(record["edges"])
+    return dht.decode(record["samples"])
+
+def resultKey(errorCode, temperature, humidity):
+    return (errorCode, temperature, humidity)
+
+def describeKey(key):
+    if key[0] == DHTXXResult.ERR_NO_ERROR:
+        return "%s (%s, %s)" % (ERROR_NAMES[key[0]], key[1], key[2])
+    return ERROR_NAMES.get(key[0], str(key[0]))
+
+# ==================================================================================================
+# replay() - Decodes all captures with each decoder and prints the report. Returns the number of
+#            captures where the results disagree.
+# ==================================================================================================
+def replay(captures, decoders, repeats, verbose):
+    # One DHTXX object per (pin, type, scale, decoder); nothing here touches the GPIO
+    dhts = {}
+    def getDht(record, decoder):
+        key = (record.get("pin", 0), record.get("sensor_type", DHTXX.DHT22), record.get("scale", DHTXX.FAHRENHEIT), decoder)
+        if key not in dhts:
+            dhts[key] = DHTXX(pin=key[0], sensorType=key[1], scale=key[2], decoder=decoder)
+        return dhts[key]
+
+    results = {}
+    print("%-8s %10s %12s   %s" % ("Decoder", "us/capture", "captures/s", "Error codes"))
+    for decoder in decoders:
+        pairs = [(getDht(record, decoder), record) for record in captures]
+
+        start = time.perf_counter()
+        for i in range(repeats):
+            decoded = [decodeCapture(dht, record) for dht, record in pairs]
+        seconds = time.perf_counter() - start
+
+        results[decoder] = [resultKey(r.error_code, r.temperature, r.humidity) for r in decoded]
+        counts = {}
+        for key in results[decoder]:
+            name = ERROR_NAMES.get(key[0], str(key[0]))
+            counts[name] = counts.get(name, 0) + 1
+        perCapture = seconds / (repeats * len(captures))
+        print("%-8s %10.1f %12.0f   %s" % (decoder, perCapture * 1e6, 1.0 / perCapture,
+                                          ", ".join("%s=%d" % item for item in sorted(counts.items()))))
+
+    # Compare every decoder with the recorded result and with each other
+    differences = 0
+    for i, record in enumerate(captures):
+        recorded = resultKey(record.get("error_code"), record.get("temperature"), record.get("humidity"))
+        keys = dict((decoder, results[decoder][i]) for decoder in decoders)
+        if len(set(keys.values()) | {recorded}) > 1:
+            differences += 1
+            if verbose or differences <= 20:
+                print("%s: recorded %s; %s" % (record["source"], describeKey(recorded),
+                                               "; ".join("%s %s" % (decoder, describeKey(key)) for decoder, key in keys.items())))
+    print("Captures: %d   Differences: %d" % (len(captures), differences))
+    return differences
+
+
+def printUsage():
+    print("usage: python3 replayDht.py [-n <repeats>] [-d <decoder,decoder>] [-v] <capture file> [...]")
+    print("   where: -n is how many times to decode each capture for timing (default 10)")
+    print("          -d lists the decoders to compare (default: python, and numpy if installed)")
+    print("          -v lists every difference instead of the first 20")
+
+def main():
+    repeats = 10
+    decoders = [DHTXX.DECODER_PYTHON]
+    if dhtxx.load_numpy() is not None:
+        decoders.append(DHTXX.DECODER_NUMPY)
+    verbose = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:d:v", ["help", "repeats=", "decoders=", "verbose"])
+    except getopt.GetoptError as err:
+        print(err)
+        printUsage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o in ("-n", "--repeats"):
+            repeats = int(a)
+        elif o in ("-d", "--decoders"):
+            decoders = a.split(",")
+        elif o in ("-v", "--verbose"):
+            verbose = True
+        else:
+            printUsage()
+            sys.exit()
+
+    if not args:
+        printUsage()
+        sys.exit(2)
+
+    captures = loadCaptures(args)
+    if not captures:
+        print("No captures found")
+        sys.exit(1)
+
+    if replay(captures, decoders, repeats, verbose):
+        sys.exit(1)
+
+if __name__ == "__main__":
+   main()